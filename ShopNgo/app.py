@@ -14,39 +14,31 @@ from utils.cart_manager import init_cart_manager
 from utils.location_manager import init_location_manager
 from utils.offers_manager import init_offers_manager
 from utils.auth_manager import init_auth_manager
-from utils.analytics_manager import init_analytics_manager, init_analytics
+from utils.analytics_manager import init_analytics_manager
+from utils.index_manager import apply_migrations, report_collscans
+from utils.product_cache import init_product_cache
+from utils.tag_filter import init_tag_filter
+from utils.read_dedup import init_read_dedup
+from utils.cart_pool import init_cart_pool
+from utils.cart_registry import init_cart_registry
+from utils.reader_ingest import init_reader_ingest
+from utils.email_outbox import init_email_outbox
+from utils.session_reaper import SessionReaper, init_session_reaper
+from utils.cart_store import init_cart_store
+from utils.affinity import init_cart_affinity
+from utils.cart_events import init_cart_events
 import os
 from dotenv import load_dotenv
-from datetime import datetime
 
 load_dotenv()
 
 def end_all_active_sessions(mongo):
-    """End all active sessions and free up carts"""
+    """End all active sessions, releasing their carts and reserved stock"""
     try:
-        # Get all active sessions
-        active_sessions = mongo.db.sessions.find({"is_active": True})
-        
-        # Update all carts to available
-        cart_ids = [session["cart_id"] for session in active_sessions]
-        if cart_ids:
-            mongo.db.carts.update_many(
-                {"_id": {"$in": cart_ids}},
-                {"$set": {"is_available": True}}
-            )
-        
-        # End all active sessions
-        mongo.db.sessions.update_many(
-            {"is_active": True},
-            {
-                "$set": {
-                    "is_active": False,
-                    "ended_at": datetime.utcnow(),
-                    "ended_by": "system_shutdown"
-                }
-            }
-        )
-        print("Successfully ended all active sessions")
+        # Batched like the idle reaper, so no more than one batch is held in memory
+        reaper = SessionReaper(mongo.db, init_cart_pool(mongo.db))
+        ended, _ = reaper.reap(None, "system_shutdown")
+        print(f"Successfully ended {ended} active sessions")
     except Exception as e:
         print(f"Error ending sessions: {str(e)}")
 
@@ -65,7 +57,8 @@ def create_app():
         r"/api/*": {
             "origins": ["*"],  # In production, replace with your Flutter app's domain
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"]
+            "allow_headers": ["Content-Type", "Authorization", "X-Cart-Shard"],
+            "expose_headers": ["X-Cart-Shard"]
         }
     })
     
@@ -75,9 +68,49 @@ def create_app():
     location_manager = init_location_manager(mongo.db)
     offers_manager = init_offers_manager(mongo.db)
     analytics_manager = init_analytics_manager(mongo.db)
-    
-    # Initialize analytics indexes
-    init_analytics(mongo.db)
+
+    # Create any indexes declared since the last recorded migration, before
+    # anything below loads tags or products; data steps are left to
+    # scripts/migrate_indexes.py and startup fails while one is pending
+    apply_migrations(mongo.db, run_data_steps=False)
+    if os.getenv("INDEX_REPORT_COLLSCANS", "false").lower() == "true":
+        for collscan in report_collscans(mongo.db):
+            print(f"Warning: '{collscan['query']}' on {collscan['collection']} falls back to COLLSCAN")
+
+    # Filter of registered tags, so stray reads never reach MongoDB
+    app.tag_filter = init_tag_filter(mongo.db)
+
+    # Shared RFID tag -> product cache for the scan endpoints
+    app.product_cache = init_product_cache(mongo.db, app.tag_filter)
+
+    # Per-reader duplicate-read suppression in front of the RFID endpoints
+    app.read_dedup = init_read_dedup()
+
+    # Barcode -> cart registry for the RFID reader endpoints
+    app.cart_registry = init_cart_registry(mongo.db)
+
+    # Free-cart pool for atomic cart claims in start_session
+    app.cart_pool = init_cart_pool(mongo.db, app.cart_registry)
+
+    # Cart and product resolution shared with the reader gateway
+    app.reader_ingest = init_reader_ingest(mongo.db, app.product_cache, app.read_dedup,
+                                           app.cart_registry, app.cart_pool)
+
+    # Which shard of the carts this worker owns (see utils/affinity.py)
+    app.cart_affinity = init_cart_affinity()
+
+    # Live cart state for the scan endpoints (MongoDB, or in memory with write-behind)
+    app.cart_store = init_cart_store(mongo.db, app.cart_affinity.shard_index)
+
+    # Push channel for cart changes (/api/cart/stream)
+    app.cart_events = init_cart_events()
+
+    # Persistent outbox for OTP emails, sent by background workers
+    app.email_outbox = init_email_outbox(mongo.db)
+
+    # End abandoned sessions so their carts and reserved stock go back into use,
+    # and tell the cart store, so it stops serving them from memory
+    app.session_reaper = init_session_reaper(mongo.db, app.cart_pool, app.cart_store.forget)
 
     # Register blueprints with API prefix
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -1,11 +1,60 @@
 from flask import Blueprint, request, jsonify, current_app
 from bson import ObjectId
 from utils.jwt_utils import jwt_required
+from utils.scan_engine import session_items
+from utils.pagination import keyset_page, page_size, order_projection, serialize_order, KEYSET_SORT
+from utils.streaming import wants_ndjson, ndjson_response
+from utils.uid_codec import encode_uid, try_encode_uid, decode_uid, decode_items
+from utils.tag_registry import register_tags, unregister_tags
+from utils.sales_rollups import window_rollups, sum_rollups, hour_histogram
 from datetime import datetime, timedelta
 from collections import Counter
 
 admin_bp = Blueprint("admin", __name__)
 
+# Upper bound on tags registered or removed in one request
+MAX_TAGS_PER_REQUEST = 5000
+
+
+def serialize_product(product):
+    product["_id"] = str(product["_id"])
+    if "rfid_tag" in product:
+        product["rfid_tag"] = decode_uid(product["rfid_tag"])
+    # Internal stock-write markers, not product data
+    product.pop("recent_ops", None)
+    return product
+
+
+def serialize_session(session):
+    session["_id"] = str(session["_id"])
+    session["cart_id"] = str(session["cart_id"])
+    session["items"] = decode_items(session_items(session))
+    session["started_at"] = session["started_at"].isoformat() if "started_at" in session else None
+    session["updated_at"] = session["updated_at"].isoformat() if "updated_at" in session else None
+    return session
+
+
+def register_product_tags(product_id, rfid_tags, add_stock=False):
+    """Register rfid_tags to a SKU and make them visible to scans in this process"""
+    registered, duplicates, invalid = register_tags(current_app.mongo.db, ObjectId(product_id), rfid_tags, add_stock)
+    for code in registered:
+        current_app.product_cache.invalidate(rfid_tag=code)
+    if current_app.tag_filter and registered:
+        current_app.tag_filter.register(registered)
+    if add_stock and registered:
+        current_app.product_cache.invalidate(product_id=product_id)
+    return registered, duplicates, invalid
+
+
+def request_tags(data):
+    """The tags of a request, given as rfid_tags (a list) and/or rfid_tag; raises ValueError"""
+    rfid_tags = list(data.get("rfid_tags") or [])
+    if data.get("rfid_tag"):
+        rfid_tags.append(data["rfid_tag"])
+    if len(rfid_tags) > MAX_TAGS_PER_REQUEST:
+        raise ValueError(f"At most {MAX_TAGS_PER_REQUEST} RFID tags per request")
+    return [encode_uid(rfid_tag) for rfid_tag in rfid_tags]
+
 
 @admin_bp.route("/add_product", methods=["POST"])
 @jwt_required
@@ -17,17 +66,21 @@ def add_product():
     data = request.get_json()
     mongo = current_app.mongo
 
-    # Validate required fields for product
-    required_fields = ["name", "price", "category", "rfid_tag", "stock_quantity"]
+    # Validate required fields for product; tags are optional and can be registered later
+    required_fields = ["name", "price", "category", "stock_quantity"]
     if not all(field in data for field in required_fields):
         return jsonify({"error": "Missing required fields", "required": required_fields}), 400
+    try:
+        rfid_tags = request_tags(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # Create product object
+    # Create the SKU; its tags live in the tag registry
     product = {
         "name": data["name"],
         "price": data["price"],
         "category": data["category"],
-        "rfid_tag": data["rfid_tag"],
+        "flavor": data.get("flavor"),
         "stock_quantity": data["stock_quantity"],
         "description": data.get("description", ""),
         "location": data.get("location", ""),
@@ -37,17 +90,19 @@ def add_product():
         "store_id": data.get("store_id")
     }
 
-    # Check if product with same RFID already exists
-    existing_product = mongo.db.products.find_one({"rfid_tag": data["rfid_tag"]})
-    if existing_product:
+    # Check if any of the RFID tags is already registered
+    if rfid_tags and mongo.db.tags.find_one({"_id": {"$in": rfid_tags}}, {"_id": 1}):
         return jsonify({"error": "Product with this RFID tag already exists"}), 409
 
     # Insert the product
     result = mongo.db.products.insert_one(product)
+    registered, duplicates, _ = register_product_tags(result.inserted_id, rfid_tags)
 
     return jsonify({
         "message": "Product added successfully",
-        "product_id": str(result.inserted_id)
+        "product_id": str(result.inserted_id),
+        "registered_tags": len(registered),
+        "duplicate_tags": [decode_uid(code) for code in duplicates]
     }), 201
 
 
@@ -66,17 +121,28 @@ def update_product():
     data = request.get_json()
     mongo = current_app.mongo
 
-    # Update the product
+    # Update the product; a new rfid_tag is registered to it rather than stored on it
     try:
-        result = mongo.db.products.update_one(
-            {"_id": ObjectId(product_id)},
-            {"$set": data}
-        )
-
-        if result.matched_count == 0:
+        rfid_tags = request_tags({"rfid_tag": data.pop("rfid_tag", None)})
+        owner = mongo.db.tags.find_one({"_id": rfid_tags[0]}) if rfid_tags else None
+        if owner and str(owner["product_id"]) != product_id:
+            return jsonify({"error": "RFID tag is registered to another product"}), 409
+        if data:
+            matched = mongo.db.products.update_one(
+                {"_id": ObjectId(product_id)},
+                {"$set": data}
+            ).matched_count
+        else:
+            matched = mongo.db.products.count_documents({"_id": ObjectId(product_id)}, limit=1)
+
+        if matched == 0:
             return jsonify({"error": "Product not found"}), 404
 
+        current_app.product_cache.invalidate(product_id=product_id)
+        register_product_tags(product_id, rfid_tags)
         return jsonify({"message": "Product updated successfully"}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -102,11 +168,77 @@ def delete_product():
         if result.deleted_count == 0:
             return jsonify({"error": "Product not found"}), 404
 
+        # Its tags no longer resolve; cached tag entries fail to find the SKU
+        mongo.db.tags.delete_many({"product_id": ObjectId(product_id)})
+        current_app.product_cache.invalidate(product_id=product_id)
+
         return jsonify({"message": "Product deleted successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@admin_bp.route("/products/<product_id>/tags", methods=["GET"])
+@jwt_required
+def get_product_tags(product_id):
+    if request.user.get("role") != "admin":
+        return jsonify({"error": "Admin access required"}), 403
+    if not ObjectId.is_valid(product_id):
+        return jsonify({"error": "Invalid product ID"}), 400
+    tags = current_app.mongo.db.tags.find({"product_id": ObjectId(product_id)}, {"_id": 1, "registered_at": 1})
+    return jsonify({"rfid_tags": [
+        {"rfid_tag": decode_uid(tag["_id"]), "registered_at": tag["registered_at"].isoformat()}
+        for tag in tags
+    ]}), 200
+
+
+@admin_bp.route("/products/<product_id>/tags", methods=["POST"])
+@jwt_required
+def add_product_tags(product_id):
+    """Register a batch of RFID tags to a SKU; with add_stock each new tag is a unit in stock"""
+    if request.user.get("role") != "admin":
+        return jsonify({"error": "Admin access required"}), 403
+    data = request.get_json() or {}
+    if not ObjectId.is_valid(product_id):
+        return jsonify({"error": "Invalid product ID"}), 400
+    if not isinstance(data.get("rfid_tags"), list) or not data["rfid_tags"]:
+        return jsonify({"error": "A list of RFID tags is required"}), 400
+    if len(data["rfid_tags"]) > MAX_TAGS_PER_REQUEST:
+        return jsonify({"error": f"At most {MAX_TAGS_PER_REQUEST} RFID tags per request"}), 400
+    if not current_app.mongo.db.products.count_documents({"_id": ObjectId(product_id)}, limit=1):
+        return jsonify({"error": "Product not found"}), 404
+
+    try:
+        registered, duplicates, invalid = register_product_tags(product_id, data["rfid_tags"],
+                                                                bool(data.get("add_stock")))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({
+        "message": f"{len(registered)} of {len(data['rfid_tags'])} tags registered",
+        "registered": len(registered),
+        "duplicates": [decode_uid(code) for code in duplicates],
+        "invalid": invalid
+    }), 201
+
+
+@admin_bp.route("/products/<product_id>/tags", methods=["DELETE"])
+@jwt_required
+def remove_product_tags(product_id):
+    """Unregister tags (lost, damaged or retired); stock is adjusted separately"""
+    if request.user.get("role") != "admin":
+        return jsonify({"error": "Admin access required"}), 403
+    data = request.get_json() or {}
+    if not ObjectId.is_valid(product_id):
+        return jsonify({"error": "Invalid product ID"}), 400
+    if not isinstance(data.get("rfid_tags"), list) or not data["rfid_tags"]:
+        return jsonify({"error": "A list of RFID tags is required"}), 400
+    if len(data["rfid_tags"]) > MAX_TAGS_PER_REQUEST:
+        return jsonify({"error": f"At most {MAX_TAGS_PER_REQUEST} RFID tags per request"}), 400
+    removed = unregister_tags(current_app.mongo.db, data["rfid_tags"], ObjectId(product_id))
+    for rfid_tag in data["rfid_tags"]:
+        current_app.product_cache.invalidate(rfid_tag=try_encode_uid(rfid_tag))
+    return jsonify({"message": f"{removed} tags removed", "removed": removed}), 200
+
+
 @admin_bp.route("/inventory", methods=["GET"])
 @jwt_required
 def get_inventory():
@@ -127,16 +259,50 @@ def get_inventory():
     if category:
         query["category"] = category
 
-    # Get products
-    products = list(mongo.db.products.find(query))
+    # Stream the export instead of building the whole list in memory
+    if wants_ndjson(request):
+        return ndjson_response(mongo.db.products.find(query), serialize_product)
 
-    # Convert ObjectId to string for JSON serialization
-    for product in products:
-        product["_id"] = str(product["_id"])
+    # Get products
+    products = [serialize_product(product) for product in mongo.db.products.find(query)]
 
     return jsonify({"products": products}), 200
 
 
+@admin_bp.route("/cache/products", methods=["GET"])
+@jwt_required
+def get_product_cache_stats():
+    if request.user.get("role") != "admin":
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify({"product_cache": current_app.product_cache.stats()}), 200
+
+
+@admin_bp.route("/tag_filter", methods=["GET"])
+@jwt_required
+def get_tag_filter_stats():
+    if request.user.get("role") != "admin":
+        return jsonify({"error": "Admin access required"}), 403
+    if not current_app.tag_filter:
+        return jsonify({"tag_filter": {"enabled": False}}), 200
+    return jsonify({"tag_filter": current_app.tag_filter.stats()}), 200
+
+
+@admin_bp.route("/sessions/reaper", methods=["GET"])
+@jwt_required
+def get_session_reaper_stats():
+    if request.user.get("role") != "admin":
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify({"session_reaper": current_app.session_reaper.stats()}), 200
+
+
+@admin_bp.route("/cart_store", methods=["GET"])
+@jwt_required
+def get_cart_store_stats():
+    if request.user.get("role") != "admin":
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify({"cart_store": current_app.cart_store.stats()}), 200
+
+
 # --- ADMIN ANALYTICS ENDPOINTS ---
 
 @admin_bp.route("/active_carts", methods=["GET"])
@@ -146,12 +312,9 @@ def get_active_carts():
         return jsonify({"error": "Admin access required"}), 403
     mongo = current_app.mongo
     # Find all active sessions (carts in use)
-    active_sessions = list(mongo.db.sessions.find({"is_active": True}))
-    for session in active_sessions:
-        session["_id"] = str(session["_id"])
-        session["cart_id"] = str(session["cart_id"])
-        session["started_at"] = session["started_at"].isoformat() if "started_at" in session else None
-        session["updated_at"] = session["updated_at"].isoformat() if "updated_at" in session else None
+    if wants_ndjson(request):
+        return ndjson_response(mongo.db.sessions.find({"is_active": True}), serialize_session)
+    active_sessions = [serialize_session(session) for session in mongo.db.sessions.find({"is_active": True})]
     return jsonify({"active_carts": active_sessions, "count": len(active_sessions)})
 
 @admin_bp.route("/orders", methods=["GET"])
@@ -160,13 +323,29 @@ def get_all_orders():
     if request.user.get("role") != "admin":
         return jsonify({"error": "Admin access required"}), 403
     mongo = current_app.mongo
-    orders = list(mongo.db.orders.find({}, sort=[("created_at", -1)]))
-    for order in orders:
-        order["_id"] = str(order["_id"])
-        order["created_at"] = order["created_at"].isoformat() if "created_at" in order else None
-        if "card_number" in order:
-            order["card_number"] = "****" + order["card_number"][-4:]
-    return jsonify({"orders": orders, "count": len(orders)})
+    # Optional filter, served by the by_user_keyset index
+    query = {}
+    if request.args.get("user_email"):
+        query["user_email"] = request.args["user_email"]
+    # Full export for BI pulls: every matching order, streamed in keyset order
+    if wants_ndjson(request):
+        cursor = mongo.db.orders.find(query, order_projection(request.args.get("include"))).sort(KEYSET_SORT)
+        return ndjson_response(cursor, serialize_order)
+    try:
+        orders, next_cursor = keyset_page(
+            mongo.db.orders,
+            query,
+            cursor=request.args.get("cursor"),
+            limit=page_size(request.args.get("limit")),
+            projection=order_projection(request.args.get("include"))
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "orders": [serialize_order(order) for order in orders],
+        "count": len(orders),
+        "next_cursor": next_cursor
+    })
 
 @admin_bp.route("/analytics/peak_hours", methods=["GET"])
 @jwt_required
@@ -177,11 +356,10 @@ def get_peak_hours():
     days = int(request.args.get("days", 30))
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=days)
-    orders = list(mongo.db.orders.find({"created_at": {"$gte": start_date, "$lte": end_date}}))
-    hours = [order["created_at"].hour for order in orders if "created_at" in order]
-    hour_counts = Counter(hours)
+    # Read from the hourly and daily sales rollups rather than every order in the window
+    hour_counts = hour_histogram(window_rollups(mongo.db, start_date, end_date))
     peak_hours = hour_counts.most_common(5)
-    return jsonify({"peak_hours": peak_hours, "total_orders": len(orders)})
+    return jsonify({"peak_hours": peak_hours, "total_orders": sum(hour_counts.values())})
 
 @admin_bp.route("/analytics/trending_products", methods=["GET"])
 @jwt_required
@@ -250,11 +428,10 @@ def get_sales_analytics():
     days = int(request.args.get("days", 30))
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=days)
-    orders = list(mongo.db.orders.find({"created_at": {"$gte": start_date, "$lte": end_date}}))
-    total_sales = sum(order.get("total_amount", 0) for order in orders)
-    total_products = sum(item.get("quantity", 1) for order in orders for item in order.get("items", []))
+    # Read from the hourly and daily sales rollups rather than every order in the window
+    totals = sum_rollups(window_rollups(mongo.db, start_date, end_date), request.args.get("store_id"))
     return jsonify({
-        "total_sales": total_sales,
-        "total_products_sold": total_products,
-        "order_count": len(orders)
+        "total_sales": totals["revenue"],
+        "total_products_sold": totals["units"],
+        "order_count": totals["order_count"]
     })
@@ -1,114 +1,93 @@
-from flask import Blueprint, request, jsonify, current_app, render_template
+from flask import Blueprint, request, jsonify, current_app, render_template, Response, stream_with_context
 from utils.jwt_utils import jwt_required
+from utils.scan_engine import session_items, MAX_BATCH_TAGS
+from utils.stock_manager import reserve, reserve_many, release, commit_reservations, restock
+from utils.session_reaper import end_session as end_active_session
+from utils.affinity import cart_affinity, SHARD_HEADER
+from utils.cart_events import cart_delta, format_event
+from utils.session_view import session_view, session_etag
+from utils.pagination import keyset_page, page_size, order_projection, serialize_order
+from utils.uid_codec import encode_uid, try_encode_uid, decode_items
+from utils.sales_rollups import record_order, PENDING
 # from utils.payment_verification import PaymentVerification
 from bson import ObjectId
 from datetime import datetime, timedelta
 import random
 import string
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import queue
+import os
 
 
 cart_bp = Blueprint("cart", __name__)
 
-# Email configuration
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
-SENDER_EMAIL = "nzezo7251@gmail.com"
-SENDER_PASSWORD = "egzi jrel vctk ccpv"
 
 
-
-def end_user_session(user_email):
-    """End a user's active session and free up the cart"""
+def end_user_session(user_email, release_stock=True):
+    """End a user's active session, release its reserved stock and free up the cart"""
     mongo = current_app.mongo
-    session = mongo.db.sessions.find_one({
-        "user_email": user_email,
-        "is_active": True
-    })
-    
+    cart_store = current_app.cart_store
+    # Write back any cart changes still held in memory so the right units are released
+    cart_store.flush(user_email)
+    session = end_active_session(mongo.db, current_app.cart_pool, {"user_email": user_email}, release_stock=release_stock)
+    cart_store.evict(user_email)
     if session:
-        # Free up the cart
-        mongo.db.carts.update_one(
-            {"_id": session["cart_id"]},
-            {"$set": {"is_available": True}}
-        )
-        # End the session
-        mongo.db.sessions.update_one(
-            {"_id": session["_id"]},
-            {"$set": {"is_active": False, "ended_at": datetime.utcnow()}}
-        )
+        current_app.cart_events.publish(session["_id"], "session_ended", {})
+    return session
+
+def publish_cart_change(session, product_ids):
+    """Push the delta of a cart mutation to the session's stream subscribers"""
+    if product_ids:
+        current_app.cart_events.publish(session["_id"], "cart_updated", cart_delta(session, product_ids),
+                                        session["version"])
 
 def generate_otp():
     """Generate a 6-digit OTP"""
     return ''.join(random.choices(string.digits, k=6))
 
 def send_otp_email(email, otp):
-    """Send OTP via email using Gmail SMTP"""
-    try:
-        print(f"Attempting to send OTP to email: {email}")  # Debug log
-        
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = SENDER_EMAIL
-        msg['To'] = email
-        msg['Subject'] = "Your Shop N Go Checkout OTP"
-
-        # Email body
-        body = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif; padding: 20px;">
-                <h2 style="color: #333;">Your Checkout OTP</h2>
-                <p>Your OTP for completing your purchase is:</p>
-                <h1 style="color: #4CAF50; font-size: 32px; letter-spacing: 5px;">{otp}</h1>
-                <p>This OTP will expire in 5 minutes.</p>
-                <p>If you didn't request this OTP, please ignore this email.</p>
-                <hr>
-                <p style="color: #666; font-size: 12px;">This is an automated message, please do not reply.</p>
-            </body>
-        </html>
-        """
-        msg.attach(MIMEText(body, 'html'))
-
-        print(f"Connecting to SMTP server: {SMTP_SERVER}:{SMTP_PORT}")  # Debug log
-        
-        # Connect to SMTP server and send email
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            print("Starting TLS connection...")  # Debug log
-            server.starttls()
-            print("Logging in to SMTP server...")  # Debug log
-            server.login(SENDER_EMAIL, SENDER_PASSWORD)
-            print("Sending email...")  # Debug log
-            server.send_message(msg)
-            print("Email sent successfully!")  # Debug log
-        
-        return True
-    except Exception as e:
-        print(f"Error sending email: {str(e)}")  # Debug log
-        return False
+    """Queue the checkout OTP email; returns the outbox message id"""
+    # Email body
+    body = f"""
+    <html>
+        <body style="font-family: Arial, sans-serif; padding: 20px;">
+            <h2 style="color: #333;">Your Checkout OTP</h2>
+            <p>Your OTP for completing your purchase is:</p>
+            <h1 style="color: #4CAF50; font-size: 32px; letter-spacing: 5px;">{otp}</h1>
+            <p>This OTP will expire in 5 minutes.</p>
+            <p>If you didn't request this OTP, please ignore this email.</p>
+            <hr>
+            <p style="color: #666; font-size: 12px;">This is an automated message, please do not reply.</p>
+        </body>
+    </html>
+    """
+    # The background sender delivers it over a pooled SMTP connection
+    return current_app.email_outbox.enqueue(email, "Your Shop N Go Checkout OTP", body, kind="checkout_otp")
 
 @cart_bp.route("/start_session", methods=["POST"])
 @jwt_required
+@cart_affinity
 def start_session():
     """Start a new shopping session with a physical cart"""
     try:
         mongo = current_app.mongo
+        cart_pool = current_app.cart_pool
         user_email = request.user.get("email")
         data = request.get_json()
         
-        if not data or "cart_barcode" not in data:
+        if not data or ("cart_barcode" not in data and not data.get("auto_assign")):
             return jsonify({"error": "Cart barcode is required"}), 400
 
         # End any existing active session for this user
         end_user_session(user_email)
-        
-        # Find the cart by barcode
-        cart = mongo.db.carts.find_one({
-            "barcode": data["cart_barcode"],
-            "is_available": True
-        })
-        
+
+        # Claim the cart in a single conditional write so two shoppers
+        # scanning the same barcode cannot both win
+        session_id = ObjectId()
+        if "cart_barcode" in data:
+            cart = cart_pool.claim_by_barcode(data["cart_barcode"], session_id)
+        else:
+            cart = cart_pool.claim_any(session_id)
+
         if not cart:
             return jsonify({
                 "error": "Cart not found or is currently in use",
@@ -117,35 +96,42 @@ def start_session():
 
         # Create new session
         session = {
+            "_id": session_id,
             "user_email": user_email,
             "cart_id": cart["_id"],
-            "items": [],
+            "cart_number": cart["cart_number"],
+            "store_id": str(cart["store_id"]) if cart.get("store_id") else None,
+            "items": {},
+            "item_count": 0,
+            "version": 0,
             "total_amount": 0,
             "is_active": True,
             "started_at": datetime.utcnow(),
             "updated_at": datetime.utcnow()
         }
-        
-        # Mark cart as unavailable
-        mongo.db.carts.update_one(
-            {"_id": cart["_id"]},
-            {"$set": {"is_available": False}}
-        )
-        
-        # Insert session
-        result = mongo.db.sessions.insert_one(session)
-        
+
+        try:
+            mongo.db.sessions.insert_one(session)
+        except Exception:
+            # Hand the cart back if the session could not be created
+            cart_pool.release(cart["_id"])
+            raise
+
+        # Tell the client which worker owns this cart; it echoes the shard on later requests
+        shard = current_app.cart_affinity.shard_for(user_email)
         return jsonify({
             "message": "Shopping session started",
-            "session_id": str(result.inserted_id),
-            "cart_number": cart["cart_number"]
-        }), 201
+            "session_id": str(session_id),
+            "cart_number": cart["cart_number"],
+            "shard": shard
+        }), 201, {SHARD_HEADER: str(shard)}
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @cart_bp.route("/end_session", methods=["POST"])
 @jwt_required
+@cart_affinity
 def end_session():
     """End the current shopping session"""
     try:
@@ -164,6 +150,7 @@ def end_session():
 
 @cart_bp.route("/scan", methods=["POST"])
 @jwt_required
+@cart_affinity
 def scan_product():
     """Add a product to cart using RFID scan"""
     try:
@@ -173,66 +160,116 @@ def scan_product():
         
         if not data.get("rfid_tag"):
             return jsonify({"error": "RFID tag is required"}), 400
-        
-        # Get active session
-        session = mongo.db.sessions.find_one({
-            "user_email": user_email,
-            "is_active": True
-        })
-        if not session:
-            return jsonify({"error": "No active shopping session. Please start a session first"}), 400
+        try:
+            rfid_tag = encode_uid(data["rfid_tag"])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         # Find product by RFID tag
-        product = mongo.db.products.find_one({"rfid_tag": data["rfid_tag"]})
+        product = current_app.product_cache.get_by_tag(rfid_tag)
         if not product:
             return jsonify({"error": "Product not found"}), 404
 
-        # Check if product is in stock
-        if product.get("stock_quantity", 0) <= 0:
+        # Reserve the unit before it goes in the cart
+        if not reserve(mongo.db, product["_id"]):
             return jsonify({"error": f"Product {product['name']} is out of stock"}), 400
 
-        # Check if product is already in session
-        existing_item = next(
-            (item for item in session["items"] if item["product_id"] == str(product["_id"])),
-            None
-        )
+        # Increment or push the item and update the total in one atomic write
+        session, error = current_app.cart_store.add_item(user_email, product)
+        if error:
+            release(mongo.db, [{"product_id": str(product["_id"]), "quantity": 1}])
+        if error == "no_session":
+            return jsonify({"error": "No active shopping session. Please start a session first"}), 400
+        if error == "stock_limit":
+            return jsonify({"error": f"Cannot add more {product['name']}. Only {product['stock_quantity']} available"}), 400
+        if error == "duplicate":
+            # The same physical unit read again; the cart is unchanged
+            return jsonify({
+                "message": "Product already in cart",
+                "status": "duplicate",
+                "session": {
+                    "items": decode_items(session_items(session)),
+                    "total_amount": session["total_amount"]
+                }
+            }), 200
 
-        if existing_item:
-            # Check if adding one more would exceed stock
-            if existing_item["quantity"] + 1 > product["stock_quantity"]:
-                return jsonify({"error": f"Cannot add more {product['name']}. Only {product['stock_quantity']} available"}), 400
-            # Update quantity
-            existing_item["quantity"] += 1
-            existing_item["total_price"] = existing_item["price"] * existing_item["quantity"]
-        else:
-            # Add new item
-            session["items"].append({
-                "product_id": str(product["_id"]),
-                "name": product["name"],
-                "price": product["price"],
-                "quantity": 1,
-                "total_price": product["price"],
-                "rfid_tag": product["rfid_tag"],
-                "scanned_at": datetime.utcnow()
-            })
-        
-        # Update session total
-        session["total_amount"] = sum(item["total_price"] for item in session["items"])
-        
-        # Update session in database
-        mongo.db.sessions.update_one(
-            {"_id": session["_id"]},
-            {"$set": {
-                "items": session["items"],
-                "total_amount": session["total_amount"],
-                "updated_at": datetime.utcnow()
-            }}
-        )
-        
+        publish_cart_change(session, [str(product["_id"])])
         return jsonify({
             "message": "Product scanned successfully",
+            "status": "added",
             "session": {
-                "items": session["items"],
+                "items": decode_items(session_items(session)),
+                "total_amount": session["total_amount"]
+            }
+        }), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@cart_bp.route("/scan_batch", methods=["POST"])
+@jwt_required
+@cart_affinity
+def scan_batch():
+    """Add every product read in one RFID anti-collision cycle to the cart"""
+    try:
+        data = request.get_json()
+        mongo = current_app.mongo
+        user_email = request.user.get("email")
+
+        rfid_tags = data.get("rfid_tags") if data else None
+        if not rfid_tags or not isinstance(rfid_tags, list):
+            return jsonify({"error": "A list of RFID tags is required"}), 400
+        if len(rfid_tags) > MAX_BATCH_TAGS:
+            return jsonify({"error": f"At most {MAX_BATCH_TAGS} RFID tags per batch"}), 400
+
+        # Resolve every tag with at most one $in query; malformed tags resolve to nothing
+        codes = [try_encode_uid(rfid_tag) for rfid_tag in rfid_tags]
+        products = current_app.product_cache.get_many_by_tag({code for code in codes if code is not None})
+
+        results = []
+        candidates = []
+        seen = set()
+        for rfid_tag, code in zip(rfid_tags, codes):
+            product = products.get(code)
+            if code is not None and code in seen:
+                status = "duplicate"
+            elif not product:
+                status = "unknown"
+            else:
+                status = "added"
+                candidates.append(product)
+            seen.add(code)
+            results.append({"rfid_tag": rfid_tag, "status": status})
+
+        # Reserve one unit per candidate tag in one bulk write
+        reserved = reserve_many(mongo.db, [product["_id"] for product in candidates], ObjectId())
+        to_add = [product for product in candidates if str(product["_id"]) in reserved]
+
+        # Apply all additions in one atomic session update
+        session, added, error = current_app.cart_store.add_items(user_email, to_add)
+
+        # Give back the units of products that did not make it into the cart
+        unused = [product for product in to_add if error or product["rfid_tag"] not in added]
+        release(mongo.db, [{"product_id": str(product["_id"]), "quantity": 1} for product in unused])
+        if error == "no_session":
+            return jsonify({"error": "No active shopping session. Please start a session first"}), 400
+
+        for result, code in zip(results, codes):
+            if result["status"] != "added":
+                continue
+            product = products[code]
+            if str(product["_id"]) not in reserved:
+                result["status"] = "out_of_stock"
+            elif code not in added:
+                # Tags already in the cart were not counted again
+                result["status"] = "duplicate"
+
+        publish_cart_change(session, list({str(product["_id"]) for product in to_add if product["rfid_tag"] in added}))
+        return jsonify({
+            "message": f"{len(added)} of {len(rfid_tags)} tags added to cart",
+            "results": results,
+            "session": {
+                "items": decode_items(session_items(session)),
                 "total_amount": session["total_amount"]
             }
         }), 200
@@ -242,41 +279,118 @@ def scan_product():
 
 @cart_bp.route("/get", methods=["GET"])
 @jwt_required
+@cart_affinity
 def get_session():
     """Get current shopping session for authenticated user"""
     try:
         mongo = current_app.mongo
+        cart_store = current_app.cart_store
         user_email = request.user.get("email")
-        
+
+        # Revalidation only needs the version: one small indexed read, no body
+        if request.if_none_match:
+            current = cart_store.get_version(user_email)
+            if current and request.if_none_match.contains(session_etag(*current)):
+                shard = current_app.cart_affinity.shard_for(user_email)
+                response = current_app.response_class(status=304)
+                response.set_etag(session_etag(*current))
+                response.headers[SHARD_HEADER] = str(shard)
+                return response
+
         # Get active session
-        session = mongo.db.sessions.find_one({
-            "user_email": user_email,
-            "is_active": True
-        })
+        session = cart_store.get_active(user_email)
         
         if not session:
             return jsonify({
                 "message": "No active shopping session",
                 "session": {"items": [], "total_amount": 0}
             }), 200
-        
-        # Get cart details
-        cart = mongo.db.carts.find_one({"_id": session["cart_id"]})
-        
-        return jsonify({
-            "session": {
-                "session_id": str(session["_id"]),
-                "cart_number": cart["cart_number"],
-                "items": session["items"],
-                "total_amount": session["total_amount"]
-            }
-        }), 200
+
+        view = session_view(session)
+        if view["cart_number"] is None:
+            # Session started before cart_number was copied onto it
+            view["cart_number"] = mongo.db.carts.find_one({"_id": session["cart_id"]}, {"cart_number": 1})["cart_number"]
+        view["shard"] = current_app.cart_affinity.shard_for(user_email)
+
+        response = jsonify({"session": view})
+        response.set_etag(session_etag(session["_id"], view["version"]))
+        response.headers[SHARD_HEADER] = str(view["shard"])
+        return response, 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@cart_bp.route("/stream", methods=["GET"])
+@jwt_required
+@cart_affinity
+def stream_session():
+    """Push cart changes as server-sent events instead of polling /get"""
+    mongo = current_app.mongo
+    cart_events = current_app.cart_events
+    user_email = request.user.get("email")
+
+    current = current_app.cart_store.get_version(user_email)
+    if not current:
+        return jsonify({"error": "No active shopping session"}), 400
+    session_id = current[0]
+
+    # EventSource sends Last-Event-ID on reconnect; other clients may pass ?last_event_id=
+    last_version = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_version = int(last_version) if last_version else None
+    except ValueError:
+        last_version = None
+    # Subscribe before reading the cart, so no change lands between the snapshot and the stream
+    subscriber, missed = cart_events.subscribe(session_id, last_version)
+    session = current_app.cart_store.get_active(user_email) if missed is None else None
+    if missed is None and (not session or session["_id"] != session_id):
+        cart_events.unsubscribe(session_id, subscriber)
+        return jsonify({"error": "No active shopping session"}), 400
+    heartbeat = int(os.getenv("CART_STREAM_HEARTBEAT_SECONDS", 15))
+
+    def generate():
+        last_id = last_version
+        try:
+            if missed is None:
+                # Too far behind (or first connect): start from the full cart
+                last_id = session.get("version", 0)
+                yield format_event({"id": last_id, "event": "snapshot", "data": current_app.json.dumps({
+                    "version": last_id,
+                    "session_id": str(session_id),
+                    "items": decode_items(session_items(session)),
+                    "item_count": session.get("item_count", 0),
+                    "total_amount": session["total_amount"]
+                })})
+            for event in missed or []:
+                last_id = event["id"]
+                yield format_event(event)
+            # Changes queued while the snapshot was read may already be in it
+            skip_through = last_id
+            while True:
+                try:
+                    event = subscriber.get(timeout=heartbeat)
+                except queue.Empty:
+                    # Sessions ended by the idle reaper publish nothing; notice on a heartbeat
+                    if not mongo.db.sessions.find_one({"_id": session_id, "is_active": True}, {"_id": 1}):
+                        yield format_event({"id": last_id, "event": "session_ended", "data": "{}"})
+                        return
+                    yield ": heartbeat\n\n"
+                    continue
+                if event["id"] <= skip_through and event["event"] == "cart_updated":
+                    continue
+                last_id = event["id"]
+                yield format_event(event)
+                if event["event"] == "session_ended":
+                    return
+        finally:
+            cart_events.unsubscribe(session_id, subscriber)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @cart_bp.route("/remove", methods=["POST"])
 @jwt_required
+@cart_affinity
 def remove_from_cart():
     """Remove a product from session"""
     try:
@@ -286,50 +400,25 @@ def remove_from_cart():
         
         if not data or "product_id" not in data:
             return jsonify({"error": "Product ID is required"}), 400
+        # The id becomes part of field paths ("items.<product_id>"), so nothing else may get through
+        if not isinstance(data["product_id"], str) or not ObjectId.is_valid(data["product_id"]):
+            return jsonify({"error": "Invalid product ID"}), 400
         
-        # Get active session
-        session = mongo.db.sessions.find_one({
-            "user_email": user_email,
-            "is_active": True
-        })
-        if not session:
+        # Decrement or drop the item and update the total in one atomic write
+        session, error = current_app.cart_store.remove_one(user_email, data["product_id"])
+        if error == "no_session":
             return jsonify({"error": "No active shopping session"}), 400
-
-        # Find the item index
-        item_index = None
-        for i, item in enumerate(session["items"]):
-            if item["product_id"] == data["product_id"]:
-                item_index = i
-                break
-
-        if item_index is None:
+        if error == "not_in_cart":
             return jsonify({"error": "Product not found in session"}), 404
 
-        # Remove only one quantity of the item
-        if session["items"][item_index]["quantity"] > 1:
-            session["items"][item_index]["quantity"] -= 1
-            session["items"][item_index]["total_price"] = session["items"][item_index]["price"] * session["items"][item_index]["quantity"]
-        else:
-            # Remove the entire item if quantity is 1
-            session["items"].pop(item_index)
+        # The unit left the cart, so its reservation goes back to the shelf
+        release(mongo.db, [{"product_id": data["product_id"], "quantity": 1}])
+        publish_cart_change(session, [data["product_id"]])
 
-        # Update session total
-        session["total_amount"] = sum(item["total_price"] for item in session["items"])
-        
-        # Update session in database
-        mongo.db.sessions.update_one(
-            {"_id": session["_id"]},
-            {"$set": {
-                "items": session["items"],
-                "total_amount": session["total_amount"],
-                "updated_at": datetime.utcnow()
-            }}
-        )
-        
         return jsonify({
             "message": "Product removed from session",
             "session": {
-                "items": session["items"],
+                "items": decode_items(session_items(session)),
                 "total_amount": session["total_amount"]
             }
         }), 200
@@ -339,12 +428,12 @@ def remove_from_cart():
 
 @cart_bp.route("/initiate-checkout", methods=["POST"])
 @jwt_required
+@cart_affinity
 def initiate_checkout():
     """Initiate checkout process and send OTP"""
     try:
         mongo = current_app.mongo
         user_email = request.user.get("email")
-        print(f"User email from JWT: {user_email}")
         
         data = request.get_json()
         
@@ -362,24 +451,14 @@ def initiate_checkout():
                 "error": "Card number required for visa payment"
             }), 400
         
-        # Get user's cart
-        cart = mongo.db.carts.find_one({"user_email": user_email})
-        if not cart or not cart.get("items"):
+        # Get the active session; every unit in it is already reserved, so
+        # there is nothing to re-check against stock here
+        session = current_app.cart_store.get_active(user_email)
+        if not session or not session.get("items"):
             return jsonify({"error": "Cart is empty"}), 400
 
-        # Check if all items are available in sufficient quantity
-        for item in cart["items"]:
-            product = mongo.db.products.find_one({"_id": ObjectId(item["product_id"])})
-            if not product:
-                return jsonify({"error": f"Product {item['name']} not found"}), 404
-            if product.get("stock_quantity", 0) < item["quantity"]:
-                return jsonify({
-                    "error": f"Insufficient quantity for {item['name']}. Available: {product.get('stock_quantity', 0)}"
-                }), 400
-
         # Generate OTP
         otp = generate_otp()
-        print(f"Generated OTP: {otp}")
         otp_expiry = datetime.utcnow() + timedelta(minutes=5)
 
         # Store OTP and payment info in database with current cart state
@@ -393,32 +472,46 @@ def initiate_checkout():
                     "payment_method": payment_method,
                     "card_number": data.get('card_number') if payment_method == 'visa' else None,
                     "verified": False,
-                    "cart_items": cart["items"].copy(),  # Store a copy of the current cart items
-                    "total_amount": cart["total_amount"]
+                    "cart_items": session_items(session),  # Store a copy of the current cart items
+                    "total_amount": session["total_amount"]
                 }
             },
             upsert=True
         )
 
-        # Send OTP via email
-        print("Attempting to send OTP email...")
-        if not send_otp_email(user_email, otp):
-            print("Failed to send OTP email")
-            return jsonify({"error": "Failed to send OTP"}), 500
+        # Queue the OTP email; delivery happens off the request thread
+        message_id = send_otp_email(user_email, otp)
 
-        print("OTP email sent successfully")
         return jsonify({
             "message": "OTP sent successfully",
             "expiry": otp_expiry.isoformat(),
-            "payment_method": payment_method
+            "payment_method": payment_method,
+            "otp_message_id": str(message_id),
+            "otp_status": "queued"
         }), 200
 
     except Exception as e:
         print(f"Error in initiate-checkout: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@cart_bp.route("/otp_status/<message_id>", methods=["GET"])
+@jwt_required
+def get_otp_status(message_id):
+    """Poll the delivery status of a queued checkout OTP email"""
+    try:
+        if not ObjectId.is_valid(message_id):
+            return jsonify({"error": "OTP message not found"}), 404
+        status = current_app.email_outbox.get_status(message_id)
+        if not status or status["to"] != request.user.get("email"):
+            return jsonify({"error": "OTP message not found"}), 404
+        return jsonify({"otp_message": status}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @cart_bp.route("/verify-checkout", methods=["POST"])
 @jwt_required
+@cart_affinity
 def verify_checkout():
     """Verify OTP and complete checkout"""
     try:
@@ -442,7 +535,8 @@ def verify_checkout():
         if stored_checkout["otp"] != data["otp"]:
             return jsonify({"error": "Invalid OTP"}), 400
 
-        # Get active session
+        # Get active session, written back first so the order matches what is in MongoDB
+        current_app.cart_store.flush(user_email)
         session = mongo.db.sessions.find_one({
             "user_email": user_email,
             "is_active": True
@@ -450,70 +544,90 @@ def verify_checkout():
         if not session or not session.get("items"):
             return jsonify({"error": "Session is empty"}), 400
 
-        # Verify quantities are still available
-        for item in session["items"]:
-            product = mongo.db.products.find_one({"_id": ObjectId(item["product_id"])})
-            if not product:
-                return jsonify({"error": f"Product {item['name']} not found"}), 404
-            if product.get("stock_quantity", 0) < item["quantity"]:
+        items = session_items(session)
+        order_id = ObjectId()
+
+        # Convert the basket's reservations into sales in one guarded bulk write
+        failures = commit_reservations(mongo.db, items, order_id)
+        for item in items:
+            current_app.product_cache.invalidate(product_id=item["product_id"])
+        if failures:
+            names = {item["product_id"]: item["name"] for item in items}
+            failure = failures[0]
+            if failure["reason"] == "not_found":
                 return jsonify({
-                    "error": f"Insufficient quantity for {item['name']}. Available: {product.get('stock_quantity', 0)}"
-                }), 400
+                    "error": f"Product {names[failure['product_id']]} not found",
+                    "failures": failures
+                }), 404
+            return jsonify({
+                "error": f"Insufficient quantity for {names[failure['product_id']]}. Available: {failure['available']}",
+                "failures": failures
+            }), 400
 
+        # Create order with payment info
+        order = {
+            "_id": order_id,
+            "user_email": user_email,
+            "items": items,
+            "item_count": session["item_count"],
+            "total_amount": session["total_amount"],
+            "payment_method": stored_checkout["payment_method"],
+            "card_number": stored_checkout.get("card_number"),
+            "store_id": session.get("store_id"),
+            "status": "completed",
+            # Cleared once record_order() has counted it into the sales rollups
+            PENDING: True,
+            "created_at": datetime.utcnow(),
+            "order_number": f"ORD-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}-{random.randint(1000, 9999)}"
+        }
+
+        order_inserted = False
+        ended_elsewhere = False
         try:
-            # Update product quantities
-            for item in session["items"]:
-                result = mongo.db.products.update_one(
-                    {"_id": ObjectId(item["product_id"])},
-                    {"$inc": {"stock_quantity": -item["quantity"]}}
-                )
-                if result.modified_count == 0:
-                    raise Exception(f"Failed to update quantity for product {item['name']}")
-
-            # Create order with payment info
-            order = {
-                "user_email": user_email,
-                "items": session["items"],
-                "total_amount": session["total_amount"],
-                "payment_method": stored_checkout["payment_method"],
-                "card_number": stored_checkout.get("card_number"),
-                "status": "completed",
-                "created_at": datetime.utcnow(),
-                "order_number": f"ORD-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}-{random.randint(1000, 9999)}"
-            }
-            
-            # Insert order
             mongo.db.orders.insert_one(order)
-            
-            # End the session and free up the cart
-            end_user_session(user_email)
-            
-            # Mark OTP as verified
-            mongo.db.checkout_otps.update_one(
-                {"_id": stored_checkout["_id"]},
-                {"$set": {"verified": True, "verified_at": datetime.utcnow()}}
-            )
-
-            return jsonify({
-                "message": "Checkout completed successfully",
-                "order": {
-                    "order_number": order["order_number"],
-                    "items": order["items"],
-                    "total_amount": order["total_amount"],
-                    "payment_method": order["payment_method"],
-                    "created_at": order["created_at"].isoformat()
-                }
-            }), 200
+            order_inserted = True
 
+            # End this very session last and free up the cart; its reservations are now sales
+            if not end_active_session(mongo.db, current_app.cart_pool, {"_id": session["_id"]}, release_stock=False):
+                ended_elsewhere = True
+                raise RuntimeError("Shopping session ended before checkout completed")
         except Exception as e:
-            # If anything fails, try to revert product quantities
-            for item in session["items"]:
-                mongo.db.products.update_one(
-                    {"_id": ObjectId(item["product_id"])},
-                    {"$inc": {"stock_quantity": item["quantity"]}}
-                )
+            # Nothing was sold: drop the order and put the stock back in one bulk write. The
+            # units stay reserved for a cart that is still active; a session ended elsewhere
+            # (reaper, new session) has had its reservations released already
+            if order_inserted:
+                mongo.db.orders.delete_one({"_id": order_id})
+            restock(mongo.db, items, order_id, reserved=not ended_elsewhere)
             raise e
 
+        current_app.cart_store.evict(user_email)
+
+        # Count the order into the hourly and daily sales rollups
+        record_order(mongo.db, order)
+
+        # Mark OTP as verified
+        mongo.db.checkout_otps.update_one(
+            {"_id": stored_checkout["_id"]},
+            {"$set": {"verified": True, "verified_at": datetime.utcnow()}}
+        )
+
+        current_app.cart_events.publish(session["_id"], "checkout_completed", {
+            "order_number": order["order_number"],
+            "total_amount": order["total_amount"]
+        })
+        current_app.cart_events.publish(session["_id"], "session_ended", {})
+
+        return jsonify({
+            "message": "Checkout completed successfully",
+            "order": {
+                "order_number": order["order_number"],
+                "items": decode_items(order["items"]),
+                "total_amount": order["total_amount"],
+                "payment_method": order["payment_method"],
+                "created_at": order["created_at"].isoformat()
+            }
+        }), 200
+
     except Exception as e:
         print(f"Error in verify-checkout: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -521,28 +635,27 @@ def verify_checkout():
 @cart_bp.route("/orders", methods=["GET"])
 @jwt_required
 def get_orders():
-    """Get user's order history"""
+    """Get one page of the user's order history, newest first"""
     try:
         mongo = current_app.mongo
         user_email = request.user.get("email")
-        
-        # Get orders for user
-        orders = list(mongo.db.orders.find(
-            {"user_email": user_email},
-            sort=[("created_at", -1)]
-        ))
-        
-        # Convert ObjectId to string and format dates
-        for order in orders:
-            order["_id"] = str(order["_id"])
-            order["created_at"] = order["created_at"].isoformat()
-            # Remove sensitive data
-            if "card_number" in order:
-                order["card_number"] = "****" + order["card_number"][-4:]
-        
+
+        try:
+            limit = page_size(request.args.get("limit"))
+            orders, next_cursor = keyset_page(
+                mongo.db.orders,
+                {"user_email": user_email},
+                cursor=request.args.get("cursor"),
+                limit=limit,
+                projection=order_projection(request.args.get("include"))
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
         return jsonify({
-            "orders": orders,
-            "count": len(orders)
+            "orders": [serialize_order(order) for order in orders],
+            "count": len(orders),
+            "next_cursor": next_cursor
         }), 200
 
     except Exception as e:
@@ -550,6 +663,7 @@ def get_orders():
 
 @cart_bp.route("/toggle", methods=["POST"])
 @jwt_required
+@cart_affinity
 def toggle_product():
     """Toggle a product in the cart using RFID scan: add if not present, remove if present."""
     try:
@@ -558,72 +672,42 @@ def toggle_product():
         user_email = request.user.get("email")
         if not data.get("rfid_tag"):
             return jsonify({"error": "RFID tag is required"}), 400
-
-        # Get active session
-        session = mongo.db.sessions.find_one({
-            "user_email": user_email,
-            "is_active": True
-        })
-        if not session:
-            return jsonify({"error": "No active shopping session. Please start a session first"}), 400
+        try:
+            rfid_tag = encode_uid(data["rfid_tag"])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
         # Find product by RFID tag
-        product = mongo.db.products.find_one({"rfid_tag": data["rfid_tag"]})
+        product = current_app.product_cache.get_by_tag(rfid_tag)
         if not product:
             return jsonify({"error": "Product not found"}), 404
 
-        # Check if product is already in session
-        existing_item_index = next((i for i, item in enumerate(session["items"]) if item["rfid_tag"] == data["rfid_tag"]), None)
-
-        if existing_item_index is not None:
-            # Remove the item
-            session["items"].pop(existing_item_index)
-            session["total_amount"] = sum(item["total_price"] for item in session["items"])
-            mongo.db.sessions.update_one(
-                {"_id": session["_id"]},
-                {"$set": {
-                    "items": session["items"],
-                    "total_amount": session["total_amount"],
-                    "updated_at": datetime.utcnow()
-                }}
-            )
-            return jsonify({
-                "message": f"Product removed from cart: {product['name']} ({product.get('flavor', '')})",
-                "session": {
-                    "items": session["items"],
-                    "total_amount": session["total_amount"]
-                }
-            }), 200
+        # Remove the item if present, otherwise add it, in one atomic write
+        session, action, quantity, error = current_app.cart_store.toggle_item(user_email, product)
+        if error == "no_session":
+            return jsonify({"error": "No active shopping session. Please start a session first"}), 400
+        if error == "out_of_stock":
+            return jsonify({"error": f"Product {product['name']} is out of stock"}), 400
+
+        if action == "removed":
+            release(mongo.db, [{"product_id": str(product["_id"]), "quantity": quantity}])
+        elif not reserve(mongo.db, product["_id"]):
+            # Every unit is reserved by other carts: toggling again takes the tag back out
+            current_app.cart_store.toggle_item(user_email, product)
+            return jsonify({"error": f"Product {product['name']} is out of stock"}), 400
+        publish_cart_change(session, [str(product["_id"])])
+
+        if action == "added":
+            message = f"Product added to cart: {product['name']} ({product.get('flavor', '')})"
         else:
-            # Add the item
-            if product.get("stock_quantity", 0) <= 0:
-                return jsonify({"error": f"Product {product['name']} is out of stock"}), 400
-            session["items"].append({
-                "product_id": str(product["_id"]),
-                "name": product["name"],
-                "price": product["price"],
-                "quantity": 1,
-                "total_price": product["price"],
-                "rfid_tag": product["rfid_tag"],
-                "flavor": product.get("flavor"),
-                "scanned_at": datetime.utcnow()
-            })
-            session["total_amount"] = sum(item["total_price"] for item in session["items"])
-            mongo.db.sessions.update_one(
-                {"_id": session["_id"]},
-                {"$set": {
-                    "items": session["items"],
-                    "total_amount": session["total_amount"],
-                    "updated_at": datetime.utcnow()
-                }}
-            )
-            return jsonify({
-                "message": f"Product added to cart: {product['name']} ({product.get('flavor', '')})",
-                "session": {
-                    "items": session["items"],
-                    "total_amount": session["total_amount"]
-                }
-            }), 200
+            message = f"Product removed from cart: {product['name']} ({product.get('flavor', '')})"
+        return jsonify({
+            "message": message,
+            "session": {
+                "items": decode_items(session_items(session)),
+                "total_amount": session["total_amount"]
+            }
+        }), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -1,10 +1,20 @@
-from flask import Blueprint, request, jsonify, current_app
-from datetime import datetime
-from bson import ObjectId
+from flask import Blueprint, request, jsonify, current_app, Response
+from utils.scan_engine import MAX_BATCH_TAGS
+from utils.read_dedup import suppress_duplicate_reads
+from utils.uid_codec import try_encode_uid, decode_uid
+from utils import rfid_frames
 
 rfid_bp = Blueprint('rfid', __name__)
 
+# Largest binary request accepted on /frames
+MAX_FRAME_BODY = 16 * 1024
+
+def resolve_cart(uid):
+    """Find (or register) the cart for uid; returns (cart, status, session_id)"""
+    return current_app.reader_ingest.resolve_cart(uid)
+
 @rfid_bp.route('/scan', methods=['POST'])
+@suppress_duplicate_reads('uid')
 def receive_rfid():
     """Receive RFID UID and process cart operations"""
     try:
@@ -15,26 +25,9 @@ def receive_rfid():
 
         print(f"Received RFID UID: {uid}")
         
-        # Get MongoDB instance
-        mongo = current_app.mongo
-        
-        # Look for cart with this RFID UID
-        cart = mongo.db.carts.find_one({"barcode": uid})
-        
-        if not cart:
-            # If no cart found, create a new cart entry (for testing)
-            cart_data = {
-                "cart_number": mongo.db.carts.count_documents({}) + 1,
-                "barcode": uid,
-                "is_available": True,
-                "created_at": datetime.utcnow()
-            }
-            result = mongo.db.carts.insert_one(cart_data)
-            cart = mongo.db.carts.find_one({"_id": result.inserted_id})
-            print(f"Created new cart entry for UID: {uid}")
+        cart, status, session_id = resolve_cart(uid)
         
-        # Check if cart is available
-        if cart.get("is_available", True):
+        if status == 'available':
             return jsonify({
                 'message': 'Cart available',
                 'cart_id': str(cart['_id']),
@@ -42,41 +35,30 @@ def receive_rfid():
                 'barcode': cart.get('barcode'),
                 'status': 'available'
             }), 200
+        elif status == 'in_use':
+            return jsonify({
+                'message': 'Cart in use',
+                'cart_id': str(cart['_id']),
+                'cart_number': cart.get('cart_number'),
+                'barcode': cart.get('barcode'),
+                'status': 'in_use',
+                'session_id': str(session_id)
+            }), 200
         else:
-            # Cart is in use, check if there's an active session
-            active_session = mongo.db.sessions.find_one({
-                "cart_id": cart['_id'],
-                "is_active": True
-            })
-            
-            if active_session:
-                return jsonify({
-                    'message': 'Cart in use',
-                    'cart_id': str(cart['_id']),
-                    'cart_number': cart.get('cart_number'),
-                    'barcode': cart.get('barcode'),
-                    'status': 'in_use',
-                    'session_id': str(active_session['_id'])
-                }), 200
-            else:
-                # Mark cart as available if no active session
-                mongo.db.carts.update_one(
-                    {"_id": cart['_id']},
-                    {"$set": {"is_available": True}}
-                )
-                return jsonify({
-                    'message': 'Cart now available',
-                    'cart_id': str(cart['_id']),
-                    'cart_number': cart.get('cart_number'),
-                    'barcode': cart.get('barcode'),
-                    'status': 'available'
-                }), 200
+            return jsonify({
+                'message': 'Cart now available',
+                'cart_id': str(cart['_id']),
+                'cart_number': cart.get('cart_number'),
+                'barcode': cart.get('barcode'),
+                'status': 'available'
+            }), 200
                 
     except Exception as e:
         print(f"Error processing RFID scan: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @rfid_bp.route('/scan_product', methods=['POST'])
+@suppress_duplicate_reads('rfid_tag')
 def scan_product_rfid():
     """Scan product via RFID without authentication - for ESP32"""
     try:
@@ -87,10 +69,9 @@ def scan_product_rfid():
 
         print(f"RFID Product Scan: {rfid_tag}")
         
-        mongo = current_app.mongo
-        
-        # Find product by RFID tag
-        product = mongo.db.products.find_one({"rfid_tag": rfid_tag})
+        # Find product by RFID tag; a malformed tag cannot belong to a product
+        code = try_encode_uid(rfid_tag)
+        product = current_app.product_cache.get_by_tag(code) if code is not None else None
         if not product:
             return jsonify({
                 'error': 'Product not found',
@@ -117,7 +98,7 @@ def scan_product_rfid():
                 'name': product['name'],
                 'price': product['price'],
                 'category': product.get('category'),
-                'rfid_tag': product['rfid_tag'],
+                'rfid_tag': decode_uid(product['rfid_tag']),
                 'stock_quantity': product.get('stock_quantity', 0)
             }
         }), 200
@@ -126,6 +107,76 @@ def scan_product_rfid():
         print(f"Error scanning product: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@rfid_bp.route('/scan_product_batch', methods=['POST'])
+def scan_product_batch_rfid():
+    """Resolve every tag read in one anti-collision cycle - for ESP32"""
+    try:
+        data = request.get_json()
+        rfid_tags = data.get('rfid_tags') if data else None
+        if not rfid_tags or not isinstance(rfid_tags, list):
+            return jsonify({'error': 'A list of RFID tags is required'}), 400
+        if len(rfid_tags) > MAX_BATCH_TAGS:
+            return jsonify({'error': f'At most {MAX_BATCH_TAGS} RFID tags per batch'}), 400
+
+        print(f"RFID Product Batch Scan: {len(rfid_tags)} tags")
+
+        # Resolve every tag with at most one $in query; malformed tags resolve to nothing
+        codes = [try_encode_uid(rfid_tag) for rfid_tag in rfid_tags]
+        products = current_app.product_cache.get_many_by_tag({code for code in codes if code is not None})
+
+        results = []
+        seen = set()
+        for rfid_tag, code in zip(rfid_tags, codes):
+            product = products.get(code)
+            result = {'rfid_tag': rfid_tag}
+            if code is not None and code in seen:
+                result['status'] = 'duplicate'
+            elif not product:
+                result['status'] = 'unknown'
+            elif product.get('stock_quantity', 0) <= 0:
+                result['status'] = 'out_of_stock'
+            else:
+                result['status'] = 'scanned'
+                result['product'] = {
+                    'id': str(product['_id']),
+                    'name': product['name'],
+                    'price': product['price'],
+                    'category': product.get('category'),
+                    'rfid_tag': decode_uid(product['rfid_tag']),
+                    'stock_quantity': product.get('stock_quantity', 0)
+                }
+            seen.add(code)
+            results.append(result)
+
+        return jsonify({'results': results}), 200
+
+    except Exception as e:
+        print(f"Error scanning product batch: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@rfid_bp.route('/frames', methods=['POST'])
+def receive_frames():
+    """Binary ingestion for ESP32 readers: cart and product frames in, compact acks out"""
+    try:
+        if (request.content_length or 0) > MAX_FRAME_BODY:
+            return Response(status=413)
+        try:
+            frames = rfid_frames.decode_frames(request.get_data())
+            acks = current_app.reader_ingest.process_frames(frames)
+        except ValueError as e:
+            return Response(str(e), status=400, mimetype='text/plain')
+
+        return Response(b''.join(acks), mimetype='application/octet-stream')
+
+    except Exception as e:
+        print(f"Error processing RFID frames: {str(e)}")
+        return Response(status=500)
+
+@rfid_bp.route('/dedup_stats', methods=['GET'])
+def get_dedup_stats():
+    """Suppressed versus forwarded read counts per reader"""
+    return jsonify(current_app.read_dedup.stats()), 200
+
 @rfid_bp.route('/carts', methods=['GET'])
 def get_all_carts():
     """Get all carts with their RFID barcodes"""
@@ -1,8 +1,13 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from datetime import datetime
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.uid_codec import decode_uid
+from utils.tag_registry import register_tags
+
 load_dotenv()
 
 rfid_products = [
@@ -26,22 +31,30 @@ def add_bulk_rfid_products():
     client = MongoClient(mongo_uri)
     db = client.shopngo
 
+    # One SKU per name and flavor; every tag is one unit of its SKU
+    skus = {}
     for prod in rfid_products:
-        existing = db.products.find_one({"rfid_tag": prod["rfid_tag"]})
-        if existing:
-            print(f"Product with RFID {prod['rfid_tag']} already exists: {existing['name']} ({existing.get('flavor', 'N/A')})")
-            continue
-        product_doc = {
-            "name": prod["name"],
-            "price": prod["price"],
-            "flavor": prod["flavor"],
-            "rfid_tag": prod["rfid_tag"],
-            "stock_quantity": 1,  # Each tag is a unique item
-            "description": f"{prod['name']} - {prod['flavor']}",
-            "created_at": datetime.utcnow()
-        }
-        db.products.insert_one(product_doc)
-        print(f"Added: {product_doc['name']} ({product_doc['flavor']}) - RFID: {product_doc['rfid_tag']}")
+        skus.setdefault((prod["name"], prod["flavor"]), []).append(prod)
+
+    for (name, flavor), units in skus.items():
+        product_doc = db.products.find_one_and_update(
+            {"name": name, "flavor": flavor, "price": units[0]["price"]},
+            {"$setOnInsert": {
+                "name": name,
+                "price": units[0]["price"],
+                "flavor": flavor,
+                "stock_quantity": 0,  # Counted up as tags are registered
+                "description": f"{name} - {flavor}",
+                "created_at": datetime.utcnow()
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        registered, duplicates, _ = register_tags(db, product_doc["_id"], [unit["rfid_tag"] for unit in units],
+                                                  add_stock=True)
+        for code in duplicates:
+            print(f"RFID {decode_uid(code)} is already registered")
+        print(f"Added: {name} ({flavor}) - {len(registered)} tags, {product_doc['stock_quantity'] + len(registered)} in stock")
 
 if __name__ == "__main__":
     add_bulk_rfid_products()
@@ -1,8 +1,13 @@
 from pymongo import MongoClient
 from datetime import datetime
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.uid_codec import encode_uid
+from utils.tag_registry import register_tags
+
 load_dotenv()
 
 def add_rfid_product():
@@ -20,24 +25,25 @@ def add_rfid_product():
         "name": "Apple",
         "price": 2.50,
         "category": "Fruits",
-        "rfid_tag": rfid_uid,
         "stock_quantity": 100,
         "description": "Fresh red apple",
         "created_at": datetime.utcnow()
     }
 
     # Check if product already exists
-    existing = db.products.find_one({"rfid_tag": rfid_uid})
+    existing = db.tags.find_one({"_id": encode_uid(rfid_uid)})
     if existing:
-        print(f"Product with RFID {rfid_uid} already exists: {existing['name']}")
+        product = db.products.find_one({"_id": existing["product_id"]}) or {"name": "a deleted product"}
+        print(f"RFID {rfid_uid} is already registered to {product['name']}")
         return
 
-    # Insert product
+    # Insert the SKU and register the sticker to it
     result = db.products.insert_one(product)
+    register_tags(db, result.inserted_id, [rfid_uid])
     print(f"✅ Product added successfully!")
     print(f"Name: {product['name']}")
     print(f"Price: ${product['price']}")
-    print(f"RFID Tag: {product['rfid_tag']}")
+    print(f"RFID Tag: {rfid_uid}")
     print(f"ID: {result.inserted_id}")
     
     print(f"\n🎯 Now when you scan your RFID sticker, it will add {product['name']} to the cart!")
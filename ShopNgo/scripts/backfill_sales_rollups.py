@@ -0,0 +1,34 @@
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.sales_rollups import backfill_rollups, catch_up_rollups
+
+load_dotenv()
+
+def backfill_sales_rollups():
+    """Rebuild the hourly and daily sales rollups from orders (run once after index migration 9)"""
+    parser = argparse.ArgumentParser(description=backfill_sales_rollups.__doc__)
+    parser.add_argument("--days", type=int, help="only rebuild the last N days (default: every order)")
+    parser.add_argument("--pending", action="store_true",
+                        help="only count the orders whose rollup write failed, leaving the rest as they are")
+    args = parser.parse_args()
+
+    mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/shopngo")
+    client = MongoClient(mongo_uri)
+    db = client.shopngo
+
+    if args.pending:
+        print(f"Counted {catch_up_rollups(db)} pending orders into the rollups")
+        return
+
+    start = datetime.utcnow() - timedelta(days=args.days) if args.days else None
+    written = backfill_rollups(db, start=start)
+    print(f"Wrote {written} rollup documents" + (f" for the last {args.days} days" if args.days else ""))
+
+if __name__ == "__main__":
+    backfill_sales_rollups()
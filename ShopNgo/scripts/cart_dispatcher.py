@@ -0,0 +1,143 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import http.client
+import itertools
+import subprocess
+import argparse
+import base64
+import signal
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.affinity import HashRing
+
+# Local cart-affinity dispatcher: starts one Flask worker per shard and
+# forwards each request to the worker named by its X-Cart-Shard header, so
+# every request for a cart reaches the process holding that cart's state.
+# Requests without the header go to the shard owning the email in their
+# bearer token, on the same hash ring as the workers; anonymous requests
+# (login, signup) are spread round-robin. Behind nginx the same contract is
+# a map from $http_x_cart_shard to an upstream.
+
+SHARD_HEADER = "X-Cart-Shard"
+HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "upgrade", "proxy-connection"}
+# Written by the dispatcher's own send_response
+OWN_HEADERS = {"server", "date"}
+
+# SIGTERM is turned into a normal exit so atexit hooks (cart store flush) run
+WORKER_CODE = (
+    "import os, signal, sys; signal.signal(signal.SIGTERM, lambda *args: sys.exit(0)); "
+    "from app import app; app.run(host='127.0.0.1', port=int(os.environ['PORT']), threaded=True)"
+)
+
+
+def start_workers(shards, base_port, app_dir):
+    """Start one app process per shard; returns the list of (process, port)"""
+    workers = []
+    for shard in range(shards):
+        env = dict(os.environ)
+        env.update({
+            "PORT": str(base_port + shard),
+            "CART_SHARDS": str(shards),
+            "CART_SHARD_INDEX": str(shard)
+        })
+        process = subprocess.Popen([sys.executable, "-c", WORKER_CODE], cwd=app_dir, env=env)
+        workers.append((process, base_port + shard))
+        print(f"Started shard {shard} on port {base_port + shard} (pid {process.pid})")
+    return workers
+
+
+def token_email(authorization):
+    """Email claim of a bearer token, read without verification; the worker verifies it"""
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+    try:
+        payload = authorization.split(" ")[1].split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return None
+    return claims.get("email") if isinstance(claims, dict) else None
+
+
+def make_handler(ports):
+    round_robin = itertools.cycle(range(len(ports)))
+    ring = HashRing(range(len(ports)))
+
+    class DispatchHandler(BaseHTTPRequestHandler):
+        # Close-delimited responses let streamed bodies (NDJSON, SSE) pass straight through
+        protocol_version = "HTTP/1.0"
+
+        def _port(self):
+            shard = self.headers.get(SHARD_HEADER)
+            if shard is not None and shard.isdigit() and int(shard) < len(ports):
+                return ports[int(shard)]
+            email = token_email(self.headers.get("Authorization"))
+            if email:
+                return ports[ring.node_for(email)]
+            return ports[next(round_robin)]
+
+        def _forward(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else None
+            headers = {key: value for key, value in self.headers.items() if key.lower() not in HOP_HEADERS}
+
+            upstream = http.client.HTTPConnection("127.0.0.1", self._port(), timeout=300)
+            try:
+                upstream.request(self.command, self.path, body=body, headers=headers)
+                response = upstream.getresponse()
+                self.send_response(response.status, response.reason)
+                for key, value in response.getheaders():
+                    if key.lower() not in HOP_HEADERS | OWN_HEADERS:
+                        self.send_header(key, value)
+                self.end_headers()
+                while True:
+                    chunk = response.read1(65536)
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+            except (ConnectionError, OSError) as e:
+                print(f"Error forwarding to worker: {str(e)}")
+                try:
+                    self.send_error(502, "Worker unavailable")
+                except OSError:
+                    pass
+            finally:
+                upstream.close()
+
+        do_GET = do_POST = do_PUT = do_DELETE = do_OPTIONS = _forward
+
+        def log_message(self, format, *args):
+            pass
+
+    return DispatchHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run one worker per cart shard behind an affinity dispatcher")
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--worker-port", type=int, default=5100, help="port of shard 0; shard n uses this + n")
+    args = parser.parse_args()
+
+    app_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    workers = start_workers(args.shards, args.worker_port, app_dir)
+    server = ThreadingHTTPServer(("0.0.0.0", args.port), make_handler([port for process, port in workers]))
+
+    def shutdown(signum, frame):
+        # SIGTERM lets each worker flush its in-memory carts on the way out
+        for process, port in workers:
+            process.send_signal(signal.SIGTERM)
+        for process, port in workers:
+            process.wait(10)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    print(f"Dispatching on 0.0.0.0:{args.port} to {args.shards} shards")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 from pymongo import MongoClient
-from datetime import datetime
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.stock_manager import rebuild_reservations
+from utils.cart_pool import CartPool
+from utils.session_reaper import SessionReaper
+
 load_dotenv()
 
 def cleanup_sessions():
@@ -12,43 +17,28 @@ def cleanup_sessions():
     client = MongoClient(mongo_uri)
     db = client.shopngo
 
-    # Find all active sessions
-    active_sessions = list(db.sessions.find({"is_active": True}))
-    print(f"Found {len(active_sessions)} active sessions:")
-    
-    for session in active_sessions:
+    # List active sessions straight from the cursor rather than loading them all
+    count = 0
+    print("Active sessions:")
+    for session in db.sessions.find({"is_active": True}, {"items": 0}):
+        count += 1
         print(f"\nSession ID: {session['_id']}")
         print(f"User Email: {session.get('user_email', 'N/A')}")
         print(f"Started At: {session.get('started_at', 'N/A')}")
         print(f"Cart ID: {session.get('cart_id', 'N/A')}")
-        print(f"Items: {len(session.get('items', []))}")
+        print(f"Items: {session.get('item_count', 0)}")
         print(f"Total Amount: {session.get('total_amount', 0)}")
 
-    if active_sessions:
-        # Get cart IDs from active sessions
-        cart_ids = [session["cart_id"] for session in active_sessions]
-        
-        # Update all carts to available
-        result = db.carts.update_many(
-            {"_id": {"$in": cart_ids}},
-            {"$set": {"is_available": True}}
-        )
-        print(f"\nUpdated {result.modified_count} carts to available")
-        
-        # End all active sessions
-        result = db.sessions.update_many(
-            {"is_active": True},
-            {
-                "$set": {
-                    "is_active": False,
-                    "ended_at": datetime.utcnow(),
-                    "ended_by": "manual_cleanup"
-                }
-            }
-        )
-        print(f"Ended {result.modified_count} active sessions")
+    if count:
+        # End them in batches, releasing carts and reserved stock as we go
+        ended, _ = SessionReaper(db, CartPool(db)).reap(None, "manual_cleanup")
+        print(f"\nEnded {ended} active sessions and freed their carts")
+
+        # Nothing is held by a cart any more, so clear any reservation drift
+        rebuild_reservations(db)
+        print("Released all stock reservations")
     else:
         print("\nNo active sessions found")
 
 if __name__ == "__main__":
-    cleanup_sessions() 
\ No newline at end of file
+    cleanup_sessions()
\ No newline at end of file
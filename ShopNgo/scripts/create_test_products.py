@@ -1,8 +1,12 @@
 from pymongo import MongoClient
 from datetime import datetime
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.tag_registry import register_tags
+
 load_dotenv()
 
 def create_test_products():
@@ -60,8 +64,13 @@ def create_test_products():
         if response.lower() != 'y':
             return
 
-    # Insert products
-    result = db.products.insert_many(test_products)
+    # Insert the SKUs, then register each one's tag in the tag registry
+    result = db.products.insert_many([{key: value for key, value in product.items() if key != "rfid_tag"}
+                                      for product in test_products])
+    for product_id, product in zip(result.inserted_ids, test_products):
+        _, duplicates, _ = register_tags(db, product_id, [product["rfid_tag"]])
+        if duplicates:
+            print(f"RFID {product['rfid_tag']} is already registered to another product")
     print(f"Successfully created {len(result.inserted_ids)} test products:")
     
     for product in test_products:
@@ -0,0 +1,374 @@
+from collections import defaultdict
+from datetime import datetime
+from pymongo import MongoClient, ReturnDocument
+from werkzeug.security import generate_password_hash
+from dotenv import load_dotenv
+import argparse
+import threading
+import random
+import json
+import time
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import rfid_frames
+from utils.tag_registry import register_tags
+
+load_dotenv()
+
+# Load generator for the scan path: simulated ESP32 readers hit the RFID
+# endpoints with bursty, duplicated reads (plus stray tags), while simulated
+# shoppers log in, start sessions, scan and remove items, poll their cart and
+# check out. Latency is recorded per endpoint and reported as p50/p95/p99.
+#
+#   python scripts/load_test.py --readers 20 --shoppers 50 --seconds 60
+#       runs the app in-process (Flask test client) against MONGO_URI
+#   python scripts/load_test.py --url http://localhost:5000 ...
+#       drives a running server; MONGO_URI must point at its database
+#   python scripts/load_test.py --inmemory ...
+#       in-process against a throwaway mongod (needs pymongo_inmemory)
+#
+# Fixtures are tagged load_test: true and removed with --cleanup. Use
+# --save/--compare to keep a baseline and fail on a p95 regression.
+
+PASSWORD = "load-test"
+TAG_BASE = 0xF0000000000000
+CART_BASE = 0xCA000000000000
+STRAY_BASE = 0xE0000000000000
+
+
+class Recorder:
+    """Collects request latencies per endpoint, thread-safely"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, status, seconds):
+        with self._lock:
+            self.samples[endpoint].append(seconds)
+            self.statuses[endpoint][status] += 1
+
+    def summary(self, elapsed):
+        rows = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            samples = sorted(samples)
+            pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+            statuses = self.statuses[endpoint]
+            rows[endpoint] = {
+                "count": len(samples),
+                "rps": round(len(samples) / elapsed, 1),
+                "p50_ms": round(pick(0.50), 2),
+                "p95_ms": round(pick(0.95), 2),
+                "p99_ms": round(pick(0.99), 2),
+                "max_ms": round(samples[-1] * 1000, 2),
+                "errors": sum(n for status, n in statuses.items() if status >= 500 or status == 0),
+                "statuses": {str(status): n for status, n in sorted(statuses.items())}
+            }
+        return rows
+
+
+class HttpClient:
+    """Talks to a running server over HTTP"""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def request(self, method, path, json=None, data=None, headers=None):
+        response = self.session.request(method, self.base_url + path, json=json, data=data,
+                                        headers=headers, timeout=30)
+        return response.status_code, response.content, response.headers
+
+
+class AppClient:
+    """Calls the app in-process through the Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, json=None, data=None, headers=None):
+        response = self.client.open(path, method=method, json=json, data=data, headers=headers)
+        return response.status_code, response.get_data(), response.headers
+
+
+class Actor:
+    def __init__(self, client, recorder):
+        self.client = client
+        self.recorder = recorder
+        self.headers = {}
+
+    def call(self, endpoint, method, path, payload=None, data=None, headers=None):
+        """Make one request, timing it under endpoint; returns (status, parsed body)"""
+        started = time.perf_counter()
+        try:
+            status, body, response_headers = self.client.request(
+                method, path, json=payload, data=data, headers=dict(self.headers, **(headers or {})))
+        except Exception as e:
+            self.recorder.record(endpoint, 0, time.perf_counter() - started)
+            print(f"{endpoint} failed: {str(e)}")
+            return 0, None
+        self.recorder.record(endpoint, status, time.perf_counter() - started)
+        if data is not None:
+            return status, body
+        try:
+            return status, json.loads(body) if body else None
+        except ValueError:
+            return status, None
+
+
+class Fixtures:
+    """Synthetic SKUs, tags, carts and users for a load run"""
+
+    def __init__(self, db, products, carts, users, stray_ratio, skus=40):
+        self.db = db
+        self.tags = [f"{TAG_BASE + i:014X}" for i in range(products)]
+        self.skus = max(1, min(skus, products))
+        self.carts = [f"{CART_BASE + i:014X}" for i in range(carts)]
+        self.users = [f"loadtest{i}@shopngo.test" for i in range(users)]
+        self.stray_ratio = stray_ratio
+
+    def seed(self):
+        now = datetime.utcnow()
+        names = ["Molto", "Chips", "V Cola", "Juice", "Biscuits", "Water"]
+        # Tags are spread round-robin over the SKUs, as several units of each
+        for sku in range(self.skus):
+            product = self.db.products.find_one_and_update({"load_test": True, "sku": sku}, {"$setOnInsert": {
+                "name": names[sku % len(names)],
+                "price": round(5 + sku * 0.5, 2),
+                "category": "load_test",
+                "stock_quantity": 1000000,
+                "created_at": now
+            }}, upsert=True, return_document=ReturnDocument.AFTER, projection={"_id": 1})
+            register_tags(self.db, product["_id"], self.tags[sku::self.skus])
+        highest = self.db.carts.find_one({"cart_number": {"$exists": True}}, {"cart_number": 1},
+                                         sort=[("cart_number", -1)])
+        number = highest["cart_number"] if highest else 0
+        for barcode in self.carts:
+            if not self.db.carts.find_one({"barcode": barcode}, {"_id": 1}):
+                number += 1
+                self.db.carts.insert_one({"cart_number": number, "barcode": barcode, "is_available": True,
+                                          "load_test": True, "created_at": now})
+        # Keep the cart number sequence ahead of the numbers used here
+        self.db.counters.update_one({"_id": "cart_number"}, {"$max": {"value": number}}, upsert=True)
+        hashed = generate_password_hash(PASSWORD)
+        for i, email in enumerate(self.users):
+            self.db.users.update_one({"email": email}, {"$setOnInsert": {
+                "firstName": "Load", "lastName": f"Tester {i}", "email": email,
+                "password": hashed, "gender": "other", "role": "customer", "load_test": True
+            }}, upsert=True)
+
+    def cleanup(self):
+        emails = {"$in": self.users}
+        skus = [product["_id"] for product in self.db.products.find({"load_test": True}, {"_id": 1})]
+        removed = {
+            "tags": self.db.tags.delete_many({"product_id": {"$in": skus}}).deleted_count,
+            "products": self.db.products.delete_many({"load_test": True}).deleted_count,
+            "carts": self.db.carts.delete_many({"load_test": True}).deleted_count,
+            "users": self.db.users.delete_many({"load_test": True}).deleted_count,
+            "sessions": self.db.sessions.delete_many({"user_email": emails}).deleted_count,
+            "orders": self.db.orders.delete_many({"user_email": emails}).deleted_count
+        }
+        self.db.checkout_otps.delete_many({"user_email": emails})
+        self.db.email_outbox.delete_many({"to": emails})
+        return removed
+
+    def read(self):
+        """One tag read: usually a registered product, sometimes a stray tag"""
+        if random.random() < self.stray_ratio:
+            return f"{STRAY_BASE + random.getrandbits(40):014X}"
+        return random.choice(self.tags)
+
+
+def run_reader(actor, fixtures, reader_id, deadline, rate):
+    """An ESP32 reader: bursts of reads with repeats, over JSON and binary frames"""
+    seq = 0
+    while time.monotonic() < deadline:
+        # A burst is one anti-collision cycle; tags in the field are read several times
+        burst = [fixtures.read() for i in range(random.randint(1, 6))]
+        burst += random.choices(burst, k=random.randint(0, len(burst)))
+        mode = random.random()
+        if mode < 0.4:
+            for tag in burst:
+                actor.call("rfid/scan_product", "POST", "/api/rfid/scan_product",
+                           payload={"rfid_tag": tag, "reader_id": f"load-{reader_id}"})
+        elif mode < 0.7:
+            actor.call("rfid/scan_product_batch", "POST", "/api/rfid/scan_product_batch",
+                       payload={"rfid_tags": burst, "reader_id": f"load-{reader_id}"})
+        elif mode < 0.95:
+            seq += 1
+            frame = rfid_frames.encode_frame(rfid_frames.KIND_PRODUCT, reader_id, seq,
+                                             int(time.time() * 1000), burst)
+            actor.call("rfid/frames", "POST", "/api/rfid/frames", data=frame,
+                       headers={"Content-Type": "application/octet-stream"})
+        else:
+            actor.call("rfid/scan", "POST", "/api/rfid/scan",
+                       payload={"uid": random.choice(fixtures.carts), "reader_id": f"load-{reader_id}"})
+        time.sleep(random.expovariate(rate))
+
+
+def run_shopper(actor, fixtures, email, deadline, think, db):
+    """A shopper: log in, take a cart, scan and remove items, poll, then check out or walk away"""
+    status, body = actor.call("auth/login", "POST", "/api/auth/login", payload={"email": email, "password": PASSWORD})
+    if status != 200:
+        return
+    actor.headers["Authorization"] = f"Bearer {body['user']['token']}"
+
+    while time.monotonic() < deadline:
+        status, body = actor.call("cart/start_session", "POST", "/api/cart/start_session", payload={"auto_assign": True})
+        if status != 201:
+            time.sleep(think)
+            continue
+        actor.headers["X-Cart-Shard"] = str(body.get("shard", 0))
+
+        in_cart = []
+        for i in range(random.randint(3, 15)):
+            if time.monotonic() >= deadline:
+                break
+            tag = fixtures.read()
+            if random.random() < 0.2:
+                # The phone sees the whole basket at once
+                tags = [tag] + [fixtures.read() for j in range(random.randint(1, 4))]
+                status, body = actor.call("cart/scan_batch", "POST", "/api/cart/scan_batch", payload={"rfid_tags": tags})
+            else:
+                # A held-down scan fires more than once
+                for j in range(random.choice([1, 1, 1, 2, 3])):
+                    status, body = actor.call("cart/scan", "POST", "/api/cart/scan", payload={"rfid_tag": tag})
+            if status == 200:
+                in_cart = body["session"]["items"]
+            if in_cart and random.random() < 0.1:
+                status, body = actor.call("cart/remove", "POST", "/api/cart/remove",
+                                          payload={"product_id": random.choice(in_cart)["product_id"]})
+                if status == 200:
+                    in_cart = body["session"]["items"]
+            if random.random() < 0.3:
+                actor.call("cart/get", "GET", "/api/cart/get")
+            time.sleep(random.expovariate(1 / think))
+
+        if random.random() < 0.15 or not in_cart:
+            actor.call("cart/end_session", "POST", "/api/cart/end_session", payload={})
+            continue
+
+        status, body = actor.call("cart/initiate-checkout", "POST", "/api/cart/initiate-checkout",
+                                  payload={"payment_method": "mobile_wallet"})
+        if status != 200:
+            actor.call("cart/end_session", "POST", "/api/cart/end_session", payload={})
+            continue
+        # The OTP would arrive by email; read it straight from the database
+        pending = db.checkout_otps.find_one({"user_email": email}, {"otp": 1})
+        actor.call("cart/verify-checkout", "POST", "/api/cart/verify-checkout", payload={"otp": pending["otp"]})
+        if random.random() < 0.2:
+            actor.call("cart/orders", "GET", "/api/cart/orders?limit=10")
+        time.sleep(think)
+
+
+def print_report(rows, elapsed):
+    total = sum(row["count"] for row in rows.values())
+    print(f"\n{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)\n")
+    print(f"{'endpoint':28} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'5xx':>5}  statuses")
+    for endpoint, row in rows.items():
+        statuses = " ".join(f"{status}:{n}" for status, n in row["statuses"].items())
+        print(f"{endpoint:28} {row['count']:>7} {row['rps']:>8} {row['p50_ms']:>8} {row['p95_ms']:>8} "
+              f"{row['p99_ms']:>8} {row['max_ms']:>8} {row['errors']:>5}  {statuses}")
+
+
+def compare(rows, baseline, max_regression):
+    """Return the endpoints whose p95 grew by more than max_regression over the baseline"""
+    regressions = []
+    for endpoint, row in rows.items():
+        before = baseline.get(endpoint)
+        if before and before["p95_ms"] > 0 and row["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{endpoint}: p95 {before['p95_ms']}ms -> {row['p95_ms']}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the RFID scan path and the cart API")
+    parser.add_argument("--url", help="base URL of a running server (default: run the app in-process)")
+    parser.add_argument("--inmemory", action="store_true", help="run in-process against a throwaway mongod")
+    parser.add_argument("--readers", type=int, default=10)
+    parser.add_argument("--shoppers", type=int, default=20)
+    parser.add_argument("--seconds", type=int, default=30)
+    parser.add_argument("--reader-rate", type=float, default=5.0, help="bursts per second per reader")
+    parser.add_argument("--think", type=float, default=0.5, help="mean seconds a shopper waits between actions")
+    parser.add_argument("--products", type=int, default=2000, help="synthetic tags to register")
+    parser.add_argument("--skus", type=int, default=40, help="SKUs the synthetic tags are units of")
+    parser.add_argument("--carts", type=int, help="synthetic carts (default: one per shopper)")
+    parser.add_argument("--stray-ratio", type=float, default=0.1, help="share of reads from unregistered tags")
+    parser.add_argument("--save", help="write the per-endpoint results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --save")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p95 growth over the baseline")
+    parser.add_argument("--cleanup", action="store_true", help="remove load test fixtures and exit")
+    args = parser.parse_args()
+
+    mongod = None
+    if args.inmemory:
+        try:
+            from pymongo_inmemory import Mongod
+        except ImportError:
+            sys.exit("--inmemory needs the pymongo_inmemory package (pip install pymongo_inmemory)")
+        mongod = Mongod()
+        mongod.start()
+        os.environ["MONGO_URI"] = mongod.connection_string.rstrip("/") + "/shopngo"
+
+    mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/shopngo")
+    db = MongoClient(mongo_uri).shopngo
+    fixtures = Fixtures(db, args.products, args.carts or args.shoppers, args.shoppers, args.stray_ratio,
+                        args.skus)
+
+    try:
+        if args.cleanup:
+            print(f"Removed {fixtures.cleanup()}")
+            return
+        fixtures.seed()
+        print(f"Seeded {len(fixtures.tags)} tags, {len(fixtures.carts)} carts, {len(fixtures.users)} shoppers")
+
+        if args.url:
+            print("Note: a running server only sees newly seeded tags after its tag filter "
+                  "rebuilds (TAG_FILTER_REBUILD_SECONDS)")
+            make_client = lambda: HttpClient(args.url)
+        else:
+            # No OTP emails to the synthetic shoppers, and no reaper racing the run
+            os.environ["EMAIL_OUTBOX_WORKERS"] = "0"
+            os.environ["SESSION_REAPER_ENABLED"] = "false"
+            from app import app
+            make_client = lambda: AppClient(app)
+
+        recorder = Recorder()
+        deadline = time.monotonic() + args.seconds
+        threads = [threading.Thread(target=run_reader, daemon=True,
+                                    args=(Actor(make_client(), recorder), fixtures, i + 1, deadline, args.reader_rate))
+                   for i in range(args.readers)]
+        threads += [threading.Thread(target=run_shopper, daemon=True,
+                                     args=(Actor(make_client(), recorder), fixtures, email, deadline, args.think, db))
+                    for email in fixtures.users]
+
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        rows = recorder.summary(elapsed)
+        print_report(rows, elapsed)
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(rows, f, indent=2)
+        if args.compare:
+            with open(args.compare) as f:
+                regressions = compare(rows, json.load(f), args.max_regression)
+            for regression in regressions:
+                print(f"Regression: {regression}")
+            if regressions:
+                sys.exit(1)
+    finally:
+        if mongod:
+            mongod.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import os
+import sys
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.index_manager import apply_migrations, report_collscans, get_applied_version, LATEST_VERSION
+
+load_dotenv()
+
+def migrate_indexes():
+    """Apply pending index migrations, including their data steps, and report hot-path queries without index support"""
+    mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/shopngo")
+    client = MongoClient(mongo_uri)
+    db = client.shopngo
+
+    verify_all = "--verify" in sys.argv
+    print(f"Recorded index version: {get_applied_version(db)} (latest: {LATEST_VERSION})")
+
+    if verify_all:
+        print("Checking every declared index; data migrations are not run")
+    report = apply_migrations(db, verify_all=verify_all)
+    print(f"Index version is now {report['version']}")
+    for failure in report["failed"]:
+        print(f"- FAILED {failure['index']}: {failure['error']}")
+
+    collscans = report_collscans(db)
+    if collscans:
+        print("\nHot-path queries falling back to COLLSCAN:")
+        for collscan in collscans:
+            print(f"- {collscan['query']} ({collscan['collection']}): {collscan['filter']}")
+    else:
+        print("\nAll hot-path queries are index-backed")
+
+if __name__ == "__main__":
+    migrate_indexes()
@@ -0,0 +1,121 @@
+import os
+import sys
+from pymongo import MongoClient, UpdateOne
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.tag_registry import copy_product_tags
+from utils.stock_manager import rebuild_reservations
+
+load_dotenv()
+
+# Products that differ only in their RFID tag are units of the same SKU
+SKU_FIELDS = ("name", "price", "flavor", "category")
+
+
+def sku_key(product):
+    return tuple(product.get(field) for field in SKU_FIELDS)
+
+
+def plan_merges(db):
+    """Group per-tag products into SKUs; returns a list of (survivor, merged products)"""
+    groups = {}
+    for product in db.products.find({}, {"recent_ops": 0}).sort("_id", 1):
+        groups.setdefault(sku_key(product), []).append(product)
+    plans = []
+    for products in groups.values():
+        if not any("rfid_tag" in product for product in products):
+            continue
+        # Keep an existing tagless SKU if there is one, otherwise the oldest product
+        survivor = next((product for product in products if "rfid_tag" not in product), products[0])
+        plans.append((survivor, [product for product in products if product is not survivor]))
+    return plans
+
+
+def merge_items(items, renamed):
+    """Repoint items at their SKU, folding items of the same SKU together; returns (items, changed)"""
+    merged = {}
+    changed = False
+    for item in items:
+        product_id = renamed.get(item["product_id"], item["product_id"])
+        changed = changed or product_id != item["product_id"]
+        if product_id in merged:
+            merged[product_id]["quantity"] += item["quantity"]
+            merged[product_id]["total_price"] += item["total_price"]
+            merged[product_id]["rfid_tags"] = merged[product_id].get("rfid_tags", []) + item.get("rfid_tags", [])
+        else:
+            merged[product_id] = dict(item, product_id=product_id)
+    return merged, changed
+
+
+def rewrite_references(db, renamed, batch_size=500):
+    """Point order and active session items at the surviving SKUs"""
+    ids = list(renamed)
+    operations = []
+    for order in db.orders.find({"items.product_id": {"$in": ids}}, {"items": 1}):
+        items, changed = merge_items(order["items"], renamed)
+        if changed:
+            operations.append(UpdateOne({"_id": order["_id"]}, {"$set": {"items": list(items.values())}}))
+        if len(operations) >= batch_size:
+            db.orders.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        db.orders.bulk_write(operations, ordered=False)
+        operations = []
+
+    for session in db.sessions.find({"is_active": True}, {"items": 1}):
+        items = session.get("items") or {}
+        items, changed = merge_items(items.values() if isinstance(items, dict) else items, renamed)
+        if changed:
+            operations.append(UpdateOne({"_id": session["_id"]}, {"$set": {"items": items}}))
+    if operations:
+        db.sessions.bulk_write(operations, ordered=False)
+
+
+def migrate_to_skus():
+    """Merge one-product-per-tag documents into SKUs whose tags live in the tag registry"""
+    mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/shopngo")
+    client = MongoClient(mongo_uri)
+    db = client.shopngo
+
+    dry_run = "--dry-run" in sys.argv
+    active = db.sessions.count_documents({"is_active": True})
+    if active and not dry_run and "--force" not in sys.argv:
+        print(f"{active} shopping sessions are active. Run while the store is closed, or pass --force.")
+        return
+
+    plans = plan_merges(db)
+    merged_count = sum(len(merged) for _, merged in plans)
+    print(f"{len(plans)} SKUs from {len(plans) + merged_count} tagged products")
+    for survivor, merged in plans:
+        stock = sum(product.get("stock_quantity", 0) for product in [survivor] + merged)
+        print(f"- {survivor.get('name')} ({survivor.get('flavor') or 'N/A'}): "
+              f"{len(merged) + 1} products -> 1 SKU, {stock} in stock")
+    if dry_run:
+        print("\nDry run: nothing was changed")
+        return
+
+    # Every tag must be in the registry before the products carrying them go away
+    print(f"\nRegistered {copy_product_tags(db)} tags")
+
+    renamed = {}
+    for survivor, merged in plans:
+        merged_ids = [product["_id"] for product in merged]
+        db.tags.update_many({"product_id": {"$in": merged_ids}}, {"$set": {"product_id": survivor["_id"]}})
+        db.products.update_one({"_id": survivor["_id"]}, {
+            "$set": {"stock_quantity": sum(product.get("stock_quantity", 0) for product in [survivor] + merged)},
+            "$unset": {"rfid_tag": ""}
+        })
+        renamed.update({str(product_id): str(survivor["_id"]) for product_id in merged_ids})
+    if renamed:
+        rewrite_references(db, renamed)
+        db.products.delete_many({"_id": {"$in": [product["_id"] for _, merged in plans for product in merged]}})
+
+    # Reservations now belong to the surviving SKUs
+    rebuild_reservations(db)
+    print(f"Merged {merged_count} products into {len(plans)} SKUs")
+    print("Restart the app (or wait for the product cache TTL) so cached products are dropped")
+
+
+if __name__ == "__main__":
+    migrate_to_skus()
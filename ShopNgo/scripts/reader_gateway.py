@@ -0,0 +1,251 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from pymongo import MongoClient
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import random
+import time
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils import rfid_frames
+from utils.product_cache import init_product_cache
+from utils.tag_filter import init_tag_filter
+from utils.read_dedup import init_read_dedup
+from utils.cart_registry import init_cart_registry
+from utils.cart_pool import init_cart_pool
+from utils.reader_ingest import ReaderIngest
+from utils.uid_codec import decode_uid
+
+load_dotenv()
+
+# Standalone reader gateway: readers keep a TCP connection open (or send UDP
+# datagrams) carrying the binary frames of utils/rfid_frames.py, instead of
+# one HTTP request per read. Frames go onto a bounded queue per reader; a
+# worker per reader drains its queue in batches and runs them through the
+# same ReaderIngest logic as /api/rfid/frames on a thread pool. A full queue
+# stops reading from that reader's socket (TCP) or drops the datagram (UDP),
+# so one noisy reader cannot starve the others or grow memory without bound.
+#
+#   python scripts/reader_gateway.py serve --tcp-port 7000 --udp-port 7001
+#   python scripts/reader_gateway.py simulate --readers 50 --seconds 30
+
+
+class ReaderGateway:
+    def __init__(self, ingest, queue_size=256, batch_size=32, threads=8, idle_seconds=300):
+        self.ingest = ingest
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.idle_seconds = idle_seconds
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.stats = Counter()
+        self._queues = {}
+
+    def _queue(self, reader_id):
+        queue = self._queues.get(reader_id)
+        if queue is None:
+            queue = self._queues[reader_id] = asyncio.Queue(maxsize=self.queue_size)
+            asyncio.get_running_loop().create_task(self._drain(reader_id, queue))
+        return queue
+
+    async def submit(self, frame, reply):
+        """Queue a frame, waiting while the reader's queue is full"""
+        self.stats["frames"] += 1
+        await self._queue(frame.reader_id).put((frame, reply))
+
+    def submit_nowait(self, frame, reply):
+        """Queue a frame if there is room; returns False if it was dropped"""
+        self.stats["frames"] += 1
+        try:
+            self._queue(frame.reader_id).put_nowait((frame, reply))
+            return True
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            return False
+
+    async def _drain(self, reader_id, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                batch = [await asyncio.wait_for(queue.get(), self.idle_seconds)]
+            except asyncio.TimeoutError:
+                # Idle reader: release its queue; the next frame creates a new one
+                if queue.empty():
+                    self._queues.pop(reader_id, None)
+                    return
+                continue
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            frames = [frame for frame, reply in batch]
+            try:
+                acks = await loop.run_in_executor(self.executor, self.ingest.process_frames, frames)
+            except Exception as e:
+                print(f"Error processing frames from reader {reader_id}: {str(e)}")
+                self.stats["errors"] += 1
+                # An ack with no results tells the reader to resend
+                acks = [rfid_frames.encode_ack(frame, []) for frame in frames]
+
+            self.stats["batches"] += 1
+            self.stats["reads"] += sum(len(frame.uids) for frame in frames)
+            for (frame, reply), ack in zip(batch, acks):
+                reply(ack)
+
+    async def handle_tcp(self, reader, writer):
+        """Read frames off one reader connection until it closes"""
+        self.stats["connections"] += 1
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                await self.submit(frame, writer.write)
+                await writer.drain()
+        except ValueError as e:
+            print(f"Closing reader connection after bad frame: {str(e)}")
+            self.stats["bad_frames"] += 1
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def queue_depths(self):
+        return {reader_id: queue.qsize() for reader_id, queue in self._queues.items() if queue.qsize()}
+
+
+class UDPReaderProtocol(asyncio.DatagramProtocol):
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            frames = rfid_frames.decode_frames(data)
+        except ValueError:
+            self.gateway.stats["bad_frames"] += 1
+            return
+        for frame in frames:
+            # No ack for a dropped datagram; the reader resends on timeout
+            self.gateway.submit_nowait(frame, lambda ack, addr=addr: self.transport.sendto(ack, addr))
+
+
+async def read_frame(reader):
+    """Read exactly one frame from a stream; returns None at a clean end of stream"""
+    try:
+        header = await reader.readexactly(rfid_frames.HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ValueError("Truncated frame header")
+        return None
+    parts = [header]
+    for i in range(header[-1]):
+        length = await reader.readexactly(1)
+        parts.append(length)
+        parts.append(await reader.readexactly(length[0]))
+    return rfid_frames.decode_frames(b"".join(parts))[0]
+
+
+async def report(gateway, interval):
+    last = Counter()
+    while True:
+        await asyncio.sleep(interval)
+        current = Counter(gateway.stats)
+        delta = current - last
+        last = current
+        print(f"frames/s {delta['frames'] / interval:.0f}  reads/s {delta['reads'] / interval:.0f}  "
+              f"batches {delta['batches']}  dropped {delta['dropped']}  errors {delta['errors']}  "
+              f"readers {len(gateway._queues)}  backlog {sum(gateway.queue_depths().values())}")
+
+
+async def serve(args):
+    mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/shopngo")
+    db = MongoClient(mongo_uri).shopngo
+    product_cache = init_product_cache(db, init_tag_filter(db))
+    cart_registry = init_cart_registry(db)
+    ingest = ReaderIngest(db, product_cache, init_read_dedup(), cart_registry, init_cart_pool(db, cart_registry))
+    gateway = ReaderGateway(ingest, queue_size=args.queue_size, batch_size=args.batch_size, threads=args.threads)
+
+    loop = asyncio.get_running_loop()
+    server = await asyncio.start_server(gateway.handle_tcp, args.host, args.tcp_port)
+    if args.udp_port:
+        await loop.create_datagram_endpoint(lambda: UDPReaderProtocol(gateway), local_addr=(args.host, args.udp_port))
+    print(f"Reader gateway on tcp://{args.host}:{args.tcp_port}"
+          + (f" and udp://{args.host}:{args.udp_port}" if args.udp_port else ""))
+    loop.create_task(report(gateway, args.report_interval))
+    async with server:
+        await server.serve_forever()
+
+
+async def simulate_reader(args, reader_id, tags, latencies, deadline):
+    reader, writer = await asyncio.open_connection(args.host, args.tcp_port)
+    seq = 0
+    try:
+        while time.monotonic() < deadline:
+            # One anti-collision cycle: a few tags, sometimes read twice
+            uids = random.sample(tags, min(len(tags), random.randint(1, 4)))
+            if random.random() < 0.3:
+                uids.append(uids[0])
+            seq += 1
+            started = time.monotonic()
+            writer.write(rfid_frames.encode_frame(rfid_frames.KIND_PRODUCT, reader_id, seq,
+                                                  int(time.time() * 1000), uids))
+            await writer.drain()
+            header = await reader.readexactly(rfid_frames.ACK_HEADER.size)
+            await reader.readexactly(rfid_frames.RESULT.size * header[-1])
+            latencies.append(time.monotonic() - started)
+            await asyncio.sleep(random.expovariate(args.rate))
+    finally:
+        writer.close()
+
+
+async def simulate(args):
+    tags = args.tags.split(",") if args.tags else None
+    if not tags:
+        db = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/shopngo")).shopngo
+        tags = [decode_uid(tag["_id"]) for tag in db.tags.find({}, {"_id": 1}).limit(1000)]
+    latencies = []
+    deadline = time.monotonic() + args.seconds
+    await asyncio.gather(*(simulate_reader(args, reader_id, tags, latencies, deadline)
+                           for reader_id in range(1, args.readers + 1)))
+    latencies.sort()
+    if latencies:
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        print(f"{len(latencies)} frames in {args.seconds}s ({len(latencies) / args.seconds:.0f}/s)  "
+              f"p50 {pick(0.5):.2f}ms  p95 {pick(0.95):.2f}ms  p99 {pick(0.99):.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Asyncio TCP/UDP gateway for RFID reader frames")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="run the gateway")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--tcp-port", type=int, default=7000)
+    serve_parser.add_argument("--udp-port", type=int, default=7001, help="0 disables UDP")
+    serve_parser.add_argument("--queue-size", type=int, default=256, help="frames buffered per reader")
+    serve_parser.add_argument("--batch-size", type=int, default=32, help="frames processed per batch")
+    serve_parser.add_argument("--threads", type=int, default=8, help="threads for MongoDB work")
+    serve_parser.add_argument("--report-interval", type=int, default=10)
+
+    simulate_parser = commands.add_parser("simulate", help="drive a running gateway with simulated readers")
+    simulate_parser.add_argument("--host", default="127.0.0.1")
+    simulate_parser.add_argument("--tcp-port", type=int, default=7000)
+    simulate_parser.add_argument("--readers", type=int, default=50)
+    simulate_parser.add_argument("--rate", type=float, default=5.0, help="frames per second per reader")
+    simulate_parser.add_argument("--seconds", type=int, default=30)
+    simulate_parser.add_argument("--tags", help="comma separated tags (default: read from products)")
+
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args) if args.command == "serve" else simulate(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import os
+import sys
+
+import mongomock
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Background workers are not wanted in tests; each test drives what it needs
+os.environ.setdefault("EMAIL_OUTBOX_WORKERS", "0")
+os.environ.setdefault("SESSION_REAPER_ENABLED", "false")
+os.environ.setdefault("TAG_FILTER_ENABLED", "false")
+
+
+def _drop_sort(method):
+    # pymongo >= 4.11 passes sort= to the bulk builder, which mongomock predates
+    def wrapper(self, *args, sort=None, **kwargs):
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+mongomock.collection.BulkOperationBuilder.add_update = _drop_sort(mongomock.collection.BulkOperationBuilder.add_update)
+mongomock.collection.BulkOperationBuilder.add_replace = _drop_sort(mongomock.collection.BulkOperationBuilder.add_replace)
+
+
+@pytest.fixture
+def mongo_client(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr("flask_pymongo.MongoClient", lambda *args, **kwargs: client)
+    return client
+
+
+@pytest.fixture
+def db(mongo_client):
+    return mongo_client.shopngo
+
+
+@pytest.fixture
+def app(mongo_client):
+    from utils.index_manager import apply_migrations
+
+    # As scripts/migrate_indexes.py would before the first start (importing
+    # app already creates one)
+    apply_migrations(mongo_client.shopngo)
+    from app import create_app
+    return create_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(app):
+    from utils.jwt_utils import create_access_token
+
+    def headers(email="shopper@shopngo.test", role="customer"):
+        token = create_access_token({"email": email, "role": role}, app.config["SECRET_KEY"])
+        return {"Authorization": f"Bearer {token}"}
+    return headers
@@ -0,0 +1,43 @@
+import os
+import sys
+
+from utils.affinity import CartAffinity, HashRing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from cart_dispatcher import token_email
+
+EMAILS = [f"shopper{index}@shopngo.test" for index in range(2000)]
+
+
+def test_ring_is_deterministic():
+    first, second = HashRing(range(4)), HashRing(range(4))
+    assert [first.node_for(email) for email in EMAILS] == [second.node_for(email) for email in EMAILS]
+
+
+def test_adding_a_node_moves_only_its_share_of_keys():
+    before, after = HashRing(range(4)), HashRing(range(5))
+    moved = [email for email in EMAILS if before.node_for(email) != after.node_for(email)]
+    # Roughly 1/5 of the keys move, and only to the new node
+    assert len(moved) < len(EMAILS) * 0.3
+    assert {after.node_for(email) for email in moved} == {4}
+
+
+def test_every_node_gets_keys():
+    ring = HashRing(range(4))
+    assert {ring.node_for(email) for email in EMAILS} == {0, 1, 2, 3}
+
+
+def test_headerless_request_on_wrong_worker_gets_owning_shard(app, client, auth_headers):
+    app.cart_affinity = CartAffinity(shard_count=4, shard_index=0)
+    email = next(email for email in EMAILS if app.cart_affinity.shard_for(email) != 0)
+
+    response = client.post("/api/cart/end_session", json={}, headers=auth_headers(email))
+    assert response.status_code == 421
+    assert response.get_json()["shard"] == app.cart_affinity.shard_for(email)
+
+
+def test_dispatcher_routes_by_token_email(auth_headers):
+    email = "shopper@shopngo.test"
+    assert token_email(auth_headers(email)["Authorization"]) == email
+    assert token_email("Bearer not-a-token") is None
+    assert token_email(None) is None
@@ -0,0 +1,60 @@
+import pytest
+
+from utils.cart_events import CartEventBus
+
+
+@pytest.fixture
+def bus(app):
+    with app.app_context():
+        yield CartEventBus(history_size=5)
+
+
+def publish_versions(bus, versions):
+    for version in versions:
+        bus.publish("s1", "cart_updated", {"changes": {}}, version)
+
+
+def test_event_ids_are_session_versions(bus):
+    assert bus.publish("s1", "cart_updated", {}, 7) == 7
+    subscriber, missed = bus.subscribe("s1", 6)
+    assert [event["id"] for event in missed] == [7]
+
+
+def test_reconnect_replays_missed_versions(bus):
+    publish_versions(bus, [1, 2, 3, 4])
+    _, missed = bus.subscribe("s1", 2)
+    assert [event["id"] for event in missed] == [3, 4]
+
+
+def test_up_to_date_client_gets_nothing_to_replay(bus):
+    publish_versions(bus, [1, 2])
+    assert bus.subscribe("s1", 2)[1] == []
+
+
+def test_history_that_no_longer_reaches_back_needs_a_snapshot(bus):
+    publish_versions(bus, range(1, 11))
+    assert bus.subscribe("s1", 2)[1] is None
+    assert [event["id"] for event in bus.subscribe("s1", 6)[1]] == [7, 8, 9, 10]
+
+
+def test_gap_in_versions_needs_a_snapshot(bus):
+    # Version 3 was written somewhere that published nothing here
+    publish_versions(bus, [1, 2, 4])
+    assert bus.subscribe("s1", 1)[1] is None
+
+
+def test_out_of_order_publishes_replay_in_version_order(bus):
+    publish_versions(bus, [1, 3, 2])
+    assert [event["id"] for event in bus.subscribe("s1", 1)[1]] == [2, 3]
+
+
+def test_client_ahead_of_this_worker_needs_a_snapshot(bus):
+    publish_versions(bus, [1])
+    assert bus.subscribe("s1", 5)[1] is None
+
+
+def test_terminal_events_follow_the_latest_version(bus):
+    publish_versions(bus, [4])
+    subscriber, _ = bus.subscribe("s1", 4)
+    assert bus.publish("s1", "checkout_completed", {}) == 5
+    assert subscriber.get_nowait()["id"] == 5
@@ -0,0 +1,131 @@
+import json
+
+import pytest
+from bson import ObjectId
+
+from utils.cart_pool import CartPool
+from utils.cart_store import MemoryCartStore, init_cart_store
+from utils.session_reaper import SessionReaper
+
+EMAIL = "shopper@shopngo.test"
+
+
+def start(db):
+    return db.sessions.insert_one({"user_email": EMAIL, "is_active": True, "cart_id": ObjectId(), "items": {},
+                                   "item_count": 0, "total_amount": 0, "version": 0}).inserted_id
+
+
+@pytest.fixture
+def store(db, tmp_path):
+    store = MemoryCartStore(db, str(tmp_path / "cart.journal"))
+    yield store
+    store.close()
+
+
+def product_with_tag(db, rfid_tag, reserved=1):
+    product = {"_id": ObjectId(), "name": "Molto", "price": 2.5, "stock_quantity": 10, "rfid_tag": rfid_tag}
+    db.products.insert_one({"_id": product["_id"], "stock_quantity": 10, "reserved_quantity": reserved})
+    return product
+
+
+def journal_lines(store):
+    with open(store.journal_path) as journal:
+        return [json.loads(line) for line in journal]
+
+
+def test_cached_scans_do_not_touch_mongodb(db, store, monkeypatch):
+    start(db)
+    store.get_active(EMAIL)
+
+    def no_io(*args, **kwargs):
+        raise AssertionError("MongoDB queried on the scan path")
+    monkeypatch.setattr(db.sessions, "find_one", no_io)
+    monkeypatch.setattr(db.sessions, "find", no_io)
+
+    session, error = store.add_item(EMAIL, product_with_tag(db, 1))
+    assert error is None and session["item_count"] == 1
+
+
+def test_session_ended_elsewhere_is_dropped_by_the_periodic_check(db, store):
+    product = product_with_tag(db, 1)
+    first = start(db)
+    store.add_item(EMAIL, product)
+
+    # Another worker ends the session and the shopper starts a new one
+    db.sessions.update_one({"_id": first}, {"$set": {"is_active": False}})
+    second = start(db)
+
+    assert store.verify_active() == 1
+    session = store.get_active(EMAIL)
+    assert session["_id"] == second
+    assert session["items"] == {}
+    # The unit only this process knew about goes back to the shelf
+    assert db.products.find_one({"_id": product["_id"]})["reserved_quantity"] == 0
+
+
+def test_reaper_tells_the_store_what_it_ended(db, store):
+    product = product_with_tag(db, 1, reserved=2)
+    start(db)
+    store.add_item(EMAIL, product)
+    store.flush()
+    store.add_item(EMAIL, dict(product, rfid_tag=2))
+
+    reaper = SessionReaper(db, CartPool(db), on_ended=store.forget)
+    reaper.reap(None, "idle_timeout")
+
+    assert store.get_active(EMAIL) is None
+    # The reaper released the flushed unit, the store the one it never wrote back
+    assert db.products.find_one({"_id": product["_id"]})["reserved_quantity"] == 0
+
+
+def test_journal_is_compacted_to_unflushed_records(db, store):
+    start(db)
+    other = db.sessions.insert_one({"user_email": "other@shopngo.test", "is_active": True, "items": {},
+                                    "item_count": 0, "total_amount": 0, "version": 0}).inserted_id
+    for rfid_tag in range(1, 6):
+        store.add_item(EMAIL, product_with_tag(db, rfid_tag))
+    store.flush(EMAIL)
+    store.add_item("other@shopngo.test", product_with_tag(db, 9))
+    assert len(journal_lines(store)) == 1
+
+    # Another session stays dirty the whole time, yet flushed records still leave the journal
+    for rfid_tag in range(10, 20):
+        store.add_item(EMAIL, product_with_tag(db, rfid_tag))
+        store.add_item("other@shopngo.test", product_with_tag(db, rfid_tag + 100))
+        store.flush(EMAIL)
+    assert {record["session_id"] for record in journal_lines(store)} == {str(other)}
+    assert len(journal_lines(store)) == 11
+
+    store.flush()
+    assert journal_lines(store) == []
+
+
+def test_compacted_journal_still_recovers_unflushed_scans(db, tmp_path):
+    session_id = start(db)
+    crashed = MemoryCartStore(db, str(tmp_path / "cart.journal"))
+    crashed.add_item(EMAIL, product_with_tag(db, 1))
+    crashed.flush()
+    crashed.add_item(EMAIL, product_with_tag(db, 2))
+
+    # Started over the same journal without the first store closing
+    MemoryCartStore(db, str(tmp_path / "cart.journal")).close()
+    assert db.sessions.find_one({"_id": session_id})["item_count"] == 2
+
+
+def test_memory_store_requires_a_journal(db, monkeypatch):
+    monkeypatch.setenv("CART_STORE", "memory")
+    monkeypatch.delenv("CART_STORE_JOURNAL", raising=False)
+    with pytest.raises(RuntimeError):
+        init_cart_store(db)
+
+
+def test_each_shard_journals_to_its_own_file(db, monkeypatch, tmp_path):
+    monkeypatch.setenv("CART_STORE", "memory")
+    monkeypatch.setenv("CART_STORE_JOURNAL", str(tmp_path / "cart.journal"))
+    stores = [init_cart_store(db, shard_index) for shard_index in range(2)]
+    try:
+        assert [store.journal_path for store in stores] == [str(tmp_path / f"cart.journal.shard{index}")
+                                                            for index in range(2)]
+    finally:
+        for store in stores:
+            store.close()
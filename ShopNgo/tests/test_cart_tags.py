@@ -0,0 +1,109 @@
+import pytest
+from bson import ObjectId
+
+from utils.cart_store import MemoryCartStore
+from utils.scan_engine import add_item, add_items, session_items
+from utils.tag_registry import register_tags
+
+EMAIL = "shopper@shopngo.test"
+TAG_A, TAG_B, TAG_C = 0x07 << 56 | 0x53FFC752110001, 0x07 << 56 | 0x53FFC752110002, 0x07 << 56 | 0x53FFC752110003
+
+
+def unit(product, rfid_tag):
+    return dict(product, rfid_tag=rfid_tag)
+
+
+@pytest.fixture
+def product():
+    return {"_id": ObjectId(), "name": "Molto", "price": 2.5, "stock_quantity": 10}
+
+
+@pytest.fixture
+def session_db(db):
+    db.sessions.insert_one({"user_email": EMAIL, "is_active": True, "items": {}, "item_count": 0,
+                            "total_amount": 0, "version": 0})
+    return db
+
+
+def test_batch_after_single_scan_counts_only_new_tags(session_db, product):
+    add_item(session_db, EMAIL, unit(product, TAG_A))
+
+    session, added, error = add_items(session_db, EMAIL, [unit(product, TAG_A), unit(product, TAG_B)])
+    assert error is None
+    assert added == {TAG_B}
+
+    stored = session_db.sessions.find_one({"user_email": EMAIL})
+    item = stored["items"][str(product["_id"])]
+    assert item["quantity"] == 2
+    assert sorted(item["rfid_tags"]) == [TAG_A, TAG_B]
+    assert stored["item_count"] == 2
+    assert stored["total_amount"] == 5.0
+    assert session["items"][str(product["_id"])]["quantity"] == 2
+
+
+def test_rereading_the_basket_adds_nothing(session_db, product):
+    basket = [unit(product, TAG_A), unit(product, TAG_B)]
+    add_items(session_db, EMAIL, basket)
+    _, added, _ = add_items(session_db, EMAIL, basket + [unit(product, TAG_C)])
+    assert added == {TAG_C}
+    assert session_db.sessions.find_one({"user_email": EMAIL})["item_count"] == 3
+
+
+@pytest.fixture
+def memory_store(session_db, tmp_path):
+    return MemoryCartStore(session_db, str(tmp_path / "cart.journal"))
+
+
+def test_memory_toggle_moves_only_the_scanned_unit(memory_store, product):
+    memory_store.add_items(EMAIL, [unit(product, TAG_A), unit(product, TAG_B)])
+
+    session, action, quantity, error = memory_store.toggle_item(EMAIL, unit(product, TAG_B))
+    assert (action, quantity, error) == ("removed", 1, None)
+    item = session["items"][str(product["_id"])]
+    assert item["quantity"] == 1
+    assert item["rfid_tags"] == [TAG_A]
+
+    session, action, _, _ = memory_store.toggle_item(EMAIL, unit(product, TAG_C))
+    assert action == "added"
+    assert session["items"][str(product["_id"])]["rfid_tags"] == [TAG_A, TAG_C]
+    assert session["item_count"] == 2
+
+
+def test_memory_batch_after_single_scan_counts_only_new_tags(memory_store, product):
+    memory_store.add_item(EMAIL, unit(product, TAG_A))
+    session, added, _ = memory_store.add_items(EMAIL, [unit(product, TAG_A), unit(product, TAG_B)])
+    assert added == {TAG_B}
+    assert [item["quantity"] for item in session_items(session)] == [2]
+
+
+def test_scanning_the_same_tag_twice_counts_one_unit(session_db, product):
+    add_item(session_db, EMAIL, unit(product, TAG_A))
+    session, error = add_item(session_db, EMAIL, unit(product, TAG_A))
+    assert error == "duplicate"
+    assert session["item_count"] == 1
+
+    stored = session_db.sessions.find_one({"user_email": EMAIL})
+    assert stored["items"][str(product["_id"])]["quantity"] == 1
+    assert stored["version"] == 1
+
+
+def test_memory_scanning_the_same_tag_twice_counts_one_unit(memory_store, product):
+    memory_store.add_item(EMAIL, unit(product, TAG_A))
+    session, error = memory_store.add_item(EMAIL, unit(product, TAG_A))
+    assert error == "duplicate"
+    assert [item["quantity"] for item in session_items(session)] == [1]
+
+
+def test_scan_route_reserves_a_rescanned_tag_once(client, db, auth_headers):
+    db.carts.insert_one({"cart_number": 1, "barcode": "CART0001", "is_available": True})
+    product_id = db.products.insert_one({"name": "Molto", "price": 2.5, "stock_quantity": 5}).inserted_id
+    register_tags(db, product_id, ["53FFC752110001"])
+    headers = auth_headers()
+    client.post("/api/cart/start_session", json={"cart_barcode": "CART0001"}, headers=headers)
+
+    first = client.post("/api/cart/scan", json={"rfid_tag": "53FFC752110001"}, headers=headers)
+    second = client.post("/api/cart/scan", json={"rfid_tag": "53FFC752110001"}, headers=headers)
+    assert (first.get_json()["status"], second.get_json()["status"]) == ("added", "duplicate")
+    assert second.status_code == 200
+    assert second.get_json()["session"]["items"][0]["quantity"] == 1
+    assert db.products.find_one({"_id": product_id})["reserved_quantity"] == 1
@@ -0,0 +1,71 @@
+import pytest
+
+from utils.session_reaper import SessionReaper
+from utils.stock_manager import commit_reservations
+from utils.tag_registry import register_tags
+
+
+@pytest.fixture
+def basket(client, db, auth_headers):
+    """An active session with one scanned unit and a pending checkout OTP; returns (headers, product_id, otp)"""
+    db.carts.insert_one({"cart_number": 1, "barcode": "CART0001", "is_available": True})
+    product_id = db.products.insert_one({"name": "Molto", "price": 14.5, "stock_quantity": 5}).inserted_id
+    register_tags(db, product_id, ["53FFC752110001"])
+    headers = auth_headers()
+    client.post("/api/cart/start_session", json={"cart_barcode": "CART0001"}, headers=headers)
+    client.post("/api/cart/scan", json={"rfid_tag": "53FFC752110001"}, headers=headers)
+    assert client.post("/api/cart/initiate-checkout", json={"payment_method": "mobile_wallet"},
+                       headers=headers).status_code == 200
+    return headers, product_id, db.checkout_otps.find_one()["otp"]
+
+
+def test_checkout_sells_the_basket_and_ends_the_session(client, db, basket):
+    headers, product_id, otp = basket
+    response = client.post("/api/cart/verify-checkout", json={"otp": otp}, headers=headers)
+    assert response.status_code == 200
+
+    assert db.orders.count_documents({}) == 1
+    # Counted into the rollups, so nothing is left for the catch-up
+    assert db.orders.count_documents({"rollup_pending": True}) == 0
+    assert db.sales_rollups.count_documents({"granularity": "day"}) == 1
+    product = db.products.find_one({"_id": product_id})
+    assert (product["stock_quantity"], product["reserved_quantity"]) == (4, 0)
+    assert db.sessions.count_documents({"is_active": True}) == 0
+    assert db.carts.find_one()["is_available"] is True
+
+
+def test_failed_order_insert_keeps_the_units_reserved(client, db, basket, monkeypatch):
+    headers, product_id, otp = basket
+
+    def fail_insert(order):
+        raise RuntimeError("insert failed")
+    monkeypatch.setattr(db.orders, "insert_one", fail_insert)
+
+    response = client.post("/api/cart/verify-checkout", json={"otp": otp}, headers=headers)
+    assert response.status_code == 500
+
+    assert db.orders.count_documents({}) == 0
+    product = db.products.find_one({"_id": product_id})
+    assert (product["stock_quantity"], product["reserved_quantity"]) == (5, 1)
+    assert db.sessions.count_documents({"is_active": True}) == 1
+    assert db.sales_rollups.count_documents({}) == 0
+
+
+def test_reaper_ending_the_session_mid_checkout_sells_nothing(client, app, db, basket, monkeypatch):
+    headers, product_id, otp = basket
+
+    def commit_then_reap(*args, **kwargs):
+        failures = commit_reservations(*args, **kwargs)
+        # The idle reaper ends the session between the stock write and the session end
+        SessionReaper(db, app.cart_pool).reap(None, "idle_timeout")
+        return failures
+    monkeypatch.setattr("routes.cart_routes.commit_reservations", commit_then_reap)
+
+    response = client.post("/api/cart/verify-checkout", json={"otp": otp}, headers=headers)
+    assert response.status_code == 500
+
+    assert db.orders.count_documents({}) == 0
+    product = db.products.find_one({"_id": product_id})
+    assert (product["stock_quantity"], product["reserved_quantity"]) == (5, 0)
+    assert db.sessions.count_documents({"is_active": True}) == 0
+    assert db.carts.find_one()["is_available"] is True
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils.email_outbox import EmailOutbox, SMTPConnectionPool, init_email_outbox
+
+
+def outbox(db, batch_size=3):
+    return EmailOutbox(db, pool=None, sender="shop@shopngo.test", workers=0, batch_size=batch_size)
+
+
+def test_claim_batch_takes_due_messages_once(db):
+    senders = [outbox(db), outbox(db)]
+    for index in range(5):
+        senders[0].enqueue(f"user{index}@shopngo.test", "OTP", "<p>1</p>")
+    db.email_outbox.update_one({"to": "user4@shopngo.test"},
+                               {"$set": {"next_attempt_at": datetime.utcnow() + timedelta(hours=1)}})
+
+    first = senders[0]._claim_batch()
+    second = senders[1]._claim_batch()
+    assert len(first) == 3 and len(second) == 1
+    assert not {message["_id"] for message in first} & {message["_id"] for message in second}
+    assert all(message["status"] == "sending" and message["attempts"] == 1 for message in first + second)
+    assert senders[0]._claim_batch() == []
+
+
+def test_expired_claims_are_taken_over(db):
+    sender = outbox(db)
+    sender.enqueue("user@shopngo.test", "OTP", "<p>1</p>")
+    sender._claim_batch()
+    db.email_outbox.update_many({}, {"$set": {"locked_until": datetime.utcnow() - timedelta(seconds=1)}})
+    assert [message["attempts"] for message in sender._claim_batch()] == [2]
+
+
+def test_senders_refuse_to_start_without_a_password(db, monkeypatch):
+    monkeypatch.delenv("SENDER_PASSWORD", raising=False)
+    monkeypatch.setenv("EMAIL_OUTBOX_WORKERS", "1")
+    with pytest.raises(RuntimeError):
+        init_email_outbox(db)
+
+
+class FakeSMTP:
+    """Stands in for smtplib.SMTP and keeps what it was sent"""
+    delivered = []
+
+    def __init__(self, host, port, timeout=None):
+        self.address = (host, port)
+
+    def login(self, username, password):
+        self.login_as = username
+
+    def noop(self):
+        return (250, b"OK")
+
+    def send_message(self, message):
+        FakeSMTP.delivered.append((self.address, message))
+
+    def quit(self):
+        pass
+
+
+def test_queued_messages_reach_the_smtp_server(db, monkeypatch):
+    monkeypatch.setattr("utils.email_outbox.smtplib.SMTP", FakeSMTP)
+    FakeSMTP.delivered = []
+    pool = SMTPConnectionPool("localhost", 8025, username="shop@shopngo.test", password="secret", starttls=False)
+    sender = EmailOutbox(db, pool, "shop@shopngo.test", workers=0)
+    message_id = sender.enqueue("user@shopngo.test", "Your OTP", "<h1>123456</h1>", kind="checkout_otp")
+
+    sender._send_batch(sender._claim_batch())
+
+    [(address, message)] = FakeSMTP.delivered
+    assert address == ("localhost", 8025)
+    assert (message["To"], message["From"], message["Subject"]) == ("user@shopngo.test", "shop@shopngo.test", "Your OTP")
+    assert "123456" in message.get_payload()[0].get_payload()
+    assert sender.get_status(message_id)["status"] == "sent"
+    # The connection went back to the pool for the next batch
+    assert pool._idle.qsize() == 1
+
+
+def test_otp_status_of_a_malformed_id_is_not_found(client, auth_headers):
+    response = client.get("/api/cart/otp_status/not-an-id", headers=auth_headers())
+    assert response.status_code == 404
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils import index_manager
+from utils.index_manager import apply_migrations, get_applied_version, pending_data_steps, LATEST_VERSION
+
+
+def test_verify_checks_indexes_only(db, monkeypatch):
+    apply_migrations(db)
+    history = db.schema_migrations.find_one({"_id": "indexes"})["history"]
+    db.sessions.drop_index("active_by_user")
+
+    calls = []
+    monkeypatch.setattr(index_manager, "MIGRATIONS", [dict(migration, migrate=lambda db: calls.append(db))
+                                                      for migration in index_manager.MIGRATIONS])
+    report = apply_migrations(db, verify_all=True)
+
+    assert "sessions.active_by_user" in report["created"]
+    assert calls == []
+    assert db.schema_migrations.find_one({"_id": "indexes"})["history"] == history
+
+
+def test_migrations_wait_for_the_lease_holder(db):
+    db.schema_migrations.insert_one({"_id": "migrations_lock", "owner": "other worker",
+                                     "expires_at": datetime.utcnow() + timedelta(minutes=5)})
+    report = apply_migrations(db, wait_seconds=0)
+    assert report["version"] == 0
+    assert get_applied_version(db) == 0
+
+
+def test_expired_lease_is_taken_over_and_released(db):
+    db.schema_migrations.insert_one({"_id": "migrations_lock", "owner": "crashed worker",
+                                     "expires_at": datetime.utcnow() - timedelta(minutes=1)})
+    assert apply_migrations(db)["version"] == LATEST_VERSION
+    assert db.schema_migrations.find_one({"_id": "migrations_lock"}) is None
+
+
+def test_startup_refuses_pending_data_steps(db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(index_manager, "MIGRATIONS", [dict(migration, migrate=lambda db: calls.append(db))
+                                                      if migration.get("migrate") else migration
+                                                      for migration in index_manager.MIGRATIONS])
+    with pytest.raises(RuntimeError, match="scripts/migrate_indexes.py"):
+        apply_migrations(db, run_data_steps=False)
+    assert calls == []
+    assert get_applied_version(db) == 0
+    assert db.schema_migrations.find_one({"_id": "migrations_lock"}) is None
+
+    apply_migrations(db)
+    assert len(calls) == len(pending_data_steps(db, 0))
+    # Once the script has run, startup only reads the recorded version
+    assert apply_migrations(db, run_data_steps=False)["version"] == LATEST_VERSION
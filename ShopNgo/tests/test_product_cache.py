@@ -0,0 +1,44 @@
+from bson import ObjectId
+
+from utils.product_cache import CHANGE_PIPELINE, ProductCache
+
+
+def _update(coll, key, *fields):
+    return {"operationType": "update", "ns": {"db": "shopngo", "coll": coll}, "documentKey": {"_id": key},
+            "updateDescription": {"updatedFields": {field: 1 for field in fields}, "removedFields": []}}
+
+
+def _streamed(db, events):
+    # Run the change stream's filter over recorded events
+    db.events.insert_many(events)
+    return list(db.events.aggregate(CHANGE_PIPELINE))
+
+
+def test_reservation_updates_are_not_streamed(db):
+    product_id = ObjectId()
+    streamed = _streamed(db, [
+        _update("products", product_id, "reserved_quantity"),
+        _update("products", product_id, "reserved_quantity", "recent_ops.2"),
+        _update("products", product_id, "price"),
+        _update("products", product_id, "stock_quantity", "reserved_quantity"),
+        _update("tags", 7 << 56 | 1, "product_id"),
+        _update("sessions", ObjectId(), "version"),
+    ])
+    assert [(event["ns"]["coll"], next(iter(event["documentKey"].values()))) for event in streamed] == [
+        ("products", product_id), ("products", product_id), ("tags", 7 << 56 | 1)
+    ]
+
+
+def test_tag_changes_drop_the_tag_entry(db):
+    product_id = ObjectId()
+    db.products.insert_one({"_id": product_id, "name": "Milk", "price": 10})
+    db.tags.insert_one({"_id": 7 << 56 | 1, "product_id": product_id})
+    cache = ProductCache(db)
+    assert cache.get_by_tag(7 << 56 | 1)["name"] == "Milk"
+
+    db.tags.delete_one({"_id": 7 << 56 | 1})
+    assert cache.get_by_tag(7 << 56 | 1) is not None
+    cache._handle_change({"operationType": "delete", "ns": {"coll": "tags"}, "documentKey": {"_id": 7 << 56 | 1}})
+    assert cache.get_by_tag(7 << 56 | 1) is None
+    # The SKU itself stays cached
+    assert cache.stats()["size"] == 1
@@ -0,0 +1,88 @@
+import pytest
+
+from utils.rfid_frames import (KIND_CART, KIND_PRODUCT, STATUS_OK, STATUS_SUPPRESSED, STATUS_UNKNOWN, Frame,
+                               decode_ack, decode_frames, encode_ack, encode_frame)
+from utils.tag_registry import register_tags
+from utils.uid_codec import decode_uid, encode_uid
+
+UIDS = ["53FFC752110001", "0A0B0C0D", "00000001"]
+CODES = [encode_uid(uid) for uid in UIDS]
+
+
+def test_frame_round_trip():
+    data = encode_frame(KIND_PRODUCT, 7, 42, 1760000000123, UIDS)
+    assert decode_frames(data) == [Frame(KIND_PRODUCT, 7, 42, 1760000000123, CODES)]
+    assert encode_frame(KIND_PRODUCT, 7, 42, 1760000000123, CODES) == data
+
+
+def test_uids_decode_to_their_stored_form():
+    uids = decode_frames(encode_frame(KIND_PRODUCT, 1, 1, 0, UIDS))[0].uids
+    assert [decode_uid(uid) for uid in uids] == UIDS
+
+
+def test_frames_back_to_back():
+    data = encode_frame(KIND_CART, 1, 1, 0, ["CA000001"]) + encode_frame(KIND_PRODUCT, 1, 2, 5, UIDS)
+    assert [(frame.kind, frame.seq, frame.uids) for frame in decode_frames(data)] == [
+        (KIND_CART, 1, [encode_uid("CA000001")]), (KIND_PRODUCT, 2, CODES)]
+
+
+def test_frame_without_uids():
+    assert decode_frames(encode_frame(KIND_PRODUCT, 1, 1, 0, []))[0].uids == []
+
+
+@pytest.mark.parametrize("cut", range(1, len(encode_frame(KIND_PRODUCT, 7, 42, 0, UIDS))))
+def test_every_truncation_is_rejected(cut):
+    data = encode_frame(KIND_PRODUCT, 7, 42, 0, UIDS)
+    with pytest.raises(ValueError):
+        decode_frames(data[:cut])
+
+
+def test_zero_length_uid_is_rejected():
+    data = bytearray(encode_frame(KIND_PRODUCT, 1, 1, 0, ["01"]))
+    data[-2] = 0
+    with pytest.raises(ValueError):
+        decode_frames(bytes(data[:-1]))
+
+
+def test_uid_longer_than_seven_bytes_is_rejected():
+    data = encode_frame(KIND_PRODUCT, 1, 1, 0, [])[:-1] + bytes([1, 8]) + bytes(8)
+    with pytest.raises(ValueError):
+        decode_frames(data)
+
+
+@pytest.mark.parametrize("mutate", [
+    lambda data: b"XX" + data[2:],
+    lambda data: data[:2] + bytes([9]) + data[3:],
+    lambda data: data[:3] + bytes([7]) + data[4:],
+])
+def test_foreign_frames_are_rejected(mutate):
+    with pytest.raises(ValueError):
+        decode_frames(mutate(encode_frame(KIND_PRODUCT, 1, 1, 0, UIDS)))
+
+
+def test_ack_round_trip():
+    frame = Frame(KIND_PRODUCT, 7, 42, 0, UIDS)
+    results = [(STATUS_OK, 1450), (STATUS_UNKNOWN, 0), (STATUS_OK | STATUS_SUPPRESSED, 99)]
+    assert decode_ack(encode_ack(frame, results)) == [(KIND_PRODUCT, 42, results)]
+
+
+def test_truncated_ack_is_rejected():
+    data = encode_ack(Frame(KIND_CART, 1, 3, 0, ["CA000001"]), [(STATUS_OK, 12)])
+    for cut in range(1, len(data)):
+        with pytest.raises(ValueError):
+            decode_ack(data[:cut])
+
+
+def test_frames_endpoint_resolves_products_and_carts(client, db):
+    product_id = db.products.insert_one({"name": "Molto", "price": 14.5, "stock_quantity": 5}).inserted_id
+    register_tags(db, product_id, ["53FFC752110001"])
+    body = (encode_frame(KIND_PRODUCT, 3, 1, 0, ["53FFC752110001", "0A0B0C0D"])
+            + encode_frame(KIND_CART, 3, 2, 0, ["CA000001"]))
+
+    response = client.post("/api/rfid/frames", data=body, content_type="application/octet-stream")
+    assert response.status_code == 200
+    [(_, _, products), (_, _, carts)] = decode_ack(response.data)
+    assert products == [(STATUS_OK, 1450), (STATUS_UNKNOWN, 0)]
+    assert carts[0][0] == STATUS_OK
+    # Carts are registered under the hex UID, as /scan does
+    assert db.carts.find_one({"barcode": "CA000001"}) is not None
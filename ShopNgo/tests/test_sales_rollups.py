@@ -0,0 +1,106 @@
+from datetime import datetime
+
+import pytest
+
+from utils.sales_rollups import (PENDING, backfill_rollups, catch_up_rollups, hour_histogram, record_order,
+                                 sum_rollups, window_rollups)
+
+ORDERS = [
+    # (created_at, total_amount, units, store_id)
+    (datetime(2026, 10, 14, 23, 30), 10.0, 1, "s1"),
+    (datetime(2026, 10, 15, 9, 15), 20.0, 2, "s1"),
+    (datetime(2026, 10, 15, 9, 45), 5.0, 1, "s2"),
+    (datetime(2026, 10, 16, 12, 0), 7.5, 3, None),
+    (datetime(2026, 10, 17, 1, 10), 40.0, 4, "s2"),
+    (datetime(2026, 10, 17, 18, 5), 2.5, 1, "s1"),
+]
+
+
+@pytest.fixture
+def orders(db):
+    documents = [{"created_at": created_at, "total_amount": amount, "item_count": units, "store_id": store_id,
+                  PENDING: True}
+                 for created_at, amount, units, store_id in ORDERS]
+    db.orders.insert_many(documents)
+    return documents
+
+
+def expected(start, end, store_id=None):
+    """Brute-force totals straight from the orders"""
+    totals = {"revenue": 0, "order_count": 0, "units": 0}
+    for created_at, amount, units, store in ORDERS:
+        if start <= created_at <= end and (store_id is None or store == store_id):
+            totals["revenue"] += amount
+            totals["order_count"] += 1
+            totals["units"] += units
+    return totals
+
+
+@pytest.mark.parametrize("start,end", [
+    (datetime(2026, 10, 14), datetime(2026, 10, 18)),            # whole days only
+    (datetime(2026, 10, 14, 23), datetime(2026, 10, 17, 1, 30)),  # ragged ends
+    (datetime(2026, 10, 15, 9), datetime(2026, 10, 15, 9, 59)),   # within one day (rollups resolve to hours)
+    (datetime(2026, 10, 15, 10), datetime(2026, 10, 16, 11)),     # across midnight, no whole day
+])
+def test_window_rollups_match_the_orders(db, orders, start, end):
+    backfill_rollups(db)
+    docs = window_rollups(db, start, end)
+    assert sum_rollups(docs) == expected(start, end)
+    assert sum_rollups(docs, "s1") == expected(start, end, "s1")
+
+
+def test_recorded_orders_match_a_backfill(db, orders):
+    for order in orders:
+        record_order(db, order)
+    recorded = {doc["_id"]: doc for doc in db.sales_rollups.find()}
+    backfill_rollups(db)
+    assert {doc["_id"]: doc for doc in db.sales_rollups.find()} == recorded
+
+
+def test_backfill_of_a_range_drops_emptied_periods(db, orders):
+    backfill_rollups(db)
+    db.orders.delete_many({"created_at": {"$gte": datetime(2026, 10, 16), "$lt": datetime(2026, 10, 17)}})
+    backfill_rollups(db, start=datetime(2026, 10, 16), end=datetime(2026, 10, 16))
+    assert db.sales_rollups.find_one({"_id": "day:2026-10-16"}) is None
+    assert db.sales_rollups.find_one({"_id": "day:2026-10-15"})["order_count"] == 2
+
+
+def test_orders_without_a_store_are_counted_separately(db, orders):
+    backfill_rollups(db)
+    day = db.sales_rollups.find_one({"_id": "day:2026-10-16"})
+    assert day["stores"]["none"]["revenue"] == 7.5
+
+
+def test_hour_histogram_mixes_days_and_hours(db, orders):
+    backfill_rollups(db)
+    docs = window_rollups(db, datetime(2026, 10, 14, 23), datetime(2026, 10, 17, 1, 30))
+    assert hour_histogram(docs) == {23: 1, 9: 2, 12: 1, 1: 1}
+
+
+def test_failed_rollup_write_is_counted_once_by_the_catch_up(db, orders, monkeypatch):
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("primary stepped down")
+    with monkeypatch.context() as patch:
+        patch.setattr(db.sales_rollups, "bulk_write", unavailable)
+        assert record_order(db, orders[0]) is False
+    for order in orders[1:]:
+        assert record_order(db, order) is True
+    assert db.orders.count_documents({PENDING: True}) == 1
+
+    assert catch_up_rollups(db) == 1
+    assert catch_up_rollups(db) == 0
+    recorded = {doc["_id"]: doc for doc in db.sales_rollups.find()}
+    backfill_rollups(db)
+    assert {doc["_id"]: doc for doc in db.sales_rollups.find()} == recorded
+
+
+def test_catch_up_leaves_orders_that_may_still_be_checking_out(db):
+    db.orders.insert_one({"created_at": datetime.utcnow(), "total_amount": 5.0, "item_count": 1, PENDING: True})
+    assert catch_up_rollups(db) == 0
+    assert db.sales_rollups.count_documents({}) == 0
+
+
+def test_backfill_clears_the_orders_it_counted(db, orders):
+    backfill_rollups(db)
+    assert db.orders.count_documents({PENDING: True}) == 0
+    assert catch_up_rollups(db) == 0
@@ -0,0 +1,56 @@
+from utils.tag_registry import register_tags
+
+
+def seed(db):
+    db.carts.insert_one({"cart_number": 1, "barcode": "CART0001", "is_available": True})
+    product_id = db.products.insert_one({"name": "Molto", "price": 14.5, "stock_quantity": 5}).inserted_id
+    register_tags(db, product_id, ["53FFC752110001"])
+    return product_id
+
+
+def test_start_and_end_session(client, db, auth_headers):
+    seed(db)
+    headers = auth_headers()
+
+    response = client.post("/api/cart/start_session", json={"cart_barcode": "CART0001"}, headers=headers)
+    assert response.status_code == 201
+    assert db.sessions.count_documents({"is_active": True}) == 1
+    assert db.carts.find_one({"barcode": "CART0001"})["is_available"] is False
+
+    response = client.post("/api/cart/end_session", json={}, headers=headers)
+    assert response.status_code == 200
+    assert db.sessions.count_documents({"is_active": True}) == 0
+    assert db.carts.find_one({"barcode": "CART0001"})["is_available"] is True
+
+
+def test_restarting_a_session_ends_the_previous_one(client, db, auth_headers):
+    seed(db)
+    headers = auth_headers()
+
+    assert client.post("/api/cart/start_session", json={"auto_assign": True}, headers=headers).status_code == 201
+    # The first session's cart is handed back before the next one is claimed
+    assert client.post("/api/cart/start_session", json={"auto_assign": True}, headers=headers).status_code == 201
+    assert db.sessions.count_documents({"is_active": True}) == 1
+
+
+def test_ending_a_session_releases_reserved_stock(client, db, auth_headers):
+    product_id = seed(db)
+    headers = auth_headers()
+
+    client.post("/api/cart/start_session", json={"cart_barcode": "CART0001"}, headers=headers)
+    response = client.post("/api/cart/scan", json={"rfid_tag": "53FFC752110001"}, headers=headers)
+    assert response.status_code == 200
+    assert db.products.find_one({"_id": product_id})["reserved_quantity"] == 1
+
+    assert client.post("/api/cart/end_session", json={}, headers=headers).status_code == 200
+    assert db.products.find_one({"_id": product_id})["reserved_quantity"] == 0
+
+
+def test_remove_rejects_ids_that_are_not_object_ids(client, db, auth_headers):
+    seed(db)
+    headers = auth_headers()
+    client.post("/api/cart/start_session", json={"cart_barcode": "CART0001"}, headers=headers)
+
+    for product_id in ["x.y", "$where", {"$gt": ""}, 42]:
+        response = client.post("/api/cart/remove", json={"product_id": product_id}, headers=headers)
+        assert response.status_code == 400
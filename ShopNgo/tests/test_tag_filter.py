@@ -0,0 +1,74 @@
+import random
+
+from bson import ObjectId
+
+from utils.tag_filter import BloomFilter, TagFilter
+from utils.tag_registry import register_tags
+
+
+def test_bloom_filter_has_no_false_negatives():
+    rng = random.Random(7)
+    tags = [rng.getrandbits(56) | 7 << 56 for _ in range(5000)]
+    bloom = BloomFilter(len(tags), error_rate=0.01)
+    for tag in tags:
+        bloom.add(tag)
+    assert all(tag in bloom for tag in tags)
+
+
+def test_bloom_filter_false_positive_rate_is_near_target():
+    rng = random.Random(11)
+    bloom = BloomFilter(2000, error_rate=0.01)
+    for _ in range(2000):
+        bloom.add(rng.getrandbits(56))
+    others = [rng.getrandbits(56) | 1 << 60 for _ in range(20000)]
+    assert sum(tag in bloom for tag in others) / len(others) < 0.03
+
+
+def test_filter_rejects_unregistered_tags(db):
+    register_tags(db, ObjectId(), ["53FFC752110001"])
+    tag_filter = TagFilter(db)
+    tag_filter.rebuild()
+    assert tag_filter.candidates([7 << 56 | 0x53FFC752110001, 7 << 56 | 0x0BADC0DE000000]) == [7 << 56 | 0x53FFC752110001]
+    assert tag_filter.rejected == 1
+
+
+def test_tags_registered_elsewhere_pass_until_rebuilt(db):
+    tag_filter = TagFilter(db)
+    tag_filter.rebuild()
+
+    # Registered by another process, so never added to this filter
+    (code,), _, _ = register_tags(db, ObjectId(), ["53FFC752110002"])
+    tag_filter.refresh_version()
+    assert tag_filter.might_contain(code)
+    assert tag_filter.stale_checks == 1
+
+    tag_filter.rebuild()
+    assert tag_filter.might_contain(code)
+    assert not tag_filter.might_contain(7 << 56 | 0x0BADC0DE000000)
+
+
+def test_rejected_tags_never_query_mongodb(db, monkeypatch):
+    register_tags(db, ObjectId(), ["53FFC752110001"])
+    tag_filter = TagFilter(db)
+    tag_filter.rebuild()
+
+    def no_io(*args, **kwargs):
+        raise AssertionError("MongoDB queried for a rejected tag")
+    for collection in (db.counters, db.tags):
+        monkeypatch.setattr(collection, "find_one", no_io)
+        monkeypatch.setattr(collection, "find", no_io)
+
+    assert tag_filter.candidates([7 << 56 | 0x0BADC0DE000000]) == []
+    assert tag_filter.rejected == 1
+
+
+def test_tags_registered_here_keep_the_filter_current(db):
+    tag_filter = TagFilter(db)
+    tag_filter.rebuild()
+
+    registered, _, _ = register_tags(db, ObjectId(), ["53FFC752110003", "53FFC752110004"])
+    tag_filter.register(registered)
+    tag_filter.refresh_version()
+
+    assert tag_filter.candidates(registered + [7 << 56 | 0x0BADC0DE000000]) == registered
+    assert tag_filter.stale_checks == 0
@@ -0,0 +1,87 @@
+import pytest
+from bson import ObjectId
+
+from utils.scan_engine import add_item
+from utils.tag_registry import copy_product_tags
+from utils.uid_codec import decode_item, decode_uid, encode_uid, migrate_uids, normalize_uid, try_encode_uid
+
+
+@pytest.mark.parametrize("uid", ["53FFC752110001", "0A0B0C0D", "00000001", "00", "FFFFFFFFFFFFFF"])
+def test_round_trip(uid):
+    assert decode_uid(encode_uid(uid)) == uid
+
+
+def test_leading_zero_bytes_keep_their_length():
+    assert encode_uid("0001") != encode_uid("01")
+    assert decode_uid(encode_uid("0001")) == "0001"
+
+
+@pytest.mark.parametrize("text", ["53:ff:c7:52:11:00:01", "0x53FFC752110001", "53-FF-C7-52-11-00-01",
+                                  "53 ff c7 52 11 00 01"])
+def test_accepted_spellings_normalize(text):
+    assert normalize_uid(text) == "53FFC752110001"
+    assert encode_uid(text) == encode_uid("53FFC752110001")
+
+
+def test_bytes_and_encoded_ints():
+    code = encode_uid("53FFC752110001")
+    assert encode_uid(bytes.fromhex("53FFC752110001")) == code
+    assert encode_uid(code) == code
+
+
+def test_encoded_values_are_positive_int64():
+    assert 0 < encode_uid("FFFFFFFFFFFFFF") < 2 ** 63
+
+
+@pytest.mark.parametrize("value", ["", "ABC", "GG", "53FFC75211000102", "1_23", "+1", "0x", None, b"",
+                                   bytes(8), 0, 1 << 56 | 1 << 8, True])
+def test_invalid_values(value):
+    assert try_encode_uid(value) is None
+    with pytest.raises(ValueError):
+        encode_uid(value)
+
+
+def test_strings_pass_through_decode():
+    # Orders written before the integer form keep their strings
+    assert decode_uid("53ffc752110001") == "53ffc752110001"
+    assert decode_uid(None) is None
+
+
+def test_decode_item_decodes_every_tag():
+    codes = [encode_uid("01020304"), encode_uid("0A0B0C0D")]
+    item = {"product_id": "p", "rfid_tag": codes[1], "rfid_tags": codes}
+    assert decode_item(item) == dict(item, rfid_tag="0A0B0C0D", rfid_tags=["01020304", "0A0B0C0D"])
+
+
+def test_migration_converts_session_tag_lists(db):
+    product_id = ObjectId()
+    session_id = db.sessions.insert_one({"user_email": "shopper@shopngo.test", "is_active": True, "items": {
+        str(product_id): {"product_id": str(product_id), "quantity": 2, "rfid_tag": "53FFC752110002",
+                          "rfid_tags": ["53:ff:c7:52:11:00:01", "53FFC752110002"]}
+    }}).inserted_id
+
+    migrate_uids(db)
+
+    item = db.sessions.find_one({"_id": session_id})["items"][str(product_id)]
+    assert item["rfid_tag"] == encode_uid("53FFC752110002")
+    assert item["rfid_tags"] == [encode_uid("53FFC752110001"), encode_uid("53FFC752110002")]
+    # A tag scanned before the migration is recognised when read again
+    product = {"_id": product_id, "name": "Molto", "price": 1, "stock_quantity": 9,
+               "rfid_tag": encode_uid("53FFC752110001")}
+    assert add_item(db, "shopper@shopngo.test", product)[1] == "duplicate"
+
+
+def test_migration_reports_tags_spelled_differently_by_two_products(db, capsys):
+    first = db.products.insert_one({"name": "Molto", "rfid_tag": "53:ff:c7:52:11:00:01"}).inserted_id
+    second = db.products.insert_one({"name": "Juhayna", "rfid_tag": "53FFC752110001"}).inserted_id
+    single = db.products.insert_one({"name": "Chipsy", "rfid_tag": "0a0b0c0d"}).inserted_id
+
+    migrate_uids(db)
+    copy_product_tags(db)
+
+    assert [db.products.find_one({"_id": product_id})["rfid_tag"] for product_id in (first, second, single)] == [
+        "53:ff:c7:52:11:00:01", "53FFC752110001", encode_uid("0A0B0C0D")]
+    assert "53FFC752110001" in capsys.readouterr().out
+    # Neither product silently takes the shared tag
+    assert db.tags.find_one({"_id": encode_uid("53FFC752110001")}) is None
+    assert db.tags.find_one({"_id": encode_uid("0A0B0C0D")})["product_id"] == single
@@ -0,0 +1,85 @@
+from flask import request, jsonify, current_app
+from functools import wraps
+import bisect
+import hashlib
+import os
+
+# Cart affinity: every shopper's carts are owned by one shard (a worker
+# process), so per-cart state such as the in-memory cart store stays local to
+# a process. The owner is the user's email on a consistent hash ring.
+#
+# Routing contract: start_session and /get return the owning shard in the
+# body and in an X-Cart-Shard response header. Clients echo X-Cart-Shard on
+# every cart request, and the reverse proxy (or scripts/cart_dispatcher.py)
+# forwards it to upstream number X-Cart-Shard; without the header the
+# dispatcher places the request by the email in its bearer token. A cart
+# request reaching any other worker, with or without the header, is answered
+# with 421 and the owning shard so the client or proxy can retry there.
+
+SHARD_HEADER = "X-Cart-Shard"
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes; adding a node remaps ~1/n of the keys"""
+
+    def __init__(self, nodes, vnodes=64):
+        self._ring = sorted(
+            (self._hash(f"{node}#{replica}"), node)
+            for node in nodes
+            for replica in range(vnodes)
+        )
+        self._keys = [point for point, node in self._ring]
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(str(value).encode()).digest()[:8], "big")
+
+    def node_for(self, key):
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._ring[index][1]
+
+
+class CartAffinity:
+    """Maps sessions to shards and knows which shard this process is"""
+
+    def __init__(self, shard_count=1, shard_index=0, vnodes=64):
+        self.shard_count = shard_count
+        self.shard_index = shard_index
+        self.ring = HashRing(range(shard_count), vnodes)
+
+    def shard_for(self, user_email):
+        return self.ring.node_for(user_email)
+
+    def owns(self, shard):
+        return shard == self.shard_index
+
+
+def init_cart_affinity():
+    """Initialize cart affinity from CART_SHARDS and CART_SHARD_INDEX"""
+    return CartAffinity(
+        shard_count=int(os.getenv("CART_SHARDS", 1)),
+        shard_index=int(os.getenv("CART_SHARD_INDEX", 0))
+    )
+
+
+def cart_affinity(f):
+    """Reject cart requests routed to a worker that does not own the user's shard.
+
+    Must be applied under jwt_required, which sets request.user.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        affinity = current_app.cart_affinity
+        header = request.headers.get(SHARD_HEADER)
+        if header is not None and not header.isdigit():
+            return jsonify({"error": f"Invalid {SHARD_HEADER} header"}), 400
+        if affinity.shard_count > 1:
+            shard = affinity.shard_for(request.user.get("email"))
+            if not affinity.owns(shard):
+                return jsonify({
+                    "error": "Request routed to the wrong worker for this cart",
+                    "shard": shard,
+                    "worker_shard": affinity.shard_index
+                }), 421
+        return f(*args, **kwargs)
+    return decorated
@@ -9,6 +9,7 @@ def init_analytics_manager(db):
             self.analytics_collection = db.analytics
             self.sessions_collection = db.shopping_sessions
             self.products_collection = db.products
+            self.rollups_collection = db.sales_rollups
 
         def track_page_view(self, user_id, page_name):
             """Track page view"""
@@ -31,28 +32,19 @@ def init_analytics_manager(db):
         def get_daily_sales(self, days=7):
             """Get daily sales for the last n days"""
             start_date = datetime.utcnow() - timedelta(days=days)
-            pipeline = [
-                {
-                    '$match': {
-                        'status': 'completed',
-                        'end_time': {'$gte': start_date}
-                    }
-                },
+            start_day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+            # One pre-aggregated document per day (see utils/sales_rollups.py)
+            rollups = self.rollups_collection.find(
+                {'granularity': 'day', 'period_start': {'$gte': start_day}}
+            ).sort('period_start', 1)
+            return [
                 {
-                    '$group': {
-                        '_id': {
-                            '$dateToString': {
-                                'format': '%Y-%m-%d',
-                                'date': '$end_time'
-                            }
-                        },
-                        'total_sales': {'$sum': '$total'},
-                        'order_count': {'$sum': 1}
-                    }
-                },
-                {'$sort': {'_id': 1}}
+                    '_id': rollup['period_start'].strftime('%Y-%m-%d'),
+                    'total_sales': rollup.get('revenue', 0),
+                    'order_count': rollup.get('order_count', 0)
+                }
+                for rollup in rollups
             ]
-            return list(self.sessions_collection.aggregate(pipeline))
 
         def get_top_products(self, limit=10):
             """Get top selling products"""
@@ -115,11 +107,3 @@ def init_analytics_manager(db):
             return result[0] if result else None
 
     return AnalyticsManager(db)
-
-def init_analytics(db):
-    """Initialize analytics collections and indexes"""
-    # Create indexes for better query performance
-    db.analytics.create_index([('user_id', 1), ('timestamp', -1)])
-    db.analytics.create_index([('event_type', 1), ('timestamp', -1)])
-    db.shopping_sessions.create_index([('status', 1), ('end_time', -1)])
-    db.shopping_sessions.create_index([('user_id', 1), ('status', 1)]) 
\ No newline at end of file
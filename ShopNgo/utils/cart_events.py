@@ -0,0 +1,127 @@
+from collections import deque
+from flask import current_app
+from utils.uid_codec import decode_item
+import threading
+import queue
+import time
+import os
+
+# Per-session push channel for cart changes. Every mutation publishes a
+# delta whose event id is the version the mutation gave the session
+# document; subscribers receive it on their own queue, and a reconnecting
+# client that sends the last version it saw gets the missed deltas replayed
+# from a short history. When the history does not hold every version since
+# then (it no longer reaches back far enough, or the session was changed
+# somewhere that publishes nothing here) the client gets a full snapshot.
+#
+# Channels live in the worker process, so with several workers clients must
+# be routed by cart affinity (utils/affinity.py).
+
+
+class _Channel:
+    def __init__(self, history_size):
+        self.version = 0
+        self.history = deque(maxlen=history_size)
+        self.subscribers = set()
+        self.last_activity = time.monotonic()
+
+
+class CartEventBus:
+    """In-process publish/subscribe of cart deltas, keyed by session id"""
+
+    def __init__(self, history_size=100, idle_seconds=3600):
+        self.history_size = history_size
+        self.idle_seconds = idle_seconds
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._published = 0
+
+    def _channel(self, session_id):
+        channel = self._channels.get(session_id)
+        if channel is None:
+            channel = self._channels[session_id] = _Channel(self.history_size)
+        channel.last_activity = time.monotonic()
+        return channel
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        for session_id in [session_id for session_id, channel in self._channels.items()
+                           if not channel.subscribers and channel.last_activity < cutoff]:
+            del self._channels[session_id]
+
+    def publish(self, session_id, event_type, data, version=None):
+        """Send one event to every subscriber of session_id; returns its version.
+
+        version is the session document's version after the mutation. Events
+        that do not change the document (checkout, session end) leave it None
+        and follow the latest version seen.
+        """
+        session_id = str(session_id)
+        with self._lock:
+            channel = self._channel(session_id)
+            if version is None:
+                version = channel.version + 1
+            channel.version = max(channel.version, version)
+            event = {"id": version, "event": event_type,
+                     "data": current_app.json.dumps(dict(data, version=version))}
+            channel.history.append(event)
+            for subscriber in channel.subscribers:
+                subscriber.put(event)
+            if event_type == "session_ended":
+                self._channels.pop(session_id, None)
+            self._published += 1
+            if self._published % 1000 == 0:
+                self._prune()
+            return version
+
+    def subscribe(self, session_id, last_version=None):
+        """Register a listener; returns (queue, missed events or None if a snapshot is needed)"""
+        session_id = str(session_id)
+        subscriber = queue.Queue()
+        with self._lock:
+            channel = self._channel(session_id)
+            channel.subscribers.add(subscriber)
+            missed = None
+            if last_version is not None and last_version <= channel.version:
+                events = {event["id"]: event for event in channel.history if event["id"] > last_version}
+                # Replay only if no version in between is missing from the history
+                if len(events) == channel.version - last_version:
+                    missed = [events[version] for version in sorted(events)]
+            return subscriber, missed
+
+    def unsubscribe(self, session_id, subscriber):
+        with self._lock:
+            channel = self._channels.get(str(session_id))
+            if channel:
+                channel.subscribers.discard(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "channels": len(self._channels),
+                "subscribers": sum(len(channel.subscribers) for channel in self._channels.values()),
+                "published": self._published
+            }
+
+
+def format_event(event):
+    """Render an event dict in the text/event-stream wire format"""
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {event['data']}\n\n"
+
+
+def cart_delta(session, product_ids):
+    """Delta for a mutation: the new state of each changed item (None if removed) plus totals"""
+    changes = {}
+    for product_id in product_ids:
+        item = session["items"].get(product_id)
+        changes[product_id] = decode_item(item) if item else None
+    return {
+        "changes": changes,
+        "item_count": session.get("item_count", 0),
+        "total_amount": session["total_amount"]
+    }
+
+
+def init_cart_events():
+    """Initialize the cart event bus"""
+    return CartEventBus(history_size=int(os.getenv("CART_EVENTS_HISTORY", 100)))
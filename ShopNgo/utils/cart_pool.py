@@ -0,0 +1,94 @@
+from collections import deque
+from datetime import datetime
+from pymongo import ReturnDocument
+import threading
+import os
+
+
+class CartPool:
+    """Claims physical carts with a single conditional write.
+
+    Auto-assignment draws candidates from an in-memory pool of carts believed to
+    be free, so concurrent shoppers race for different documents instead of all
+    contending for the first available cart. The pool is only a hint: every
+    claim is still conditional on is_available in MongoDB, and a stale entry
+    simply fails and the next candidate is tried.
+    """
+
+    def __init__(self, db, refill_size=20, registry=None):
+        self.db = db
+        self.refill_size = refill_size
+        self.registry = registry
+        self._free = deque()
+        self._lock = threading.Lock()
+
+    def _claim(self, query, session_id):
+        query = dict(query, is_available=True)
+        cart = self.db.carts.find_one_and_update(
+            query,
+            {"$set": {"is_available": False, "session_id": session_id, "claimed_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        if cart and self.registry:
+            self.registry.mark(cart["_id"], False, session_id)
+        return cart
+
+    def _refill(self):
+        cursor = self.db.carts.find({"is_available": True}, {"_id": 1}).limit(self.refill_size)
+        with self._lock:
+            known = set(self._free)
+            self._free.extend(cart["_id"] for cart in cursor if cart["_id"] not in known)
+
+    def _next_candidate(self):
+        with self._lock:
+            return self._free.popleft() if self._free else None
+
+    def claim_by_barcode(self, barcode, session_id):
+        """Atomically claim the cart with barcode if it is free; returns the cart or None"""
+        return self._claim({"barcode": barcode}, session_id)
+
+    def claim_any(self, session_id):
+        """Atomically claim some free cart; returns the cart or None if every cart is in use"""
+        for attempt in range(2):
+            candidate = self._next_candidate()
+            while candidate is not None:
+                cart = self._claim({"_id": candidate}, session_id)
+                if cart:
+                    return cart
+                candidate = self._next_candidate()
+            if attempt == 0:
+                self._refill()
+        # Pool exhausted: fall back to letting MongoDB pick any free cart
+        return self._claim({}, session_id)
+
+    def release(self, cart_id):
+        """Mark a cart free again and return it to the pool"""
+        self.db.carts.update_one(
+            {"_id": cart_id},
+            {"$set": {"is_available": True}, "$unset": {"session_id": "", "claimed_at": ""}}
+        )
+        if self.registry:
+            self.registry.mark(cart_id, True)
+        with self._lock:
+            if cart_id not in self._free:
+                self._free.append(cart_id)
+
+    def release_many(self, cart_ids):
+        """Mark several carts free with one write and return them to the pool"""
+        if not cart_ids:
+            return
+        self.db.carts.update_many(
+            {"_id": {"$in": cart_ids}},
+            {"$set": {"is_available": True}, "$unset": {"session_id": "", "claimed_at": ""}}
+        )
+        if self.registry:
+            for cart_id in cart_ids:
+                self.registry.mark(cart_id, True)
+        with self._lock:
+            known = set(self._free)
+            self._free.extend(cart_id for cart_id in cart_ids if cart_id not in known)
+
+
+def init_cart_pool(db, registry=None):
+    """Initialize the free-cart pool with database connection"""
+    return CartPool(db, refill_size=int(os.getenv("CART_POOL_REFILL_SIZE", 20)), registry=registry)
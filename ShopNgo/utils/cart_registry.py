@@ -0,0 +1,107 @@
+from datetime import datetime
+from pymongo import DESCENDING
+from pymongo.errors import DuplicateKeyError
+from utils.sequences import SequenceAllocator
+import threading
+import time
+import os
+
+PROJECTION = {"cart_number": 1, "barcode": 1, "is_available": 1, "session_id": 1}
+
+
+class CartRegistry:
+    """In-memory barcode -> cart map for the RFID reader endpoints.
+
+    Cart identity (id, number, barcode) never changes once registered, so it
+    is loaded once at startup. Availability and the claiming session id are
+    kept current by the cart pool, which reports every claim and release made
+    by this process; they are re-read from MongoDB only after ttl seconds, to
+    pick up changes made by other processes.
+    """
+
+    def __init__(self, db, allocator, ttl=30):
+        self.db = db
+        self.allocator = allocator
+        self.ttl = ttl
+        self._by_barcode = {}
+        self._by_id = {}
+        self._lock = threading.Lock()
+
+    def _put(self, cart):
+        entry = {
+            "_id": cart["_id"],
+            "cart_number": cart.get("cart_number"),
+            "barcode": cart.get("barcode"),
+            "is_available": cart.get("is_available", True),
+            "session_id": cart.get("session_id"),
+            "checked_at": time.monotonic()
+        }
+        with self._lock:
+            self._by_barcode[entry["barcode"]] = entry
+            self._by_id[entry["_id"]] = entry
+        return entry
+
+    def warm(self):
+        """Load every cart and seed the cart number sequence past the highest number in use"""
+        for cart in self.db.carts.find({}, PROJECTION):
+            self._put(cart)
+        highest = self.db.carts.find_one({}, {"cart_number": 1}, sort=[("cart_number", DESCENDING)])
+        self.allocator.seed(highest.get("cart_number", 0) if highest else 0)
+        return len(self._by_id)
+
+    def get(self, barcode):
+        """Return the cart registered under barcode, or None"""
+        entry = self._by_barcode.get(barcode)
+        if entry is None:
+            cart = self.db.carts.find_one({"barcode": barcode}, PROJECTION)
+            return self._put(cart) if cart else None
+        if time.monotonic() - entry["checked_at"] > self.ttl:
+            cart = self.db.carts.find_one({"_id": entry["_id"]}, {"is_available": 1, "session_id": 1})
+            if not cart:
+                self.invalidate(entry["_id"])
+                return None
+            self.mark(entry["_id"], cart.get("is_available", True), cart.get("session_id"))
+        return entry
+
+    def register(self, barcode):
+        """Create a cart for an unknown barcode with the next cart number, in one write"""
+        cart = {
+            "cart_number": self.allocator.next(),
+            "barcode": barcode,
+            "is_available": True,
+            "created_at": datetime.utcnow()
+        }
+        try:
+            self.db.carts.insert_one(cart)
+        except DuplicateKeyError:
+            # Another process registered the same barcode first
+            return self.get(barcode)
+        return self._put(cart)
+
+    def mark(self, cart_id, is_available, session_id=None):
+        """Record an availability change made by this process"""
+        entry = self._by_id.get(cart_id)
+        if entry:
+            entry["is_available"] = is_available
+            entry["session_id"] = session_id
+            entry["checked_at"] = time.monotonic()
+
+    def invalidate(self, cart_id):
+        with self._lock:
+            entry = self._by_id.pop(cart_id, None)
+            if entry:
+                self._by_barcode.pop(entry["barcode"], None)
+
+    def stats(self):
+        return {"carts": len(self._by_id), "ttl_seconds": self.ttl}
+
+
+def init_cart_registry(db):
+    """Initialize and warm the cart registry"""
+    registry = CartRegistry(
+        db,
+        SequenceAllocator(db, "cart_number", block_size=int(os.getenv("CART_NUMBER_BLOCK_SIZE", 10))),
+        ttl=int(os.getenv("CART_REGISTRY_TTL", 30))
+    )
+    registry.warm()
+    return registry
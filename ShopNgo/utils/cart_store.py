@@ -0,0 +1,569 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from utils.scan_engine import add_item, add_items, remove_one, toggle_item, build_item, group_by_sku, items_to_map
+from utils.stock_manager import release
+from contextlib import contextmanager
+import threading
+import atexit
+import json
+import time
+import os
+
+# Cart state behind the scan endpoints. MongoCartStore writes every mutation
+# straight to the sessions collection; MemoryCartStore keeps live carts in
+# process memory and writes them back in bulk. Both return the same tuples as
+# utils.scan_engine, so routes do not care which one is configured.
+
+
+class MongoCartStore:
+    """Every mutation is a synchronous conditional write to MongoDB"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def get_active(self, user_email):
+        return self.db.sessions.find_one({"user_email": user_email, "is_active": True})
+
+    def get_version(self, user_email):
+        """Return (session_id, version) of the active session, or None"""
+        session = self.db.sessions.find_one({"user_email": user_email, "is_active": True}, {"version": 1})
+        return (session["_id"], session.get("version", 0)) if session else None
+
+    def add_item(self, user_email, product):
+        return add_item(self.db, user_email, product)
+
+    def add_items(self, user_email, products):
+        return add_items(self.db, user_email, products)
+
+    def remove_one(self, user_email, product_id):
+        return remove_one(self.db, user_email, product_id)
+
+    def toggle_item(self, user_email, product):
+        return toggle_item(self.db, user_email, product)
+
+    def flush(self, user_email=None):
+        pass
+
+    def evict(self, user_email):
+        pass
+
+    def forget(self, session_ids):
+        return 0
+
+    def stats(self):
+        return {"backend": "mongo"}
+
+    def close(self):
+        pass
+
+
+class MemoryCartStore:
+    """Live carts held in memory and written back to sessions asynchronously.
+
+    A mutation changes the in-memory session, appends the resulting item state
+    to a journal file and returns; a flusher thread writes dirty sessions back
+    with one bulk_write every flush_interval seconds, or sooner once
+    flush_threshold sessions are dirty. Checkout and session end flush the one
+    session synchronously first. On start the journal is replayed over MongoDB
+    so a crash loses nothing that reached the journal, and after each flush
+    it is rewritten without the records MongoDB now holds.
+
+    A cached session is trusted on the scan path. Sessions ended behind the
+    store's back are dropped when a flush no longer matches them, when the
+    local reaper reports them (forget) and by a check of every cached session
+    each verify_interval seconds. No MongoDB or journal I/O happens under
+    _lock, which every cart shares.
+
+    Only valid when every request for a cart reaches the same process.
+    """
+
+    def __init__(self, db, journal_path, flush_interval=1.0, flush_threshold=200, fsync=False,
+                 idle_evict_seconds=300, verify_interval=5.0):
+        self.db = db
+        self.journal_path = journal_path
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.fsync = fsync
+        self.idle_evict_seconds = idle_evict_seconds
+        self.verify_interval = verify_interval
+        self._sessions = {}
+        self._dirty = set()
+        self._seq = 0
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._last_verify = time.monotonic()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._metrics = {"flushes": 0, "sessions_written": 0, "lost_sessions": 0, "last_flush_ms": None,
+                         "journal_records": 0}
+        self.recover()
+        self._journal = open(self.journal_path, "a")
+
+    # --- journal ---
+
+    def _next_seq(self):
+        # Time based so sequence numbers keep increasing across restarts
+        self._seq = max(self._seq + 1, time.time_ns())
+        return self._seq
+
+    def _log(self, entry, product_id):
+        """Build the journal line for product_id's new state; _append writes it"""
+        seq = self._next_seq()
+        entry["seq"] = seq
+        entry["dirty"] = True
+        session = entry["session"]
+        record = {
+            "seq": seq,
+            "session_id": str(session["_id"]),
+            "product_id": product_id,
+            "item": session["items"].get(product_id),
+            "item_count": session["item_count"],
+            "total_amount": session["total_amount"],
+            "version": session["version"]
+        }
+        return json.dumps(record, default=str) + "\n"
+
+    def _append(self, lines):
+        # Replay orders records by seq, so lines from concurrent requests may land in any order
+        with self._journal_lock:
+            self._journal.write("".join(lines))
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._metrics["journal_records"] += len(lines)
+
+    def _compact(self):
+        """Rewrite the journal keeping only records newer than their session's last flush"""
+        with self._journal_lock:
+            with self._lock:
+                flushed = {str(entry["session"]["_id"]): entry["flushed_seq"] for entry in self._sessions.values()
+                           if not entry.get("ended")}
+            kept = []
+            with open(self.journal_path) as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    # Sessions no longer cached were flushed, ended or evicted clean
+                    if record["seq"] > flushed.get(record["session_id"], float("inf")):
+                        kept.append(line)
+            temp_path = self.journal_path + ".tmp"
+            with open(temp_path, "w") as temp:
+                temp.write("".join(kept))
+                temp.flush()
+                if self.fsync:
+                    os.fsync(temp.fileno())
+            self._journal.close()
+            os.replace(temp_path, self.journal_path)
+            self._journal = open(self.journal_path, "a")
+            self._metrics["journal_records"] = len(kept)
+
+    def recover(self):
+        """Replay journal records newer than what each active session last flushed"""
+        if not os.path.exists(self.journal_path):
+            return 0
+        records = {}
+        with open(self.journal_path) as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn last line from the crash
+                    continue
+                records.setdefault(record["session_id"], []).append(record)
+
+        operations = []
+        for session_id, session_records in records.items():
+            session = self.db.sessions.find_one({"_id": ObjectId(session_id), "is_active": True})
+            if not session:
+                continue
+            items = session.get("items") or {}
+            if not isinstance(items, dict):
+                items = items_to_map(items)[0]
+            last = None
+            for record in sorted(session_records, key=lambda record: record["seq"]):
+                if record["seq"] <= session.get("store_seq", 0):
+                    continue
+                if record["item"] is None:
+                    items.pop(record["product_id"], None)
+                else:
+                    record["item"]["scanned_at"] = datetime.fromisoformat(str(record["item"]["scanned_at"]))
+                    items[record["product_id"]] = record["item"]
+                last = record
+            if last:
+                operations.append(UpdateOne(
+                    {"_id": session["_id"], "is_active": True},
+                    {"$set": {"items": items, "item_count": last["item_count"],
+                              "total_amount": last["total_amount"], "version": last.get("version", 0),
+                              "store_seq": last["seq"], "updated_at": datetime.utcnow()}}
+                ))
+                self._seq = max(self._seq, last["seq"])
+        if operations:
+            self.db.sessions.bulk_write(operations, ordered=False)
+            print(f"Recovered {len(operations)} cart sessions from {self.journal_path}")
+        open(self.journal_path, "w").close()
+        return len(operations)
+
+    # --- in-memory sessions ---
+
+    def _load(self, user_email):
+        with self._lock:
+            entry = self._sessions.get(user_email)
+        if entry:
+            return entry
+        # Cache miss: read the session without holding the shared lock
+        session = self.db.sessions.find_one({"user_email": user_email, "is_active": True})
+        if not session:
+            return None
+        if not isinstance(session.get("items"), dict):
+            session["items"], session["item_count"], session["total_amount"] = items_to_map(session.get("items") or [])
+        entry = {
+            "session": session,
+            "seq": session.get("store_seq", 0),
+            "flushed_seq": session.get("store_seq", 0),
+            "dirty": False,
+            # Quantities as last written to MongoDB
+            "flushed": {product_id: item["quantity"] for product_id, item in session["items"].items()}
+        }
+        with self._lock:
+            # Another request may have loaded it first
+            return self._sessions.setdefault(user_email, entry)
+
+    @contextmanager
+    def _entry(self, user_email):
+        """Hold _lock over user_email's live cache entry (None without an active session)"""
+        while True:
+            entry = self._load(user_email)
+            self._lock.acquire()
+            if entry is None or not entry.get("ended"):
+                break
+            # Dropped between the load and the lock
+            self._lock.release()
+        try:
+            yield entry
+        finally:
+            self._lock.release()
+
+    def _drop_ended(self, user_email, entry):
+        """Forget a cached session that is no longer active in MongoDB.
+
+        Returns the units only this process knew about, for the caller to
+        release once it no longer holds _lock.
+        """
+        unflushed = []
+        if entry["dirty"]:
+            # Ended before these changes reached MongoDB
+            unflushed = self._unflushed(entry, entry["session"])
+            self._metrics["lost_sessions"] += 1
+        entry["ended"] = True
+        if self._sessions.get(user_email) is entry:
+            del self._sessions[user_email]
+            self._dirty.discard(user_email)
+        return unflushed
+
+    def _snapshot(self, session):
+        snapshot = dict(session)
+        snapshot["items"] = dict(session["items"])
+        return snapshot
+
+    def _changed(self, user_email, entry, product_ids):
+        """Record a mutation; returns the journal lines to _append after releasing _lock"""
+        entry["session"]["updated_at"] = datetime.utcnow()
+        entry["session"]["version"] = entry["session"].get("version", 0) + 1
+        lines = [self._log(entry, product_id) for product_id in product_ids]
+        self._dirty.add(user_email)
+        if len(self._dirty) >= self.flush_threshold:
+            self._wakeup.set()
+        return lines
+
+    def get_active(self, user_email):
+        with self._entry(user_email) as entry:
+            return self._snapshot(entry["session"]) if entry else None
+
+    def get_version(self, user_email):
+        """Return (session_id, version) of the active session, or None"""
+        with self._entry(user_email) as entry:
+            return (entry["session"]["_id"], entry["session"].get("version", 0)) if entry else None
+
+    def add_item(self, user_email, product):
+        with self._entry(user_email) as entry:
+            if not entry:
+                return None, "no_session"
+            session = entry["session"]
+            product_id = str(product["_id"])
+            item = session["items"].get(product_id)
+            if item and product["rfid_tag"] in (item.get("rfid_tags") or []):
+                return self._snapshot(session), "duplicate"
+            if item and item["quantity"] >= product.get("stock_quantity", 0):
+                return None, "stock_limit"
+            if item:
+                item = dict(item, quantity=item["quantity"] + 1, total_price=item["total_price"] + product["price"],
+                            rfid_tag=product["rfid_tag"],
+                            rfid_tags=(item.get("rfid_tags") or []) + [product["rfid_tag"]])
+            else:
+                item = build_item(product)
+            session["items"][product_id] = item
+            session["item_count"] += 1
+            session["total_amount"] += product["price"]
+            lines = self._changed(user_email, entry, [product_id])
+            snapshot = self._snapshot(session)
+        self._append(lines)
+        return snapshot, None
+
+    def add_items(self, user_email, products):
+        with self._entry(user_email) as entry:
+            if not entry:
+                return None, set(), "no_session"
+            session = entry["session"]
+            added = set()
+            changed = []
+            for product_id, (product, rfid_tags) in group_by_sku(products).items():
+                item = session["items"].get(product_id) or build_item(product, quantity=0, total_price=0, rfid_tags=[])
+                known = item.get("rfid_tags") or []
+                new_tags = [rfid_tag for rfid_tag in rfid_tags if rfid_tag not in known]
+                if not new_tags:
+                    continue
+                session["items"][product_id] = dict(item, quantity=item["quantity"] + len(new_tags),
+                                                    total_price=item["total_price"] + len(new_tags) * item["price"],
+                                                    rfid_tags=known + new_tags)
+                session["item_count"] += len(new_tags)
+                session["total_amount"] += len(new_tags) * item["price"]
+                added.update(new_tags)
+                changed.append(product_id)
+            lines = self._changed(user_email, entry, changed) if changed else []
+            snapshot = self._snapshot(session)
+        if lines:
+            self._append(lines)
+        return snapshot, added, None
+
+    def remove_one(self, user_email, product_id):
+        with self._entry(user_email) as entry:
+            if not entry:
+                return None, "no_session"
+            session = entry["session"]
+            item = session["items"].get(product_id)
+            if not item:
+                return None, "not_in_cart"
+            if item["quantity"] > 1:
+                # The most recently scanned tag leaves with the unit
+                known = item.get("rfid_tags") or []
+                session["items"][product_id] = dict(item, quantity=item["quantity"] - 1,
+                                                    total_price=item["total_price"] - item["price"],
+                                                    rfid_tags=known[:item["quantity"] - 1])
+            else:
+                del session["items"][product_id]
+            session["item_count"] -= 1
+            session["total_amount"] -= item["price"]
+            lines = self._changed(user_email, entry, [product_id])
+            snapshot = self._snapshot(session)
+        self._append(lines)
+        return snapshot, None
+
+    def toggle_item(self, user_email, product):
+        with self._entry(user_email) as entry:
+            if not entry:
+                return None, None, 0, "no_session"
+            session = entry["session"]
+            product_id = str(product["_id"])
+            rfid_tag = product["rfid_tag"]
+            item = session["items"].get(product_id)
+            known = (item or {}).get("rfid_tags") or []
+            if rfid_tag in known:
+                # Only the scanned tag's unit leaves the cart
+                if item["quantity"] > 1:
+                    session["items"][product_id] = dict(item, quantity=item["quantity"] - 1,
+                                                        total_price=item["total_price"] - item["price"],
+                                                        rfid_tags=[tag for tag in known if tag != rfid_tag])
+                else:
+                    del session["items"][product_id]
+                session["item_count"] -= 1
+                session["total_amount"] -= item["price"]
+                action = "removed"
+            elif product.get("stock_quantity", 0) <= 0:
+                return None, None, 0, "out_of_stock"
+            else:
+                if item:
+                    session["items"][product_id] = dict(item, quantity=item["quantity"] + 1,
+                                                        total_price=item["total_price"] + product["price"],
+                                                        rfid_tag=rfid_tag, rfid_tags=known + [rfid_tag])
+                else:
+                    session["items"][product_id] = build_item(product, flavor=product.get("flavor"))
+                session["item_count"] += 1
+                session["total_amount"] += product["price"]
+                action = "added"
+            lines = self._changed(user_email, entry, [product_id])
+            snapshot = self._snapshot(session)
+        self._append(lines)
+        return snapshot, action, 1, None
+
+    # --- write-behind ---
+
+    def flush(self, user_email=None):
+        """Write dirty sessions (or just user_email's) back to MongoDB with one bulk write"""
+        with self._flush_lock:
+            started = time.monotonic()
+            with self._lock:
+                emails = [user_email] if user_email else list(self._dirty)
+                pending = []
+                for email in emails:
+                    entry = self._sessions.get(email)
+                    if entry and entry["dirty"]:
+                        pending.append((email, entry, self._snapshot(entry["session"]), entry["seq"]))
+            if not pending:
+                return 0
+
+            operations = [
+                UpdateOne(
+                    {"_id": session["_id"], "is_active": True},
+                    {"$set": {"items": session["items"], "item_count": session["item_count"],
+                              "total_amount": session["total_amount"], "updated_at": session["updated_at"],
+                              "version": session["version"], "store_seq": seq}}
+                )
+                for email, entry, session, seq in pending
+            ]
+            result = self.db.sessions.bulk_write(operations, ordered=False)
+            still_active = None
+            if result.matched_count < len(operations):
+                ids = [session["_id"] for email, entry, session, seq in pending]
+                still_active = {session["_id"] for session in
+                                self.db.sessions.find({"_id": {"$in": ids}, "is_active": True}, {"_id": 1})}
+
+            unflushed = []
+            with self._lock:
+                for email, entry, session, seq in pending:
+                    if still_active is not None and session["_id"] not in still_active:
+                        # Ended elsewhere (e.g. by the reaper) before these changes reached
+                        # MongoDB, unless it was already found out and handled
+                        if not entry.get("ended"):
+                            unflushed += self._drop_ended(email, entry)
+                        continue
+                    entry["flushed"] = {product_id: item["quantity"] for product_id, item in session["items"].items()}
+                    entry["flushed_seq"] = seq
+                    if entry["seq"] == seq:
+                        entry["dirty"] = False
+                        self._dirty.discard(email)
+                self._metrics["flushes"] += 1
+                self._metrics["sessions_written"] += len(pending)
+                self._metrics["last_flush_ms"] = round((time.monotonic() - started) * 1000, 2)
+            release(self.db, unflushed)
+            # Records MongoDB now holds are dropped, so the journal stays as small as the dirty state
+            self._compact()
+            return len(pending)
+
+    def _unflushed(self, entry, session):
+        """The units in session beyond what was last written to MongoDB"""
+        unflushed = []
+        for product_id, item in session["items"].items():
+            quantity = item["quantity"] - entry["flushed"].get(product_id, 0)
+            if quantity > 0:
+                unflushed.append({"product_id": product_id, "quantity": quantity})
+        return unflushed
+
+    def evict(self, user_email):
+        """Forget the in-memory copy of user_email's session once it has ended"""
+        with self._lock:
+            entry = self._sessions.pop(user_email, None)
+            if entry:
+                entry["ended"] = True
+            self._dirty.discard(user_email)
+
+    def forget(self, session_ids):
+        """Drop cached sessions ended outside this store (e.g. by the reaper), releasing unflushed units"""
+        session_ids = set(session_ids)
+        unflushed = []
+        with self._lock:
+            ended = [(email, entry) for email, entry in self._sessions.items()
+                     if entry["session"]["_id"] in session_ids]
+            for email, entry in ended:
+                unflushed += self._drop_ended(email, entry)
+        release(self.db, unflushed)
+        return len(ended)
+
+    def verify_active(self):
+        """Drop every cached session that is no longer active in MongoDB, with one query"""
+        with self._lock:
+            cached = {entry["session"]["_id"] for entry in self._sessions.values()}
+        if not cached:
+            return 0
+        active = {session["_id"] for session in
+                  self.db.sessions.find({"_id": {"$in": list(cached)}, "is_active": True}, {"_id": 1})}
+        return self.forget(cached - active)
+
+    def evict_idle(self):
+        """Drop clean sessions untouched for idle_evict_seconds, so the reaper's view wins"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.idle_evict_seconds)
+        with self._lock:
+            idle = [email for email, entry in self._sessions.items()
+                    if not entry["dirty"] and entry["session"].get("updated_at", cutoff) <= cutoff]
+            for email in idle:
+                del self._sessions[email]
+        return len(idle)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+            stats.update({
+                "backend": "memory",
+                "sessions_cached": len(self._sessions),
+                "sessions_dirty": len(self._dirty),
+                "flush_interval_seconds": self.flush_interval,
+                "flush_threshold": self.flush_threshold,
+                "verify_interval_seconds": self.verify_interval,
+                "journal_path": self.journal_path
+            })
+        return stats
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                self.evict_idle()
+                if time.monotonic() - self._last_verify >= self.verify_interval:
+                    self._last_verify = time.monotonic()
+                    self.verify_active()
+            except Exception as e:
+                print(f"Error flushing cart store: {str(e)}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="cart-store-flush", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the flusher and write back whatever is still dirty"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(5)
+        self.flush()
+        self._journal.close()
+
+
+def init_cart_store(db, shard_index=0):
+    """Initialize the cart state store selected by CART_STORE (mongo or memory).
+
+    The memory store needs CART_STORE_JOURNAL; each shard journals to its own
+    file derived from it, since recovery replays and truncates the whole file.
+    """
+    if os.getenv("CART_STORE", "mongo").lower() != "memory":
+        return MongoCartStore(db)
+    journal = os.getenv("CART_STORE_JOURNAL")
+    if not journal:
+        raise RuntimeError("CART_STORE=memory requires CART_STORE_JOURNAL")
+    store = MemoryCartStore(
+        db,
+        f"{journal}.shard{shard_index}",
+        flush_interval=float(os.getenv("CART_STORE_FLUSH_INTERVAL", 1.0)),
+        flush_threshold=int(os.getenv("CART_STORE_FLUSH_THRESHOLD", 200)),
+        fsync=os.getenv("CART_STORE_FSYNC", "false").lower() == "true",
+        idle_evict_seconds=int(os.getenv("CART_STORE_IDLE_EVICT_SECONDS", 300)),
+        verify_interval=float(os.getenv("CART_STORE_VERIFY_INTERVAL", 5.0))
+    )
+    store.start()
+    atexit.register(store.close)
+    return store
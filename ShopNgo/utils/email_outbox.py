@@ -0,0 +1,253 @@
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from bson import ObjectId
+import queue
+import smtplib
+import threading
+import atexit
+import os
+
+
+class SMTPConnectionPool:
+    """A small pool of authenticated SMTP connections that are reused across messages"""
+
+    def __init__(self, host, port, username=None, password=None, starttls=True, size=2, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            server.starttls()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        return server
+
+    def acquire(self):
+        """Return an idle connection that still answers NOOP, or open a new one"""
+        while True:
+            try:
+                server = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.discard(server)
+
+    def release(self, server):
+        try:
+            self._idle.put_nowait(server)
+        except queue.Full:
+            self.discard(server)
+
+    def discard(self, server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def close(self):
+        while True:
+            try:
+                self.discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+class EmailOutbox:
+    """Persistent outbox in the email_outbox collection, drained by background senders.
+
+    Request threads only insert a queued message. Sender threads claim due
+    messages a batch at a time with one conditional update_many that tags them
+    with a claim token (so several app processes can share one outbox), send
+    each batch over a pooled connection, and retry failures with exponential
+    backoff until max_attempts.
+    """
+
+    def __init__(self, db, pool, sender, workers=2, batch_size=20, max_attempts=5,
+                 retry_base_seconds=5, poll_interval=2.0, lock_seconds=120):
+        self.db = db
+        self.pool = pool
+        self.sender = sender
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.poll_interval = poll_interval
+        self.lock_seconds = lock_seconds
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def enqueue(self, to, subject, html, kind=None):
+        """Queue an HTML email and return its message id"""
+        result = self.db.email_outbox.insert_one({
+            "to": to,
+            "subject": subject,
+            "html": html,
+            "kind": kind,
+            "status": "queued",
+            "attempts": 0,
+            "next_attempt_at": datetime.utcnow(),
+            "created_at": datetime.utcnow()
+        })
+        self._wakeup.set()
+        return result.inserted_id
+
+    def get_status(self, message_id):
+        """Return the delivery status of a queued message, or None if it does not exist"""
+        message = self.db.email_outbox.find_one(
+            {"_id": ObjectId(message_id)},
+            {"to": 1, "status": 1, "attempts": 1, "created_at": 1, "sent_at": 1, "last_error": 1}
+        )
+        if not message:
+            return None
+        return {
+            "message_id": str(message["_id"]),
+            "to": message["to"],
+            "status": message["status"],
+            "attempts": message.get("attempts", 0),
+            "created_at": message["created_at"].isoformat(),
+            "sent_at": message["sent_at"].isoformat() if message.get("sent_at") else None,
+            "last_error": message.get("last_error")
+        }
+
+    def _claim_batch(self):
+        now = datetime.utcnow()
+        due = {"$or": [
+            {"status": "queued", "next_attempt_at": {"$lte": now}},
+            # A sender that died mid-send leaves its lock to expire
+            {"status": "sending", "locked_until": {"$lt": now}}
+        ]}
+        ids = [message["_id"] for message in
+               self.db.email_outbox.find(due, {"_id": 1}).sort("next_attempt_at", 1).limit(self.batch_size)]
+        if not ids:
+            return []
+
+        # The filter is re-applied, so messages another sender claimed since the read are left alone
+        token = ObjectId()
+        self.db.email_outbox.update_many(
+            dict(due, _id={"$in": ids}),
+            {"$set": {"status": "sending", "locked_until": now + timedelta(seconds=self.lock_seconds),
+                      "claim_token": token},
+             "$inc": {"attempts": 1}}
+        )
+        return list(self.db.email_outbox.find({"_id": {"$in": ids}, "claim_token": token}).sort("next_attempt_at", 1))
+
+    def _build(self, message):
+        msg = MIMEMultipart()
+        msg['From'] = self.sender
+        msg['To'] = message["to"]
+        msg['Subject'] = message["subject"]
+        msg.attach(MIMEText(message["html"], 'html'))
+        return msg
+
+    def _mark_sent(self, message):
+        self.db.email_outbox.update_one(
+            {"_id": message["_id"]},
+            {"$set": {"status": "sent", "sent_at": datetime.utcnow()}, "$unset": {"locked_until": ""}}
+        )
+
+    def _mark_failed(self, message, error):
+        if message["attempts"] >= self.max_attempts:
+            update = {"status": "failed"}
+        else:
+            delay = self.retry_base_seconds * 2 ** (message["attempts"] - 1)
+            update = {"status": "queued", "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay)}
+        update["last_error"] = error
+        self.db.email_outbox.update_one({"_id": message["_id"]}, {"$set": update, "$unset": {"locked_until": ""}})
+
+    def _send_batch(self, batch):
+        try:
+            server = self.pool.acquire()
+        except Exception as e:
+            print(f"Error connecting to SMTP server: {str(e)}")
+            for message in batch:
+                self._mark_failed(message, str(e))
+            return
+
+        healthy = True
+        for message in batch:
+            if not healthy:
+                self._mark_failed(message, "SMTP connection lost")
+                continue
+            try:
+                server.send_message(self._build(message))
+                self._mark_sent(message)
+            except smtplib.SMTPRecipientsRefused as e:
+                self._mark_failed(message, str(e))
+            except Exception as e:
+                print(f"Error sending email: {str(e)}")
+                self._mark_failed(message, str(e))
+                healthy = False
+
+        if healthy:
+            self.pool.release(server)
+        else:
+            self.pool.discard(server)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                batch = self._claim_batch()
+                if batch:
+                    self._send_batch(batch)
+                    continue
+            except Exception as e:
+                print(f"Email outbox sender error: {str(e)}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"email-outbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self.pool.close()
+
+
+def init_email_outbox(db):
+    """Initialize the email outbox and start its background senders.
+
+    SENDER_PASSWORD has no default: senders refuse to start without it.
+    Point SMTP_SERVER/SMTP_PORT at a local aiosmtpd instance with
+    SMTP_STARTTLS=false and an empty SENDER_PASSWORD to test without Gmail.
+    """
+    sender = os.getenv("SENDER_EMAIL", "nzezo7251@gmail.com")
+    workers = int(os.getenv("EMAIL_OUTBOX_WORKERS", 2))
+    password = os.getenv("SENDER_PASSWORD")
+    if password is None and workers > 0:
+        raise RuntimeError("SENDER_PASSWORD is not set (set EMAIL_OUTBOX_WORKERS=0 to run without sending email)")
+    pool = SMTPConnectionPool(
+        os.getenv("SMTP_SERVER", "smtp.gmail.com"),
+        int(os.getenv("SMTP_PORT", 587)),
+        username=sender,
+        password=password,
+        starttls=os.getenv("SMTP_STARTTLS", "true").lower() == "true",
+        size=workers
+    )
+    outbox = EmailOutbox(
+        db, pool, sender,
+        workers=workers,
+        batch_size=int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", 20)),
+        max_attempts=int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", 5))
+    )
+    if workers > 0:
+        outbox.start()
+        atexit.register(outbox.stop)
+    return outbox
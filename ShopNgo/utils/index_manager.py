@@ -0,0 +1,360 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, DuplicateKeyError
+from utils.scan_engine import migrate_session_items
+from utils.stock_manager import rebuild_reservations
+from utils.session_view import backfill_session_read_model
+from utils.uid_codec import migrate_uids
+from utils.tag_registry import copy_product_tags
+import time
+
+# Every index the application relies on is declared here, grouped into
+# numbered migrations. apply_migrations() creates whatever is missing from
+# migrations newer than the version recorded in schema_migrations, and runs
+# the migration's optional data step, so a restart on an up-to-date database
+# costs a single find_one. Only the process holding the migrations_lock lease
+# applies migrations; other workers starting at the same time wait for it.
+# Data steps can take minutes, so they only run from
+# scripts/migrate_indexes.py: app startup creates indexes and refuses to
+# start while a data step is pending.
+MIGRATIONS = [
+    {
+        "version": 1,
+        "description": "Hot-path indexes for sessions, products, carts, orders, OTPs and users",
+        "indexes": {
+            "sessions": [
+                IndexModel([("user_email", ASCENDING)], name="active_by_user",
+                           partialFilterExpression={"is_active": True}),
+                IndexModel([("cart_id", ASCENDING)], name="active_by_cart",
+                           partialFilterExpression={"is_active": True}),
+            ],
+            "products": [
+                IndexModel([("rfid_tag", ASCENDING)], name="rfid_tag_unique", unique=True),
+            ],
+            "carts": [
+                IndexModel([("barcode", ASCENDING)], name="barcode_unique", unique=True),
+            ],
+            "orders": [
+                IndexModel([("user_email", ASCENDING), ("created_at", DESCENDING)], name="by_user_recent"),
+                IndexModel([("created_at", DESCENDING)], name="recent"),
+            ],
+            "checkout_otps": [
+                IndexModel([("user_email", ASCENDING)], name="by_user"),
+            ],
+            "users": [
+                IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+            ],
+            "analytics": [
+                IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING)]),
+                IndexModel([("event_type", ASCENDING), ("timestamp", DESCENDING)]),
+            ],
+            "shopping_sessions": [
+                IndexModel([("status", ASCENDING), ("end_time", DESCENDING)]),
+                IndexModel([("user_id", ASCENDING), ("status", ASCENDING)]),
+            ],
+        }
+    },
+    {
+        "version": 2,
+        "description": "Store active session items as a map keyed by product_id",
+        "indexes": {},
+        "migrate": migrate_session_items
+    },
+    {
+        "version": 3,
+        "description": "Email outbox claim index",
+        "indexes": {
+            "email_outbox": [
+                IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="due"),
+            ],
+        }
+    },
+    {
+        "version": 4,
+        "description": "Stock reservations: idle session index and reserved_quantity backfill",
+        "indexes": {
+            "sessions": [
+                IndexModel([("updated_at", ASCENDING)], name="active_by_idle",
+                           partialFilterExpression={"is_active": True}),
+            ],
+        },
+        "migrate": rebuild_reservations
+    },
+    {
+        "version": 5,
+        "description": "Keyset pagination indexes for order history",
+        "indexes": {
+            "orders": [
+                IndexModel([("user_email", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                           name="by_user_keyset"),
+                IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="keyset"),
+            ],
+        },
+        # The keyset indexes cover every query the old ones served
+        "drop": {"orders": ["by_user_recent", "recent"]}
+    },
+    {
+        "version": 6,
+        "description": "Copy cart_number onto active sessions for the session read model",
+        "indexes": {},
+        "migrate": backfill_session_read_model
+    },
+    {
+        "version": 7,
+        "description": "Store RFID tags on products and active session items as 64-bit integers",
+        "indexes": {},
+        "migrate": migrate_uids
+    },
+    {
+        "version": 8,
+        "description": "Tag registry mapping RFID tags to SKUs",
+        "indexes": {
+            "tags": [
+                IndexModel([("product_id", ASCENDING)], name="by_product"),
+            ],
+        },
+        # Tags resolve through tags._id; the products left holding an rfid_tag
+        # are merged into SKUs by scripts/migrate_to_skus.py
+        "drop": {"products": ["rfid_tag_unique"]},
+        "migrate": copy_product_tags
+    },
+    {
+        "version": 9,
+        "description": "Hourly and daily sales rollups for the admin dashboards",
+        "indexes": {
+            "sales_rollups": [
+                IndexModel([("granularity", ASCENDING), ("period_start", ASCENDING)], name="by_period"),
+            ],
+        },
+        # Rollups of past orders are built by scripts/backfill_sales_rollups.py, off the startup path
+    },
+    {
+        "version": 10,
+        "description": "Orders not yet counted into the sales rollups",
+        "indexes": {
+            "orders": [
+                IndexModel([("rollup_pending", ASCENDING), ("created_at", ASCENDING)], name="rollup_pending",
+                           partialFilterExpression={"rollup_pending": True}),
+            ],
+        },
+    },
+]
+
+# Representative hot-path queries checked by report_collscans()
+HOT_QUERIES = [
+    ("active session by user", "sessions", {"user_email": "", "is_active": True}, None),
+    ("active session by cart", "sessions", {"cart_id": ObjectId(), "is_active": True}, None),
+    ("idle active sessions", "sessions", {"is_active": True, "updated_at": {"$lt": datetime(2000, 1, 1)}}, None),
+    ("SKU by RFID tag", "tags", {"_id": 0}, None),
+    ("tags of a SKU", "tags", {"product_id": ObjectId()}, None),
+    ("cart by barcode", "carts", {"barcode": ""}, None),
+    ("order history by user", "orders", {"user_email": ""}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("all orders, newest first", "orders", {}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("orders in window", "orders", {"created_at": {"$gte": datetime(2000, 1, 1)}}, None),
+    ("pending checkout OTP", "checkout_otps", {"user_email": "", "verified": False}, None),
+    ("user by email", "users", {"email": ""}, None),
+    ("sales rollups in window", "sales_rollups",
+     {"granularity": "day", "period_start": {"$gte": datetime(2000, 1, 1)}}, None),
+    ("orders awaiting rollup", "orders", {"rollup_pending": True, "created_at": {"$lt": datetime(2000, 1, 1)}}, None),
+]
+
+LATEST_VERSION = MIGRATIONS[-1]["version"]
+
+# How long a process may hold the migrations lock before another may take it over
+MIGRATION_LEASE = timedelta(minutes=10)
+
+# Indexes a later migration drops are never (re)created by an earlier one
+SUPERSEDED = {
+    (collection_name, name)
+    for migration in MIGRATIONS
+    for collection_name, names in migration.get("drop", {}).items()
+    for name in names
+}
+
+
+def _index_signature(key, options):
+    partial = options.get("partialFilterExpression")
+    return (tuple((field, int(direction) if isinstance(direction, (int, float)) else direction)
+                  for field, direction in key),
+            bool(options.get("unique", False)),
+            repr(dict(partial)) if partial else None)
+
+
+def _existing_signatures(collection):
+    signatures = set()
+    for info in collection.index_information().values():
+        signatures.add(_index_signature(info["key"], info))
+    return signatures
+
+
+def get_applied_version(db):
+    """Return the index schema version recorded in the database (0 if none)"""
+    record = db.schema_migrations.find_one({"_id": "indexes"})
+    return record["version"] if record else 0
+
+
+def _create_missing_indexes(db, migration, report):
+    """Create the migration's missing indexes and drop the ones it supersedes; returns False on failure"""
+    failed = False
+    for collection_name, indexes in migration["indexes"].items():
+        collection = db[collection_name]
+        existing = _existing_signatures(collection)
+        missing = [index for index in indexes
+                   if (collection_name, index.document.get("name")) not in SUPERSEDED
+                   and _index_signature(index.document["key"].items(), index.document) not in existing]
+        for index in missing:
+            name = f"{collection_name}.{index.document['name']}"
+            try:
+                collection.create_indexes([index])
+                report["created"].append(name)
+            except OperationFailure as e:
+                # e.g. duplicate barcode values blocking a unique index
+                failed = True
+                report["failed"].append({"index": name, "error": str(e)})
+                print(f"Failed to create index {name}: {str(e)}")
+
+    if failed:
+        return False
+
+    for collection_name, names in migration.get("drop", {}).items():
+        collection = db[collection_name]
+        for name in set(names) & set(collection.index_information()):
+            collection.drop_index(name)
+            report["dropped"].append(f"{collection_name}.{name}")
+    return True
+
+
+def _print_report(report):
+    if report["created"]:
+        print(f"Created {len(report['created'])} indexes: {', '.join(report['created'])}")
+    if report["dropped"]:
+        print(f"Dropped {len(report['dropped'])} superseded indexes: {', '.join(report['dropped'])}")
+
+
+def verify_indexes(db):
+    """Check every declared index, creating missing ones, without running data steps or recording a version"""
+    version = get_applied_version(db)
+    report = {"from_version": version, "version": version, "created": [], "dropped": [], "failed": []}
+    for migration in MIGRATIONS:
+        _create_missing_indexes(db, migration, report)
+    _print_report(report)
+    return report
+
+
+def _acquire_lock(db, owner):
+    """Claim or renew the migrations lease; returns False while another process holds it"""
+    now = datetime.utcnow()
+    try:
+        db.schema_migrations.find_one_and_update(
+            {"_id": "migrations_lock", "$or": [{"expires_at": {"$lt": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "expires_at": now + MIGRATION_LEASE}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The lock document exists and its lease is held by someone else
+        return False
+    return True
+
+
+def _release_lock(db, owner):
+    db.schema_migrations.delete_one({"_id": "migrations_lock", "owner": owner})
+
+
+def pending_data_steps(db, applied_version=None):
+    """Return the versions of unapplied migrations that carry a data step"""
+    if applied_version is None:
+        applied_version = get_applied_version(db)
+    return [migration["version"] for migration in MIGRATIONS
+            if migration["version"] > applied_version and migration.get("migrate")]
+
+
+def apply_migrations(db, verify_all=False, wait_seconds=None, run_data_steps=True):
+    """Create any missing indexes from migrations newer than the recorded version.
+
+    With verify_all every declared index is checked instead (see
+    verify_indexes). Without run_data_steps (app startup) a pending data
+    step raises RuntimeError before anything is applied. While another
+    process holds the migrations lease this waits up to wait_seconds
+    (default: one lease) for it to finish. Returns a dict with the resulting
+    version and what was created or failed.
+    """
+    if verify_all:
+        return verify_indexes(db)
+
+    applied_version = get_applied_version(db)
+    report = {"from_version": applied_version, "version": applied_version, "created": [], "dropped": [], "failed": []}
+    if applied_version >= LATEST_VERSION:
+        return report
+
+    pending = pending_data_steps(db, applied_version)
+    if pending and not run_data_steps:
+        raise RuntimeError(f"Index migrations {', '.join(map(str, pending))} have pending data steps; "
+                           f"run scripts/migrate_indexes.py before starting the app")
+
+    owner = str(ObjectId())
+    deadline = time.monotonic() + (MIGRATION_LEASE.total_seconds() if wait_seconds is None else wait_seconds)
+    while not _acquire_lock(db, owner):
+        if get_applied_version(db) >= LATEST_VERSION or time.monotonic() >= deadline:
+            report["version"] = get_applied_version(db)
+            return report
+        time.sleep(1)
+
+    try:
+        # Another process may have finished while this one waited for the lease
+        applied_version = get_applied_version(db)
+        report["version"] = applied_version
+        for migration in MIGRATIONS:
+            if migration["version"] <= applied_version:
+                continue
+
+            if not _create_missing_indexes(db, migration, report):
+                # Leave the version where it is so the next start retries
+                break
+
+            if migration.get("migrate"):
+                print(f"Running data migration {migration['version']}: {migration['description']}")
+                migration["migrate"](db)
+
+            report["version"] = migration["version"]
+            db.schema_migrations.update_one(
+                {"_id": "indexes"},
+                {
+                    "$set": {"version": migration["version"], "applied_at": datetime.utcnow()},
+                    "$push": {"history": {
+                        "version": migration["version"],
+                        "description": migration["description"],
+                        "applied_at": datetime.utcnow()
+                    }}
+                },
+                upsert=True
+            )
+            # Extend the lease before the next, possibly long, data step
+            _acquire_lock(db, owner)
+    finally:
+        _release_lock(db, owner)
+
+    _print_report(report)
+    return report
+
+
+def _plan_stages(plan):
+    yield plan.get("stage")
+    for child in plan.get("inputStages", []) + ([plan["inputStage"]] if "inputStage" in plan else []):
+        yield from _plan_stages(child)
+
+
+def report_collscans(db):
+    """Explain every hot-path query and return the ones whose winning plan is a COLLSCAN"""
+    collscans = []
+    for name, collection_name, query, sort in HOT_QUERIES:
+        command = {"find": collection_name, "filter": query}
+        if sort:
+            command["sort"] = dict(sort)
+        explain = db.command("explain", command, verbosity="queryPlanner")
+        winning_plan = explain["queryPlanner"]["winningPlan"]
+        # Sharded clusters wrap the per-shard plans
+        plans = [shard["winningPlan"] for shard in winning_plan.get("shards", [])] or [winning_plan]
+        if any("COLLSCAN" in _plan_stages(plan.get("queryPlan", plan)) for plan in plans):
+            collscans.append({"query": name, "collection": collection_name, "filter": str(query)})
+    return collscans
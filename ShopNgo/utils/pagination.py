@@ -0,0 +1,86 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import DESCENDING
+from utils.uid_codec import decode_items
+import base64
+import json
+
+# Keyset pagination over (created_at, _id), newest first. Each page is one
+# indexed range scan that stops after limit + 1 documents, so the cost of a
+# page does not grow with how far into the history it is. The continuation
+# token is the sort key of the last document served, base64 encoded so
+# clients treat it as opaque.
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+KEYSET_SORT = [("created_at", DESCENDING), ("_id", DESCENDING)]
+
+# Order fields returned by default; items (the heavy part) only with include=items
+ORDER_SUMMARY_FIELDS = {
+    "user_email": 1,
+    "order_number": 1,
+    "total_amount": 1,
+    "item_count": 1,
+    "payment_method": 1,
+    "card_number": 1,
+    "status": 1,
+    "created_at": 1
+}
+
+
+def encode_cursor(doc):
+    """Build the continuation token pointing just past doc"""
+    key = {"created_at": doc["created_at"].isoformat(), "_id": str(doc["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(token):
+    """Return the (created_at, _id) sort key in token; raises ValueError if it is malformed"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.fromisoformat(key["created_at"]), ObjectId(key["_id"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def page_size(value):
+    """Parse the requested page size, clamped to 1..MAX_PAGE_SIZE; raises ValueError if not a number"""
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(value), MAX_PAGE_SIZE))
+
+
+def order_projection(include):
+    """Projection for order listings; include is the comma separated include= argument"""
+    fields = {field.strip() for field in (include or "").split(",")}
+    projection = dict(ORDER_SUMMARY_FIELDS)
+    if "items" in fields:
+        projection["items"] = 1
+    return projection
+
+
+def keyset_page(collection, query, cursor=None, limit=DEFAULT_PAGE_SIZE, projection=None):
+    """Fetch one page of collection newest first; returns (docs, next_cursor or None)"""
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        query = {"$and": [query, {"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": last_id}}
+        ]}]}
+    docs = list(collection.find(query, projection).sort(KEYSET_SORT).limit(limit + 1))
+    if len(docs) > limit:
+        docs = docs[:limit]
+        return docs, encode_cursor(docs[-1])
+    return docs, None
+
+
+def serialize_order(order):
+    """Make an order JSON-safe and mask its card number"""
+    order["_id"] = str(order["_id"])
+    order["created_at"] = order["created_at"].isoformat() if order.get("created_at") else None
+    if order.get("items"):
+        order["items"] = decode_items(order["items"])
+    if order.get("card_number"):
+        order["card_number"] = "****" + order["card_number"][-4:]
+    return order
@@ -0,0 +1,207 @@
+from collections import OrderedDict
+from bson import ObjectId
+import threading
+import time
+import os
+
+# Every scan moves these reservation-ledger fields, which cached documents
+# are never read for (reserve() checks them in MongoDB), so updates touching
+# nothing else are filtered out of the change stream
+LEDGER_FIELDS = ["reserved_quantity", "recent_ops"]
+
+CHANGE_PIPELINE = [
+    {"$match": {"$or": [
+        {"ns.coll": {"$in": ["products", "tags"]}},
+        {"operationType": {"$in": ["dropDatabase", "invalidate"]}}
+    ]}},
+    {"$match": {"$or": [
+        {"operationType": {"$ne": "update"}},
+        {"ns.coll": "tags"},
+        {"updateDescription.removedFields.0": {"$exists": True}},
+        {"$expr": {"$gt": [{"$size": {"$filter": {
+            "input": {"$objectToArray": "$updateDescription.updatedFields"},
+            # Array updates are reported per element, e.g. "recent_ops.3"
+            "cond": {"$eq": [{"$in": [{"$arrayElemAt": [{"$split": ["$$this.k", "."]}, 0]}, LEDGER_FIELDS]}, False]}
+        }}}, 0]}}
+    ]}},
+    {"$project": {"operationType": 1, "ns": 1, "documentKey": 1}}
+]
+
+
+class ProductCache:
+    """Bounded LRU + TTL cache of SKU documents by _id, and of the tag -> SKU registry.
+
+    Tags are looked up in the tags collection (see utils/tag_registry.py) and
+    the SKU by its _id, so every tag of a SKU shares one cached document.
+    Lookups by tag return a copy of the product carrying the scanned tag as
+    its rfid_tag; documents from get_by_id are shared between requests and
+    must be treated as read-only.
+    """
+
+    def __init__(self, db, max_size=5000, ttl_seconds=300, tag_filter=None):
+        self.db = db
+        # Optional utils.tag_filter.TagFilter: tags it rules out skip MongoDB
+        self.tag_filter = tag_filter
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._listener = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, product = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return product
+
+    def _put(self, key, value):
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _product_ids_by_tag(self, rfid_tags):
+        """Map tags to SKU ids from the cache, then the registry for the rest, in one $in query"""
+        product_ids = {}
+        missing = []
+        for rfid_tag in rfid_tags:
+            product_id = self._get(("tag", rfid_tag))
+            if product_id is None:
+                missing.append(rfid_tag)
+            else:
+                product_ids[rfid_tag] = product_id
+        if self.tag_filter:
+            missing = self.tag_filter.candidates(missing)
+        if missing:
+            query = {"_id": missing[0]} if len(missing) == 1 else {"_id": {"$in": missing}}
+            fetched = 0
+            for tag in self.db.tags.find(query, {"product_id": 1}):
+                self._put(("tag", tag["_id"]), tag["product_id"])
+                product_ids[tag["_id"]] = tag["product_id"]
+                fetched += 1
+            if self.tag_filter and fetched < len(missing):
+                self.tag_filter.record_false_positive(len(missing) - fetched)
+        return product_ids
+
+    def get_by_tag(self, rfid_tag):
+        """Resolve an encoded RFID tag (see utils/uid_codec.py) to its SKU, or None"""
+        return self.get_many_by_tag([rfid_tag]).get(rfid_tag)
+
+    def get_many_by_tag(self, rfid_tags):
+        """Resolve several RFID tags at once, with at most one registry and one products query.
+
+        Returns a dict of rfid_tag -> product for the tags that resolved.
+        """
+        product_ids = self._product_ids_by_tag(rfid_tags)
+        products = {}
+        missing = []
+        for product_id in set(product_ids.values()):
+            product = self._get(("id", str(product_id)))
+            if product is None:
+                missing.append(product_id)
+            else:
+                products[product_id] = product
+        if missing:
+            for product in self.db.products.find({"_id": {"$in": missing}}):
+                self._put(("id", str(product["_id"])), product)
+                products[product["_id"]] = product
+        return {
+            rfid_tag: dict(products[product_id], rfid_tag=rfid_tag)
+            for rfid_tag, product_id in product_ids.items()
+            if product_id in products
+        }
+
+    def get_by_id(self, product_id):
+        """Resolve a product _id (string or ObjectId) to its product"""
+        product = self._get(("id", str(product_id)))
+        if product is None:
+            product = self.db.products.find_one({"_id": ObjectId(product_id)})
+            if product:
+                self._put(("id", str(product["_id"])), product)
+        return product
+
+    def invalidate(self, product_id=None, rfid_tag=None):
+        """Drop a SKU by _id and/or a tag's registry entry from the cache"""
+        with self._lock:
+            keys = []
+            if product_id is not None:
+                keys.append(("id", str(product_id)))
+            if rfid_tag is not None:
+                keys.append(("tag", rfid_tag))
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counters for sizing the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "change_stream": self._listener is not None and self._listener.is_alive()
+            }
+
+    def start_change_listener(self):
+        """Invalidate entries from a products/tags change stream (requires a replica set)"""
+        if self._listener is not None:
+            return
+        self._listener = threading.Thread(target=self._watch_catalog, daemon=True)
+        self._listener.start()
+
+    def _handle_change(self, change):
+        """Drop whatever a products or tags change event makes stale"""
+        if change.get("operationType") in ("drop", "dropDatabase", "rename", "invalidate"):
+            self.clear()
+            return
+        key = change.get("documentKey", {}).get("_id")
+        if change.get("ns", {}).get("coll") == "tags":
+            self.invalidate(rfid_tag=key)
+        else:
+            self.invalidate(product_id=key)
+
+    def _watch_catalog(self):
+        try:
+            with self.db.watch(CHANGE_PIPELINE) as stream:
+                for change in stream:
+                    self._handle_change(change)
+        except Exception as e:
+            print(f"Product cache change stream stopped: {str(e)}")
+
+def init_product_cache(db, tag_filter=None):
+    """Initialize the shared product cache with database connection"""
+    cache = ProductCache(
+        db,
+        max_size=int(os.getenv("PRODUCT_CACHE_SIZE", 5000)),
+        ttl_seconds=int(os.getenv("PRODUCT_CACHE_TTL", 300)),
+        tag_filter=tag_filter
+    )
+    if os.getenv("PRODUCT_CACHE_CHANGE_STREAM", "false").lower() == "true":
+        cache.start_change_listener()
+    return cache
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from functools import wraps
+from flask import request, jsonify, current_app
+import threading
+import time
+import os
+
+
+class ReadDeduplicator:
+    """Suppress repeated reports of the same tag from one reader within a time window.
+
+    Each reader keeps a bounded, insertion-ordered map of tag -> last forwarded
+    read, and the set of tracked readers is itself bounded, so memory stays
+    flat no matter how many tags pass through the field.
+    """
+
+    def __init__(self, window_ms=750, max_tags_per_reader=256, max_readers=1024):
+        self.window = window_ms / 1000.0
+        self.max_tags_per_reader = max_tags_per_reader
+        self.max_readers = max_readers
+        self._readers = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _reader(self, reader_id):
+        reads = self._readers.get(reader_id)
+        if reads is None:
+            reads = self._readers[reader_id] = OrderedDict()
+            while len(self._readers) > self.max_readers:
+                evicted, _ = self._readers.popitem(last=False)
+                self._counters.pop(evicted, None)
+        self._readers.move_to_end(reader_id)
+        return reads
+
+    def _count(self, reader_id, key):
+        counters = self._counters.setdefault(reader_id, {"forwarded": 0, "suppressed": 0})
+        counters[key] += 1
+
+    def lookup(self, reader_id, tag):
+        """Return the response forwarded for tag within the window, or None if the read is new"""
+        now = time.monotonic()
+        with self._lock:
+            reads = self._reader(reader_id)
+            entry = reads.get(tag)
+            if entry is not None and now - entry[0] < self.window:
+                self._count(reader_id, "suppressed")
+                return entry[1]
+            self._count(reader_id, "forwarded")
+            return None
+
+    def remember(self, reader_id, tag, response):
+        """Record the response forwarded for tag so repeats can be answered from memory"""
+        with self._lock:
+            self._store(self._reader(reader_id), tag, time.monotonic(), response)
+
+    def _store(self, reads, tag, seen_at, response):
+        reads.pop(tag, None)
+        reads[tag] = (seen_at, response)
+        while len(reads) > self.max_tags_per_reader:
+            reads.popitem(last=False)
+
+    def stats(self):
+        """Suppressed versus forwarded counts per reader"""
+        with self._lock:
+            readers = {reader_id: dict(counters) for reader_id, counters in self._counters.items()}
+            return {
+                "window_ms": int(self.window * 1000),
+                "readers": readers,
+                "forwarded": sum(c["forwarded"] for c in readers.values()),
+                "suppressed": sum(c["suppressed"] for c in readers.values())
+            }
+
+
+def init_read_dedup():
+    """Initialize the RFID duplicate-read filter"""
+    return ReadDeduplicator(
+        window_ms=int(os.getenv("RFID_DEDUP_WINDOW_MS", 750)),
+        max_tags_per_reader=int(os.getenv("RFID_DEDUP_TAGS_PER_READER", 256))
+    )
+
+
+def reader_id_for(data):
+    """Identify the reporting reader from the body, a header, or the remote address"""
+    return data.get("reader_id") or request.headers.get("X-Reader-Id") or request.remote_addr
+
+
+def suppress_duplicate_reads(field):
+    """Answer repeated reads of the same data[field] from one reader without running the handler"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            data = request.get_json(silent=True) or {}
+            tag = data.get(field)
+            if not tag or not isinstance(tag, str):
+                return f(*args, **kwargs)
+
+            dedup = current_app.read_dedup
+            reader_id = reader_id_for(data)
+            cached = dedup.lookup(reader_id, tag)
+            if cached is not None:
+                payload, status = cached
+                return jsonify(dict(payload, suppressed=True)), status
+
+            response = f(*args, **kwargs)
+            body, status = response if isinstance(response, tuple) else (response, 200)
+            # Server errors are never replayed
+            if status < 500:
+                dedup.remember(reader_id, tag, (body.get_json(), status))
+            return response
+        return decorated
+    return decorator
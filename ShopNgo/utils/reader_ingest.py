@@ -0,0 +1,98 @@
+from utils import rfid_frames
+from utils.scan_engine import MAX_BATCH_TAGS
+from utils.uid_codec import decode_uid
+
+# Reader-facing cart and product resolution, shared by the Flask RFID routes
+# and the standalone asyncio gateway (scripts/reader_gateway.py), so both
+# ingestion paths answer a read the same way.
+
+
+class ReaderIngest:
+    """Resolves reader UIDs against carts and products, with duplicate-read suppression"""
+
+    def __init__(self, db, product_cache, read_dedup, cart_registry, cart_pool):
+        self.db = db
+        self.product_cache = product_cache
+        self.read_dedup = read_dedup
+        self.cart_registry = cart_registry
+        self.cart_pool = cart_pool
+
+    def resolve_cart(self, uid):
+        """Find (or register) the cart for uid; returns (cart, status, session_id)"""
+        cart = self.cart_registry.get(uid)
+        if not cart:
+            # If no cart found, create a new cart entry (for testing)
+            cart = self.cart_registry.register(uid)
+            print(f"Created new cart entry for UID: {uid}")
+
+        if cart.get("is_available", True):
+            return cart, "available", None
+
+        # Cart is in use; claims record the session on the cart, older ones need a lookup
+        session_id = cart.get("session_id")
+        if not session_id:
+            active_session = self.db.sessions.find_one({"cart_id": cart["_id"], "is_active": True}, {"_id": 1})
+            session_id = active_session["_id"] if active_session else None
+        if session_id:
+            return cart, "in_use", session_id
+
+        # Mark cart as available if no active session
+        self.cart_pool.release(cart["_id"])
+        return cart, "now_available", None
+
+    def process_frame(self, frame):
+        """Return one (status, value) result per UID in frame (UIDs already encoded by decode_frames)"""
+        if len(frame.uids) > MAX_BATCH_TAGS:
+            raise ValueError(f"At most {MAX_BATCH_TAGS} UIDs per frame")
+        reader_id = f"frame:{frame.reader_id}"
+        results = [None] * len(frame.uids)
+
+        # Repeats within the dedup window are answered from memory
+        fresh = []
+        for i, uid in enumerate(frame.uids):
+            cached = self.read_dedup.lookup(reader_id, uid)
+            if cached is not None:
+                results[i] = (cached[0] | rfid_frames.STATUS_SUPPRESSED, cached[1])
+            else:
+                fresh.append(i)
+
+        if frame.kind == rfid_frames.KIND_CART:
+            for i in fresh:
+                # Carts are registered under the hex UID as their barcode
+                cart, status, session_id = self.resolve_cart(decode_uid(frame.uids[i]))
+                code = rfid_frames.STATUS_IN_USE if status == "in_use" else rfid_frames.STATUS_OK
+                results[i] = (code, cart.get("cart_number") or 0)
+        else:
+            # Resolve every new tag in the frame with at most one $in query
+            products = self.product_cache.get_many_by_tag({frame.uids[i] for i in fresh})
+            seen = set()
+            for i in fresh:
+                uid = frame.uids[i]
+                product = products.get(uid)
+                if uid in seen:
+                    results[i] = (rfid_frames.STATUS_DUPLICATE, 0)
+                elif not product:
+                    results[i] = (rfid_frames.STATUS_UNKNOWN, 0)
+                elif product.get("stock_quantity", 0) <= 0:
+                    results[i] = (rfid_frames.STATUS_OUT_OF_STOCK, 0)
+                else:
+                    results[i] = (rfid_frames.STATUS_OK, int(round(product["price"] * 100)))
+                seen.add(uid)
+
+        for i in fresh:
+            if results[i][0] != rfid_frames.STATUS_DUPLICATE:
+                self.read_dedup.remember(reader_id, frame.uids[i], results[i])
+        return results
+
+    def process_frames(self, frames):
+        """Process a batch of frames and return their acks, in order"""
+        # Warm the product cache for the whole batch with one $in query
+        tags = {uid for frame in frames if frame.kind == rfid_frames.KIND_PRODUCT for uid in frame.uids}
+        if tags:
+            self.product_cache.get_many_by_tag(tags)
+        return [rfid_frames.encode_ack(frame, self.process_frame(frame)) for frame in frames]
+
+
+def init_reader_ingest(db, product_cache, read_dedup, cart_registry, cart_pool):
+    """Initialize the shared reader ingestion logic"""
+    return ReaderIngest(db, product_cache, read_dedup, cart_registry, cart_pool)
@@ -0,0 +1,110 @@
+from collections import namedtuple
+from utils.uid_codec import encode_uid, decode_uid
+import struct
+
+# Compact binary wire format for ESP32 readers (all integers little-endian).
+#
+# Request body: one or more frames back to back.
+#   header  2s magic b"SG" | B version | B kind | I reader_id | I seq | Q timestamp_ms | B uid_count
+#   uids    uid_count x (B length | length bytes of raw UID)
+#
+# Ack body: one ack per frame, in order.
+#   header  2s magic b"SG" | B version | B kind | 0x80 | I seq | B result_count
+#   results result_count x (B status | I value)
+#
+# value is the cart number for cart frames and the price in cents for
+# product frames. STATUS_SUPPRESSED is or-ed into the status of a read the
+# duplicate filter answered from memory.
+
+MAGIC = b"SG"
+VERSION = 1
+
+KIND_CART = 1
+KIND_PRODUCT = 2
+KIND_ACK = 0x80
+
+HEADER = struct.Struct("<2sBBIIQB")
+ACK_HEADER = struct.Struct("<2sBBIB")
+RESULT = struct.Struct("<BI")
+
+STATUS_OK = 0
+STATUS_IN_USE = 1
+STATUS_UNKNOWN = 2
+STATUS_OUT_OF_STOCK = 3
+STATUS_DUPLICATE = 4
+STATUS_SUPPRESSED = 0x80
+
+Frame = namedtuple("Frame", ["kind", "reader_id", "seq", "timestamp_ms", "uids"])
+
+
+def decode_frames(data):
+    """Parse every frame in data; raises ValueError on a malformed body.
+
+    UIDs are encoded straight from a memoryview over the body into the
+    integer form tags are stored in (see utils/uid_codec.py), with no hex
+    text in between.
+    """
+    view = memoryview(data)
+    frames = []
+    offset = 0
+    while offset < len(view):
+        if len(view) - offset < HEADER.size:
+            raise ValueError("Truncated frame header")
+        magic, version, kind, reader_id, seq, timestamp_ms, count = HEADER.unpack_from(view, offset)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Unsupported frame")
+        if kind not in (KIND_CART, KIND_PRODUCT):
+            raise ValueError(f"Unknown frame kind {kind}")
+        offset += HEADER.size
+        uids = []
+        for i in range(count):
+            if offset >= len(view):
+                raise ValueError("Truncated UID")
+            length = view[offset]
+            end = offset + 1 + length
+            if length == 0 or end > len(view):
+                raise ValueError("Truncated UID")
+            uids.append(encode_uid(view[offset + 1:end]))
+            offset = end
+        frames.append(Frame(kind, reader_id, seq, timestamp_ms, uids))
+    return frames
+
+
+def encode_frame(kind, reader_id, seq, timestamp_ms, uids):
+    """Build one request frame from hex or encoded UIDs; used by reader simulators and tools"""
+    parts = [HEADER.pack(MAGIC, VERSION, kind, reader_id, seq, timestamp_ms, len(uids))]
+    for uid in uids:
+        raw = bytes.fromhex(decode_uid(uid))
+        parts.append(bytes([len(raw)]) + raw)
+    return b"".join(parts)
+
+
+def encode_ack(frame, results):
+    """Build the ack for frame from (status, value) pairs, one per UID"""
+    buffer = bytearray(ACK_HEADER.size + RESULT.size * len(results))
+    ACK_HEADER.pack_into(buffer, 0, MAGIC, VERSION, frame.kind | KIND_ACK, frame.seq, len(results))
+    offset = ACK_HEADER.size
+    for status, value in results:
+        RESULT.pack_into(buffer, offset, status, value)
+        offset += RESULT.size
+    return bytes(buffer)
+
+
+def decode_ack(data):
+    """Parse the acks in data into (kind, seq, [(status, value), ...]) tuples; raises ValueError if malformed"""
+    view = memoryview(data)
+    acks = []
+    offset = 0
+    while offset < len(view):
+        if len(view) - offset < ACK_HEADER.size:
+            raise ValueError("Truncated ack header")
+        magic, version, kind, seq, count = ACK_HEADER.unpack_from(view, offset)
+        if magic != MAGIC or version != VERSION or not kind & KIND_ACK:
+            raise ValueError("Unsupported ack")
+        offset += ACK_HEADER.size
+        if len(view) - offset < RESULT.size * count:
+            raise ValueError("Truncated ack results")
+        results = [RESULT.unpack_from(view, offset + i * RESULT.size) for i in range(count)]
+        offset += RESULT.size * count
+        acks.append((kind & ~KIND_ACK, seq, results))
+    return acks
@@ -0,0 +1,213 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from pymongo import UpdateOne, ReplaceOne
+from utils.stock_manager import supports_transactions
+
+# Sales are pre-aggregated into one sales_rollups document per hour and one
+# per day, so the admin dashboards read a few dozen small documents instead
+# of every order in their window:
+#
+#   {_id: "hour:2026-10-18T14" or "day:2026-10-18", granularity, period_start,
+#    revenue, order_count, units,
+#    stores: {<store_id>: {revenue, order_count, units}},
+#    hours: {"14": {revenue, order_count, units}}}      (day documents only)
+#
+# verify_checkout counts each order in with record_order(), one bulk write of
+# $inc upserts, so concurrent checkouts never lose an update. Orders are
+# inserted with rollup_pending set and record_order() clears it in the same
+# transaction as the $inc where the deployment has them, right after it
+# otherwise; catch_up_rollups() counts whatever a failure or crash left
+# pending. Orders are the source of truth: backfill_rollups() rebuilds any
+# range of days from them.
+
+FIGURES = ("revenue", "order_count", "units")
+
+# Set on every new order until it has been counted into the rollups
+PENDING = "rollup_pending"
+
+# Pending orders younger than this may still be counted by their checkout
+CATCH_UP_GRACE = timedelta(minutes=5)
+
+# Store key for orders placed with a cart that belongs to no store
+NO_STORE = "none"
+
+
+def _hour(when):
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def _day(when):
+    return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _store_key(store_id):
+    # Field names may not contain '.' or start with '$'
+    return str(store_id).replace(".", "_").replace("$", "_") if store_id else NO_STORE
+
+
+def _keys(created_at):
+    return f"hour:{created_at:%Y-%m-%dT%H}", f"day:{created_at:%Y-%m-%d}"
+
+
+def _increments(order):
+    """$inc documents that count order into its hour and day rollups"""
+    units = order.get("item_count")
+    if units is None:
+        units = sum(item.get("quantity", 1) for item in order.get("items", []))
+    figures = {"revenue": order.get("total_amount", 0), "order_count": 1, "units": units}
+    store = _store_key(order.get("store_id"))
+    hour = order["created_at"].hour
+
+    hour_inc = {}
+    for field, value in figures.items():
+        hour_inc[field] = value
+        hour_inc[f"stores.{store}.{field}"] = value
+    day_inc = dict(hour_inc)
+    for field, value in figures.items():
+        day_inc[f"hours.{hour}.{field}"] = value
+    return hour_inc, day_inc
+
+
+def record_order(db, order):
+    """Count a completed order into its hour and day rollups and clear its rollup_pending flag.
+
+    Returns False if the rollups could not be written; the order then stays
+    pending for catch_up_rollups().
+    """
+    created_at = order["created_at"]
+    hour_key, day_key = _keys(created_at)
+    hour_inc, day_inc = _increments(order)
+    operations = [
+        UpdateOne({"_id": hour_key},
+                  {"$inc": hour_inc, "$setOnInsert": {"granularity": "hour", "period_start": _hour(created_at)}},
+                  upsert=True),
+        UpdateOne({"_id": day_key},
+                  {"$inc": day_inc, "$setOnInsert": {"granularity": "day", "period_start": _day(created_at)}},
+                  upsert=True)
+    ]
+    try:
+        client = db.client
+        if supports_transactions(client):
+            with client.start_session() as session:
+                with session.start_transaction():
+                    db.sales_rollups.bulk_write(operations, ordered=False, session=session)
+                    db.orders.update_one({"_id": order["_id"]}, {"$unset": {PENDING: ""}}, session=session)
+        else:
+            # A crash between these two writes counts the order twice on catch-up
+            db.sales_rollups.bulk_write(operations, ordered=False)
+            db.orders.update_one({"_id": order["_id"]}, {"$unset": {PENDING: ""}})
+        return True
+    except Exception as e:
+        # The order stands either way and stays pending until catch_up_rollups() counts it
+        print(f"Warning: sales rollups not updated for order {order.get('_id')}: {str(e)}")
+        return False
+
+
+def catch_up_rollups(db, grace=CATCH_UP_GRACE):
+    """Count the orders still marked rollup_pending, except ones young enough to be mid-checkout.
+
+    Returns the number of orders counted.
+    """
+    projection = {"created_at": 1, "total_amount": 1, "item_count": 1, "items.quantity": 1, "store_id": 1}
+    counted = 0
+    cutoff = datetime.utcnow() - grace
+    for order in db.orders.find({PENDING: True, "created_at": {"$lt": cutoff}}, projection):
+        if record_order(db, order):
+            counted += 1
+    return counted
+
+
+def _add(doc, increments):
+    for path, value in increments.items():
+        target = doc
+        *parents, field = path.split(".")
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[field] = target.get(field, 0) + value
+
+
+def backfill_rollups(db, start=None, end=None, batch_size=500):
+    """Rebuild the rollups of every day from start to end (inclusive) from orders.
+
+    Without bounds every order is recounted. Checkouts completing while a
+    day is rebuilt may be missed or counted twice, so run it while the
+    store is quiet. Returns the number of rollup documents written.
+    """
+    bounds = {}
+    if start is not None:
+        bounds["$gte"] = _day(start)
+    if end is not None:
+        bounds["$lt"] = _day(end) + timedelta(days=1)
+
+    docs = {}
+    pending = []
+    projection = {"created_at": 1, "total_amount": 1, "item_count": 1, "items.quantity": 1, "store_id": 1, PENDING: 1}
+    for order in db.orders.find({"created_at": bounds or {"$exists": True}}, projection):
+        if order.get(PENDING):
+            pending.append(order["_id"])
+        created_at = order["created_at"]
+        hour_key, day_key = _keys(created_at)
+        hour_inc, day_inc = _increments(order)
+        _add(docs.setdefault(hour_key, {"_id": hour_key, "granularity": "hour", "period_start": _hour(created_at)}),
+             hour_inc)
+        _add(docs.setdefault(day_key, {"_id": day_key, "granularity": "day", "period_start": _day(created_at)}),
+             day_inc)
+
+    # Periods in the range that no longer have any orders are removed
+    stale = {"_id": {"$nin": list(docs)}}
+    if bounds:
+        stale["period_start"] = bounds
+    db.sales_rollups.delete_many(stale)
+
+    operations = []
+    written = 0
+    for doc in docs.values():
+        operations.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+        if len(operations) >= batch_size:
+            db.sales_rollups.bulk_write(operations, ordered=False)
+            written += len(operations)
+            operations = []
+    if operations:
+        db.sales_rollups.bulk_write(operations, ordered=False)
+        written += len(operations)
+
+    # The pending orders read above have just been counted
+    for offset in range(0, len(pending), batch_size):
+        db.orders.update_many({"_id": {"$in": pending[offset:offset + batch_size]}}, {"$unset": {PENDING: ""}})
+    return written
+
+
+def window_rollups(db, start, end):
+    """Rollups covering start..end without overlap: days inside the window, hours at its ragged ends"""
+    first_day = _day(start) if start == _day(start) else _day(start) + timedelta(days=1)
+    last_day = _day(end)
+    if first_day >= last_day:
+        return list(db.sales_rollups.find({"granularity": "hour", "period_start": {"$gte": _hour(start), "$lte": end}}))
+    days = db.sales_rollups.find({"granularity": "day", "period_start": {"$gte": first_day, "$lt": last_day}})
+    hours = db.sales_rollups.find({"granularity": "hour", "$or": [
+        {"period_start": {"$gte": _hour(start), "$lt": first_day}},
+        {"period_start": {"$gte": last_day, "$lte": end}}
+    ]})
+    return list(days) + list(hours)
+
+
+def sum_rollups(docs, store_id=None):
+    """Total revenue, order_count and units over rollup documents, optionally for one store"""
+    totals = dict.fromkeys(FIGURES, 0)
+    for doc in docs:
+        figures = doc.get("stores", {}).get(_store_key(store_id), {}) if store_id else doc
+        for field in FIGURES:
+            totals[field] += figures.get(field, 0)
+    return totals
+
+
+def hour_histogram(docs):
+    """Orders per hour of the day over rollup documents"""
+    counts = Counter()
+    for doc in docs:
+        if doc["granularity"] == "day":
+            for hour, figures in doc.get("hours", {}).items():
+                counts[int(hour)] += figures.get("order_count", 0)
+        else:
+            counts[doc["period_start"].hour] += doc.get("order_count", 0)
+    return counts
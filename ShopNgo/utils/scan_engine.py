@@ -0,0 +1,347 @@
+from datetime import datetime
+from pymongo import ReturnDocument, UpdateOne
+
+# Every cart mutation on the scan path is a single conditional
+# find_one_and_update against the user's active session, and the new cart
+# state comes back from that same round trip.
+#
+# Session items are stored as a map keyed by product_id, with the running
+# unit count (item_count) and subtotal (total_amount) kept on the session,
+# so each mutation touches only the one item it changes no matter how large
+# the basket is. session_items() turns the map back into the list the API
+# has always returned. Every mutation also bumps the session's version,
+# which /api/cart/get uses as its ETag.
+#
+# Each item also keeps the set of tags scanned into it (rfid_tags), so a
+# batch read counts a tag at most once and a toggle takes out exactly the
+# unit whose tag was scanned.
+
+# Upper bound on tags accepted from one anti-collision read cycle
+MAX_BATCH_TAGS = 64
+
+
+def _active_session(user_email):
+    return {"user_email": user_email, "is_active": True}
+
+
+def _session_exists(db, user_email):
+    """Used only on the failure path to tell 'no session' from a rejected update"""
+    return db.sessions.find_one(_active_session(user_email), {"_id": 1}) is not None
+
+
+def _is_missing(path):
+    return {"$eq": [{"$type": path}, "missing"]}
+
+
+def _next_version():
+    return {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+
+
+def session_items(session):
+    """Return the session's items as a list, in the order they were first scanned"""
+    items = session.get("items") or {}
+    return list(items.values()) if isinstance(items, dict) else items
+
+
+def items_to_map(items):
+    """Convert a legacy item list into the map layout; returns (items, item_count, total_amount)"""
+    mapped = {}
+    for item in items:
+        existing = mapped.get(item["product_id"])
+        if existing:
+            existing["quantity"] += item["quantity"]
+            existing["total_price"] += item["total_price"]
+        else:
+            mapped[item["product_id"]] = dict(item)
+    item_count = sum(item["quantity"] for item in mapped.values())
+    total_amount = sum(item["total_price"] for item in mapped.values())
+    return mapped, item_count, total_amount
+
+
+def build_item(product, **extra):
+    """Build the session item stored for one scanned unit of product"""
+    item = {
+        "product_id": str(product["_id"]),
+        "name": product["name"],
+        "price": product["price"],
+        "quantity": 1,
+        "total_price": product["price"],
+        "rfid_tag": product["rfid_tag"],
+        "rfid_tags": [product["rfid_tag"]],
+        "scanned_at": datetime.utcnow()
+    }
+    item.update(extra)
+    return item
+
+
+def add_item(db, user_email, product):
+    """Add the unit carrying product's rfid_tag to the active session.
+
+    A tag already in the item's rfid_tags is not counted again. Returns
+    (session, error) where error is None, "no_session", "stock_limit" or
+    "duplicate"; a duplicate comes back with the unchanged session.
+    """
+    product_id = str(product["_id"])
+    path = f"items.{product_id}"
+    query = _active_session(user_email)
+    # Reject the write when the cart already holds every unit in stock,
+    # or already holds this very unit
+    query[f"{path}.quantity"] = {"$not": {"$gte": product.get("stock_quantity", 0)}}
+    query[f"{path}.rfid_tags"] = {"$ne": product["rfid_tag"]}
+
+    session = db.sessions.find_one_and_update(
+        query,
+        {
+            # $inc creates the counters for a new item; $min keeps the first scan time
+            "$inc": {
+                f"{path}.quantity": 1,
+                f"{path}.total_price": product["price"],
+                "item_count": 1,
+                "total_amount": product["price"],
+                "version": 1
+            },
+            "$set": {
+                f"{path}.product_id": product_id,
+                f"{path}.name": product["name"],
+                f"{path}.price": product["price"],
+                f"{path}.rfid_tag": product["rfid_tag"],
+                "updated_at": datetime.utcnow()
+            },
+            "$min": {f"{path}.scanned_at": datetime.utcnow()},
+            "$addToSet": {f"{path}.rfid_tags": product["rfid_tag"]}
+        },
+        return_document=ReturnDocument.AFTER
+    )
+    if session:
+        return session, None
+
+    # Only the failure path reads the session to say why the update was rejected
+    session = db.sessions.find_one(_active_session(user_email))
+    if not session:
+        return None, "no_session"
+    item = next((item for item in session_items(session) if item["product_id"] == product_id), {})
+    if product["rfid_tag"] in (item.get("rfid_tags") or []):
+        return session, "duplicate"
+    return None, "stock_limit"
+
+
+def group_by_sku(products):
+    """Group the products resolved from one read cycle (one entry per tag) by SKU.
+
+    Returns product_id -> (product, rfid_tags), in the order the SKUs were read.
+    """
+    grouped = {}
+    for product in products:
+        product_id = str(product["_id"])
+        if product_id not in grouped:
+            grouped[product_id] = (product, [])
+        grouped[product_id][1].append(product["rfid_tag"])
+    return grouped
+
+
+def add_items(db, user_email, products):
+    """Add the units read in one anti-collision cycle to the active session.
+
+    products holds one entry per tag read, so a SKU may appear several times.
+    A read cycle sees the whole basket, so only tags not yet in their item's
+    rfid_tags add a unit, whether the units already in the cart were read in
+    a batch or scanned one by one, and reading the same basket again adds
+    nothing. All SKUs are applied in one atomic update. Returns (session,
+    added, error) where added is the set of rfid_tags counted as new units
+    and error is None or "no_session".
+    """
+    grouped = group_by_sku(products)
+    candidates = {product_id: build_item(product, quantity=0, total_price=0, rfid_tags=[])
+                  for product_id, (product, _) in grouped.items()}
+
+    # Stage one creates absent items with no units, stage two counts the
+    # unseen tags into the quantities and totals and stage three records them
+    create = {f"items.{product_id}": {"$ifNull": [f"$items.{product_id}", {"$literal": item}]}
+              for product_id, item in candidates.items()}
+    totals = {}
+    tags = {}
+    new_units = []
+    new_prices = []
+    for product_id, (_, rfid_tags) in grouped.items():
+        item = f"$items.{product_id}"
+        known = {"$ifNull": [f"{item}.rfid_tags", []]}
+        unseen = {"$filter": {"input": {"$literal": rfid_tags}, "as": "tag",
+                              "cond": {"$eq": [{"$in": ["$$tag", known]}, False]}}}
+        units = {"$size": unseen}
+        price = {"$multiply": [units, f"{item}.price"]}
+        totals[f"items.{product_id}.total_price"] = {"$add": [f"{item}.total_price", price]}
+        totals[f"items.{product_id}.quantity"] = {"$add": [f"{item}.quantity", units]}
+        tags[f"items.{product_id}.rfid_tags"] = {"$concatArrays": [known, unseen]}
+        new_units.append(units)
+        new_prices.append(price)
+    totals["item_count"] = {"$add": ["$item_count"] + new_units}
+    totals["total_amount"] = {"$add": ["$total_amount"] + new_prices}
+    totals["updated_at"] = datetime.utcnow()
+    # Re-reading a basket that is already in the cart leaves the version alone
+    totals["version"] = {"$add": [{"$ifNull": ["$version", 0]},
+                                  {"$cond": [{"$gt": [{"$add": new_units}, 0]}, 1, 0]}]}
+
+    before = db.sessions.find_one_and_update(
+        _active_session(user_email),
+        [{"$set": create}, {"$set": totals}, {"$set": tags}],
+        return_document=ReturnDocument.BEFORE
+    )
+    if not before:
+        return None, set(), "no_session"
+
+    # Rebuild the post-update state locally instead of paying a second round trip
+    session = before
+    added = set()
+    for product_id, (_, rfid_tags) in grouped.items():
+        item = session["items"].get(product_id) or candidates[product_id]
+        known = item.get("rfid_tags") or []
+        new_tags = [rfid_tag for rfid_tag in rfid_tags if rfid_tag not in known]
+        if not new_tags:
+            continue
+        session["items"][product_id] = dict(item, quantity=item["quantity"] + len(new_tags),
+                                            total_price=item["total_price"] + len(new_tags) * item["price"],
+                                            rfid_tags=known + new_tags)
+        session["item_count"] += len(new_tags)
+        session["total_amount"] += len(new_tags) * item["price"]
+        added.update(new_tags)
+    if added:
+        session["version"] = before.get("version", 0) + 1
+    return session, added, None
+
+
+def remove_one(db, user_email, product_id):
+    """Remove one unit of product_id from the active session.
+
+    The most recently scanned tag leaves the item's rfid_tags with it.
+    Returns (session, error) where error is None, "no_session" or "not_in_cart".
+    """
+    item = f"$items.{product_id}"
+    known = {"$ifNull": [f"{item}.rfid_tags", []]}
+    query = _active_session(user_email)
+    query[f"items.{product_id}"] = {"$exists": True}
+
+    session = db.sessions.find_one_and_update(
+        query,
+        [{"$set": {
+            f"items.{product_id}": {"$cond": [
+                {"$gt": [f"{item}.quantity", 1]},
+                {"$mergeObjects": [item, {
+                    "quantity": {"$subtract": [f"{item}.quantity", 1]},
+                    "total_price": {"$subtract": [f"{item}.total_price", f"{item}.price"]},
+                    "rfid_tags": {"$slice": [known, {"$min": [{"$size": known}, {"$subtract": [f"{item}.quantity", 1]}]}]}
+                }]},
+                "$$REMOVE"
+            ]},
+            "item_count": {"$subtract": ["$item_count", 1]},
+            "total_amount": {"$subtract": ["$total_amount", f"{item}.price"]},
+            "version": _next_version(),
+            "updated_at": datetime.utcnow()
+        }}],
+        return_document=ReturnDocument.AFTER
+    )
+    if session:
+        return session, None
+    return None, "not_in_cart" if _session_exists(db, user_email) else "no_session"
+
+
+def toggle_item(db, user_email, product):
+    """Remove the unit carrying product's rfid_tag, or add it if it is not in the cart.
+
+    Only the scanned tag's unit moves; other units of the same SKU stay in
+    the cart. Returns (session, action, quantity, error) where action is
+    "added" or "removed", quantity is the number of units added or removed,
+    and error is None, "no_session" or "out_of_stock".
+    """
+    product_id = str(product["_id"])
+    rfid_tag = product["rfid_tag"]
+    item = f"$items.{product_id}"
+    query = _active_session(user_email)
+    if product.get("stock_quantity", 0) <= 0:
+        # Out of stock products may only be toggled out of the cart
+        query[f"items.{product_id}.rfid_tags"] = rfid_tag
+
+    known = {"$ifNull": [f"{item}.rfid_tags", []]}
+    present = {"$in": [rfid_tag, known]}
+    new_item = build_item(product, flavor=product.get("flavor"))
+
+    before = db.sessions.find_one_and_update(
+        query,
+        [{"$set": {
+            f"items.{product_id}": {"$cond": [
+                present,
+                {"$cond": [
+                    {"$gt": [f"{item}.quantity", 1]},
+                    {"$mergeObjects": [item, {
+                        "quantity": {"$subtract": [f"{item}.quantity", 1]},
+                        "total_price": {"$subtract": [f"{item}.total_price", f"{item}.price"]},
+                        "rfid_tags": {"$setDifference": [known, [rfid_tag]]}
+                    }]},
+                    "$$REMOVE"
+                ]},
+                {"$cond": [
+                    _is_missing(item),
+                    {"$literal": new_item},
+                    {"$mergeObjects": [item, {
+                        "quantity": {"$add": [f"{item}.quantity", 1]},
+                        "total_price": {"$add": [f"{item}.total_price", product["price"]]},
+                        "rfid_tag": rfid_tag,
+                        "rfid_tags": {"$concatArrays": [known, [rfid_tag]]}
+                    }]}
+                ]}
+            ]},
+            "item_count": {"$add": ["$item_count", {"$cond": [present, -1, 1]}]},
+            "total_amount": {"$cond": [
+                present,
+                {"$subtract": ["$total_amount", f"{item}.price"]},
+                {"$add": ["$total_amount", product["price"]]}
+            ]},
+            "version": _next_version(),
+            "updated_at": datetime.utcnow()
+        }}],
+        return_document=ReturnDocument.BEFORE
+    )
+    if not before:
+        return None, None, 0, "out_of_stock" if _session_exists(db, user_email) else "no_session"
+
+    # Rebuild the post-update state locally so the caller also learns what happened
+    session = before
+    session["version"] = before.get("version", 0) + 1
+    existing = session["items"].get(product_id)
+    known = (existing or {}).get("rfid_tags") or []
+    if rfid_tag in known:
+        if existing["quantity"] > 1:
+            session["items"][product_id] = dict(existing, quantity=existing["quantity"] - 1,
+                                                total_price=existing["total_price"] - existing["price"],
+                                                rfid_tags=[tag for tag in known if tag != rfid_tag])
+        else:
+            del session["items"][product_id]
+        session["item_count"] -= 1
+        session["total_amount"] -= existing["price"]
+        return session, "removed", 1, None
+    if existing:
+        session["items"][product_id] = dict(existing, quantity=existing["quantity"] + 1,
+                                            total_price=existing["total_price"] + product["price"],
+                                            rfid_tag=rfid_tag, rfid_tags=known + [rfid_tag])
+    else:
+        session["items"][product_id] = new_item
+    session["item_count"] += 1
+    session["total_amount"] += product["price"]
+    return session, "added", 1, None
+
+
+def migrate_session_items(db, batch_size=500):
+    """Convert active sessions that still store items as a list to the map layout"""
+    converted = 0
+    operations = []
+    for session in db.sessions.find({"is_active": True, "items": {"$type": "array"}}, {"items": 1}):
+        items, item_count, total_amount = items_to_map(session["items"])
+        operations.append(UpdateOne(
+            {"_id": session["_id"], "items": {"$type": "array"}},
+            {"$set": {"items": items, "item_count": item_count, "total_amount": total_amount}}
+        ))
+        if len(operations) >= batch_size:
+            converted += db.sessions.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        converted += db.sessions.bulk_write(operations, ordered=False).modified_count
+    return converted
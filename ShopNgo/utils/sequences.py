@@ -0,0 +1,39 @@
+from pymongo import ReturnDocument
+import threading
+
+
+class SequenceAllocator:
+    """Hands out increasing integers from a counter in the counters collection.
+
+    Numbers are reserved from MongoDB a block at a time with one atomic $inc,
+    then served from memory, so most allocations cost no database round
+    trip. Numbers left in a block when the process exits are skipped, never
+    reused, so sequences can have gaps but never duplicates.
+    """
+
+    def __init__(self, db, name, block_size=10):
+        self.db = db
+        self.name = name
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def seed(self, minimum):
+        """Make sure the counter is at least minimum, e.g. the highest number already in use"""
+        self.db.counters.update_one({"_id": self.name}, {"$max": {"value": minimum}}, upsert=True)
+
+    def next(self):
+        with self._lock:
+            if self._next >= self._end:
+                counter = self.db.counters.find_one_and_update(
+                    {"_id": self.name},
+                    {"$inc": {"value": self.block_size}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                self._end = counter["value"] + 1
+                self._next = self._end - self.block_size
+            value = self._next
+            self._next += 1
+            return value
@@ -0,0 +1,174 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+from utils.scan_engine import session_items
+from utils.stock_manager import release
+import threading
+import time
+import os
+
+
+def end_session(db, cart_pool, query, ended_by=None, release_stock=True):
+    """Atomically end the active session matching query and free its cart.
+
+    Unless release_stock is False (checkout has already converted them into
+    sales), the session's reserved units are released as well. Returns the
+    ended session, or None if no active session matched.
+    """
+    update = {"is_active": False, "ended_at": datetime.utcnow()}
+    if ended_by:
+        update["ended_by"] = ended_by
+    # Flipping is_active is the single point that decides who ends the session,
+    # so its reservations are released exactly once
+    session = db.sessions.find_one_and_update(dict(query, is_active=True), {"$set": update})
+    if not session:
+        return None
+    if release_stock:
+        release(db, session_items(session))
+    cart_pool.release(session["cart_id"])
+    return session
+
+
+class SessionReaper:
+    """Ends abandoned sessions in the background, a batch at a time.
+
+    Idle sessions are found through the partial active_by_idle index, oldest
+    first, and each batch is ended with one update_many. The sessions this
+    reaper actually flipped are tagged with its batch id, so their carts and
+    reserved stock are released with one write each even when another process
+    is reaping at the same time. A sweep stops after max_batches, leaving the
+    rest of a large backlog to the next one.
+    """
+
+    def __init__(self, db, cart_pool, idle_minutes=30, batch_size=200, max_batches=10, interval=60, on_ended=None):
+        self.db = db
+        self.cart_pool = cart_pool
+        # Called with the ids of the sessions each batch ended (e.g. cart_store.forget)
+        self.on_ended = on_ended
+        self.idle_minutes = idle_minutes
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._metrics = {
+            "sweeps": 0,
+            "sessions_ended": 0,
+            "carts_released": 0,
+            "units_released": 0,
+            "errors": 0,
+            "last_sweep_at": None,
+            "last_sweep_ms": None,
+            "last_sweep_ended": 0,
+            "backlog_remaining": False
+        }
+
+    def _reap_batch(self, cutoff, ended_by):
+        query = {"is_active": True}
+        if cutoff is not None:
+            query["updated_at"] = {"$lt": cutoff}
+        ids = [session["_id"] for session in
+               self.db.sessions.find(query, {"_id": 1}).sort("updated_at", 1).limit(self.batch_size)]
+        if not ids:
+            return 0, False
+
+        # The filter is re-applied so a session that saw activity since the read stays open
+        batch_id = ObjectId()
+        self.db.sessions.update_many(
+            dict(query, _id={"$in": ids}),
+            {"$set": {"is_active": False, "ended_at": datetime.utcnow(),
+                      "ended_by": ended_by, "reaped_by": batch_id}}
+        )
+        ended = list(self.db.sessions.find({"_id": {"$in": ids}, "reaped_by": batch_id},
+                                           {"items": 1, "cart_id": 1}))
+
+        items = [item for session in ended for item in session_items(session)]
+        release(self.db, items)
+        self.cart_pool.release_many([session["cart_id"] for session in ended])
+        if self.on_ended and ended:
+            self.on_ended([session["_id"] for session in ended])
+
+        with self._lock:
+            self._metrics["sessions_ended"] += len(ended)
+            self._metrics["carts_released"] += len(ended)
+            self._metrics["units_released"] += sum(item["quantity"] for item in items)
+        return len(ended), len(ids) == self.batch_size
+
+    def reap(self, cutoff, ended_by, max_batches=None):
+        """End active sessions last updated before cutoff (all of them if cutoff is None).
+
+        Returns (sessions ended, whether more may remain after max_batches).
+        """
+        total = 0
+        batches = 0
+        more = True
+        while more and (max_batches is None or batches < max_batches):
+            ended, more = self._reap_batch(cutoff, ended_by)
+            total += ended
+            batches += 1
+        return total, more
+
+    def sweep(self):
+        """Run one incremental pass over sessions idle past the TTL"""
+        started = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(minutes=self.idle_minutes)
+        try:
+            ended, more = self.reap(cutoff, "idle_timeout", self.max_batches)
+        except Exception as e:
+            print(f"Error reaping idle sessions: {str(e)}")
+            with self._lock:
+                self._metrics["errors"] += 1
+                self._metrics["backlog_remaining"] = False
+            return 0
+        with self._lock:
+            self._metrics["sweeps"] += 1
+            self._metrics["last_sweep_at"] = datetime.utcnow().isoformat()
+            self._metrics["last_sweep_ms"] = round((time.monotonic() - started) * 1000, 1)
+            self._metrics["last_sweep_ended"] = ended
+            self._metrics["backlog_remaining"] = more
+        if ended:
+            print(f"Reaped {ended} idle sessions")
+        return ended
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+        stats.update({
+            "idle_minutes": self.idle_minutes,
+            "batch_size": self.batch_size,
+            "max_batches": self.max_batches,
+            "interval_seconds": self.interval,
+            "running": self._thread is not None and self._thread.is_alive()
+        })
+        return stats
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.sweep()
+            # Catch up immediately while a backlog remains
+            if not self._metrics["backlog_remaining"]:
+                self._stopping.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="session-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+def init_session_reaper(db, cart_pool, on_ended=None):
+    """Initialize the idle-session reaper and start it unless SESSION_REAPER_ENABLED is false"""
+    reaper = SessionReaper(
+        db, cart_pool,
+        idle_minutes=int(os.getenv("SESSION_IDLE_TTL_MINUTES", 30)),
+        batch_size=int(os.getenv("SESSION_REAPER_BATCH_SIZE", 200)),
+        max_batches=int(os.getenv("SESSION_REAPER_MAX_BATCHES", 10)),
+        interval=int(os.getenv("SESSION_REAPER_INTERVAL_SECONDS", 60)),
+        on_ended=on_ended
+    )
+    if os.getenv("SESSION_REAPER_ENABLED", "true").lower() == "true":
+        reaper.start()
+    return reaper
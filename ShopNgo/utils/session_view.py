@@ -0,0 +1,46 @@
+from pymongo import UpdateOne
+from utils.scan_engine import session_items
+from utils.uid_codec import decode_items
+
+# Read model served by GET /api/cart/get. Sessions carry their cart_number
+# (copied from the cart when the session starts) and a version that every
+# cart mutation bumps, so the endpoint needs no carts lookup and a client
+# that already has the current version gets a 304 after one projected read.
+
+
+def session_etag(session_id, version):
+    return f"{session_id}:{version}"
+
+
+def session_view(session):
+    """Compact JSON-ready view of an active session"""
+    items = []
+    for item in decode_items(session_items(session)):
+        if item.get("scanned_at"):
+            item["scanned_at"] = item["scanned_at"].isoformat()
+        items.append(item)
+    return {
+        "session_id": str(session["_id"]),
+        "cart_number": session.get("cart_number"),
+        "version": session.get("version", 0),
+        "item_count": session.get("item_count", sum(item["quantity"] for item in items)),
+        "total_amount": session["total_amount"],
+        "items": items
+    }
+
+
+def backfill_session_read_model(db, batch_size=500):
+    """Copy cart_number onto active sessions started before it was denormalized"""
+    sessions = list(db.sessions.find({"is_active": True, "cart_number": {"$exists": False}}, {"cart_id": 1}))
+    cart_numbers = {
+        cart["_id"]: cart.get("cart_number")
+        for cart in db.carts.find({"_id": {"$in": list({session["cart_id"] for session in sessions})}},
+                                  {"cart_number": 1})
+    }
+    operations = [
+        UpdateOne({"_id": session["_id"]}, {"$set": {"cart_number": cart_numbers.get(session["cart_id"])}})
+        for session in sessions
+    ]
+    for start in range(0, len(operations), batch_size):
+        db.sessions.bulk_write(operations[start:start + batch_size], ordered=False)
+    return len(operations)
@@ -0,0 +1,208 @@
+from bson import ObjectId
+from pymongo import UpdateOne
+
+# Stock is reserved one unit at a time as items are scanned: a product's
+# reserved_quantity counts the units sitting in active carts and may never
+# exceed stock_quantity. Removing an item or ending a session releases its
+# units, and checkout converts the basket's reservations into sales with one
+# bulk_write of guarded updates. On a replica set that bulk write runs in a
+# transaction and is rolled back if any guard fails; on a standalone server
+# the updates that landed are undone with a second bulk write.
+
+# Each multi-product write pushes its token onto a short per-product list so
+# a partially applied non-transactional bulk can tell which updates landed
+RECENT_OPS_KEPT = 50
+
+
+def supports_transactions(client):
+    return client.topology_description.topology_type_name in ("ReplicaSetWithPrimary", "Sharded")
+
+
+def _quantities(items):
+    quantities = {}
+    for item in items:
+        quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+    return quantities
+
+
+def _object_ids(product_ids):
+    return [ObjectId(product_id) for product_id in product_ids]
+
+
+def _mark(token):
+    return {"recent_ops": {"$each": [token], "$slice": -RECENT_OPS_KEPT}}
+
+
+def _applied(db, product_ids, token, session=None):
+    """Return the ids of products whose update carrying token has landed"""
+    return {
+        str(product["_id"])
+        for product in db.products.find(
+            {"_id": {"$in": _object_ids(product_ids)}, "recent_ops": token},
+            {"_id": 1},
+            session=session
+        )
+    }
+
+
+def _failures(db, quantities, applied, session=None):
+    """Describe every product whose guarded update did not apply"""
+    missing = [product_id for product_id in quantities if product_id not in applied]
+    products = {
+        str(product["_id"]): product
+        for product in db.products.find(
+            {"_id": {"$in": _object_ids(missing)}},
+            {"name": 1, "stock_quantity": 1},
+            session=session
+        )
+    }
+    return [
+        {
+            "product_id": product_id,
+            "name": products[product_id].get("name") if product_id in products else None,
+            "requested": quantities[product_id],
+            "available": products[product_id].get("stock_quantity", 0) if product_id in products else 0,
+            "reason": "insufficient_stock" if product_id in products else "not_found"
+        }
+        for product_id in missing
+    ]
+
+
+def _available(quantity):
+    """Query guard: at least quantity units are neither reserved nor sold"""
+    return {"$expr": {"$lte": [
+        {"$add": [{"$ifNull": ["$reserved_quantity", 0]}, quantity]},
+        "$stock_quantity"
+    ]}}
+
+
+def reserve(db, product_id):
+    """Reserve one unit of product_id; returns False if every unit is already taken"""
+    query = _available(1)
+    query["_id"] = ObjectId(product_id)
+    result = db.products.update_one(query, {"$inc": {"reserved_quantity": 1}})
+    return result.modified_count == 1
+
+
+def reserve_many(db, product_ids, token):
+    """Reserve one unit per occurrence of each product with a single bulk write.
+
+    A product listed several times has all its units reserved or none.
+    Returns the ids reserved.
+    """
+    quantities = {}
+    for product_id in product_ids:
+        quantities[str(product_id)] = quantities.get(str(product_id), 0) + 1
+    if not quantities:
+        return set()
+    operations = []
+    for product_id, quantity in quantities.items():
+        query = _available(quantity)
+        query["_id"] = ObjectId(product_id)
+        operations.append(UpdateOne(query, {"$inc": {"reserved_quantity": quantity}, "$push": _mark(token)}))
+    result = db.products.bulk_write(operations, ordered=False)
+    if result.modified_count == len(operations):
+        return set(quantities)
+    return _applied(db, list(quantities), token)
+
+
+def release(db, items):
+    """Return the reserved units of items to the available pool with a single bulk write"""
+    quantities = _quantities(items)
+    if not quantities:
+        return
+    db.products.bulk_write([
+        UpdateOne(
+            {"_id": ObjectId(product_id), "reserved_quantity": {"$gte": quantity}},
+            {"$inc": {"reserved_quantity": -quantity}}
+        )
+        for product_id, quantity in quantities.items()
+    ], ordered=False)
+
+
+def commit_reservations(db, items, checkout_id):
+    """Convert the reserved units of items into sales, all or nothing.
+
+    Returns a list of failures (empty on success). Each failure names the
+    product, the quantity requested and what is in stock.
+    """
+    quantities = _quantities(items)
+    if not quantities:
+        return []
+    operations = [
+        UpdateOne(
+            {"_id": ObjectId(product_id),
+             "reserved_quantity": {"$gte": quantity},
+             "stock_quantity": {"$gte": quantity}},
+            {"$inc": {"stock_quantity": -quantity, "reserved_quantity": -quantity},
+             "$push": _mark(checkout_id)}
+        )
+        for product_id, quantity in quantities.items()
+    ]
+    client = db.client
+
+    if supports_transactions(client):
+        with client.start_session() as session:
+            with session.start_transaction():
+                result = db.products.bulk_write(operations, ordered=False, session=session)
+                if result.modified_count == len(operations):
+                    return []
+                applied = _applied(db, quantities, checkout_id, session=session)
+                failures = _failures(db, quantities, applied, session=session)
+                session.abort_transaction()
+                return failures
+
+    result = db.products.bulk_write(operations, ordered=False)
+    if result.modified_count == len(operations):
+        return []
+
+    # Some guards failed: find the updates that landed and undo them
+    applied = _applied(db, quantities, checkout_id)
+    restock(db, [{"product_id": product_id, "quantity": quantities[product_id]} for product_id in applied],
+            checkout_id)
+    return _failures(db, quantities, applied)
+
+
+def restock(db, items, checkout_id=None, reserved=True):
+    """Undo commit_reservations: put the units back in stock, still reserved.
+
+    Pass reserved=False when the session was ended elsewhere in the meantime:
+    whoever ended it has already released its reservations.
+    """
+    quantities = _quantities(items)
+    if not quantities:
+        return
+    operations = []
+    for product_id, quantity in quantities.items():
+        update = {"$inc": {"stock_quantity": quantity}}
+        if reserved:
+            update["$inc"]["reserved_quantity"] = quantity
+        if checkout_id is not None:
+            update["$pull"] = {"recent_ops": checkout_id}
+        operations.append(UpdateOne({"_id": ObjectId(product_id)}, update))
+    db.products.bulk_write(operations, ordered=False)
+
+
+def rebuild_reservations(db):
+    """Recompute every product's reserved_quantity from the items in active sessions"""
+    reserved = {}
+    pipeline = [
+        {"$match": {"is_active": True}},
+        {"$project": {"items": {"$objectToArray": "$items"}}},
+        {"$unwind": "$items"},
+        {"$group": {"_id": "$items.v.product_id", "quantity": {"$sum": "$items.v.quantity"}}}
+    ]
+    for row in db.sessions.aggregate(pipeline):
+        reserved[row["_id"]] = row["quantity"]
+
+    operations = [
+        UpdateOne({"_id": ObjectId(product_id)}, {"$set": {"reserved_quantity": quantity}})
+        for product_id, quantity in reserved.items()
+    ]
+    if operations:
+        db.products.bulk_write(operations, ordered=False)
+    db.products.update_many(
+        {"_id": {"$nin": _object_ids(reserved)}, "reserved_quantity": {"$ne": 0}},
+        {"$set": {"reserved_quantity": 0}}
+    )
+    return len(reserved)
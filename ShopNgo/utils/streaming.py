@@ -0,0 +1,30 @@
+from flask import Response, current_app, stream_with_context
+import os
+
+# Export mode for admin list endpoints: documents are pulled from the Mongo
+# cursor one batch at a time and written out as newline-delimited JSON as
+# they arrive, so worker memory stays flat however large the result is.
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def wants_ndjson(request):
+    """True when the client asked for the streaming export with ?format=ndjson"""
+    return request.args.get("format", "").lower() == "ndjson"
+
+
+def ndjson_response(cursor, serialize, batch_size=None):
+    """Stream every document of cursor, passed through serialize, as one JSON line each"""
+    if batch_size is None:
+        batch_size = int(os.getenv("EXPORT_BATCH_SIZE", 500))
+    cursor.batch_size(batch_size)
+
+    def generate():
+        try:
+            for doc in cursor:
+                yield current_app.json.dumps(serialize(doc)) + "\n"
+        finally:
+            # Free the server-side cursor if the client disconnects mid-export
+            cursor.close()
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
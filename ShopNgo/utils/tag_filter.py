@@ -0,0 +1,228 @@
+from hashlib import blake2b
+from utils.uid_codec import try_encode_uid
+from utils.tag_registry import registry_version
+import threading
+import math
+import time
+import os
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over encoded RFID tags, sized for capacity at error_rate"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, tag):
+        # Double hashing: k positions from the two halves of one 128-bit digest
+        digest = blake2b(tag.to_bytes(8, "little"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, tag):
+        for position in self._positions(tag):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, tag):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(tag))
+
+    def expected_error_rate(self):
+        """False-positive rate predicted from the number of tags added so far"""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class TagFilter:
+    """In-memory filter of every registered RFID tag, consulted before MongoDB.
+
+    A tag the filter has never seen cannot belong to a product, so stray
+    reads (other stores' stickers, shelf tags, clothing) are rejected
+    without a database round trip. A "maybe" answer still goes to MongoDB,
+    so false positives only cost the query that would have happened anyway.
+
+    Tags registered through this process are inserted immediately. Removed
+    tags and tags registered by other processes are picked up when the filter
+    is rebuilt from the tag registry, every rebuild_interval seconds or as
+    soon as it fills past its capacity. The background thread also reads the
+    registry version every version_interval seconds; while it differs from
+    the version the filter holds, a tag the filter rules out goes to MongoDB
+    and a rebuild is triggered. Checks themselves never query MongoDB, so a
+    tag registered by another process can be turned away for at most
+    version_interval seconds. Until the first build finishes every tag passes.
+    """
+
+    def __init__(self, db, error_rate=0.001, headroom=1.5, rebuild_interval=300, version_interval=2.0):
+        self.db = db
+        self.error_rate = error_rate
+        self.headroom = headroom
+        self.rebuild_interval = rebuild_interval
+        self.version_interval = version_interval
+        self._bloom = None
+        # Registry version the filter holds every tag of, and the last one read from MongoDB
+        self._version = None
+        self._registry_version = None
+        self._pending = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.checks = 0
+        self.rejected = 0
+        self.stale_checks = 0
+        self.false_positives = 0
+        self.rebuilds = 0
+        self.last_rebuild_seconds = None
+
+    def might_contain(self, rfid_tag):
+        """False only if rfid_tag is not registered to a product"""
+        return bool(self.candidates([rfid_tag]))
+
+    def candidates(self, rfid_tags):
+        """The tags that may be registered; the rest are certainly not"""
+        bloom, version = self._bloom, self._version
+        if bloom is None:
+            return list(rfid_tags)
+        self.checks += len(rfid_tags)
+        passed = [rfid_tag for rfid_tag in rfid_tags if rfid_tag in bloom]
+        if len(passed) == len(rfid_tags):
+            return passed
+        if self._registry_version != version:
+            # Tags were registered elsewhere since the build: the filter cannot rule anything out
+            self.stale_checks += 1
+            self._wakeup.set()
+            return list(rfid_tags)
+        self.rejected += len(rfid_tags) - len(passed)
+        return passed
+
+    def record_false_positive(self, count=1):
+        """A tag that passed the filter turned out to have no product"""
+        if self._bloom is not None:
+            self.false_positives += count
+
+    def add(self, rfid_tag):
+        """Register a tag (encoded or hex) as belonging to a product"""
+        code = try_encode_uid(rfid_tag)
+        if code is None:
+            return
+        with self._lock:
+            if self._pending is not None:
+                # Replayed onto the filter being built
+                self._pending.append(code)
+            if self._bloom is not None:
+                self._bloom.add(code)
+                if self._bloom.count > self._bloom.capacity:
+                    self._wakeup.set()
+
+    def register(self, rfid_tags):
+        """Add the tags of one register_tags() call made by this process.
+
+        That call bumped the registry version once; the filter follows it
+        locally, since it now holds those tags.
+        """
+        for rfid_tag in rfid_tags:
+            self.add(rfid_tag)
+        with self._lock:
+            if self._version is not None:
+                self._version += 1
+                self._registry_version += 1
+
+    def refresh_version(self):
+        """Read the registry version, so checks can tell a stale filter without MongoDB"""
+        version = registry_version(self.db)
+        with self._lock:
+            self._registry_version = version
+        return version
+
+    def rebuild(self):
+        """Build a fresh filter from the tag registry and swap it in"""
+        started = time.monotonic()
+        with self._lock:
+            self._pending = []
+        try:
+            # Read before the scan, so tags added during it show up as a newer version
+            version = registry_version(self.db)
+            count = self.db.tags.estimated_document_count()
+            bloom = BloomFilter(int(count * self.headroom) + 1000, self.error_rate)
+            for tag in self.db.tags.find({}, {"_id": 1}):
+                bloom.add(tag["_id"])
+            with self._lock:
+                for code in self._pending:
+                    bloom.add(code)
+                self._bloom = bloom
+                self._version = version
+                self._registry_version = version
+        finally:
+            with self._lock:
+                self._pending = None
+        self.rebuilds += 1
+        self.last_rebuild_seconds = round(time.monotonic() - started, 3)
+        return bloom.count
+
+    def _run(self):
+        next_rebuild = 0
+        while True:
+            try:
+                if self._wakeup.is_set() or time.monotonic() >= next_rebuild:
+                    self._wakeup.clear()
+                    self.rebuild()
+                    next_rebuild = time.monotonic() + self.rebuild_interval
+                else:
+                    self.refresh_version()
+            except Exception as e:
+                print(f"Tag filter rebuild error: {str(e)}")
+            self._wakeup.wait(self.version_interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="tag-filter", daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        """Size, memory and false-positive figures for tuning the filter"""
+        bloom = self._bloom
+        # Share of unregistered tags that still got through to MongoDB
+        absent = self.rejected + self.false_positives
+        stats = {
+            "ready": bloom is not None,
+            "checks": self.checks,
+            "rejected": self.rejected,
+            "stale_checks": self.stale_checks,
+            "stale": self._registry_version != self._version,
+            "false_positives": self.false_positives,
+            "observed_false_positive_rate": round(self.false_positives / absent, 6) if absent else 0.0,
+            "rebuilds": self.rebuilds,
+            "last_rebuild_seconds": self.last_rebuild_seconds,
+            "rebuild_interval_seconds": self.rebuild_interval,
+            "version_interval_seconds": self.version_interval
+        }
+        if bloom is not None:
+            stats.update({
+                "tags": bloom.count,
+                "capacity": bloom.capacity,
+                "hashes": bloom.hashes,
+                "bits": bloom.size,
+                "memory_bytes": len(bloom.bits),
+                "target_false_positive_rate": bloom.error_rate,
+                "expected_false_positive_rate": round(bloom.expected_error_rate(), 6)
+            })
+        return stats
+
+
+def init_tag_filter(db):
+    """Initialize the registered-tag filter and build it in the background; None if disabled"""
+    if os.getenv("TAG_FILTER_ENABLED", "true").lower() != "true":
+        return None
+    tag_filter = TagFilter(
+        db,
+        error_rate=float(os.getenv("TAG_FILTER_ERROR_RATE", 0.001)),
+        rebuild_interval=int(os.getenv("TAG_FILTER_REBUILD_SECONDS", 300)),
+        version_interval=float(os.getenv("TAG_FILTER_VERSION_SECONDS", 2.0))
+    )
+    tag_filter.start()
+    return tag_filter
@@ -0,0 +1,116 @@
+from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from utils.uid_codec import try_encode_uid, decode_uid
+
+# Two-level catalog: products holds one document per SKU (name, price,
+# stock), and tags maps each physical RFID tag to its SKU:
+#
+#   tags  {_id: <encoded UID>, product_id: ObjectId, registered_at}
+#
+# Keying tags by the encoded UID makes the _id index the tag -> SKU index,
+# so a scan resolves with one point lookup no matter how many units are on
+# the shelf, and the catalog no longer grows with every tagged unit.
+#
+# Every write that adds tags bumps the tag_registry counter afterwards, so a
+# copy of the registry built at version n (utils/tag_filter.py) can tell
+# whether tags have been added since.
+
+REGISTRY_COUNTER = "tag_registry"
+
+
+def registry_version(db):
+    """Number of registrations that have added tags so far"""
+    counter = db.counters.find_one({"_id": REGISTRY_COUNTER})
+    return counter["value"] if counter else 0
+
+
+def _bump_version(db):
+    db.counters.update_one({"_id": REGISTRY_COUNTER}, {"$inc": {"value": 1}}, upsert=True)
+
+
+def register_tags(db, product_id, rfid_tags, add_stock=False):
+    """Map rfid_tags to product_id in one bulk insert.
+
+    Returns (registered, duplicates, invalid): the encoded tags that were
+    added, the tags already registered (to any SKU) and the values that are
+    not UIDs. With add_stock every newly registered tag adds one unit to the
+    SKU's stock, for stores that tag each item.
+    """
+    invalid = []
+    codes = []
+    for rfid_tag in rfid_tags:
+        code = try_encode_uid(rfid_tag)
+        if code is None:
+            invalid.append(rfid_tag)
+        elif code not in codes:
+            codes.append(code)
+    if not codes:
+        return [], [], invalid
+
+    now = datetime.utcnow()
+    duplicates = set()
+    try:
+        db.tags.insert_many([{"_id": code, "product_id": product_id, "registered_at": now} for code in codes],
+                            ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            if error.get("code") != 11000:
+                raise
+            duplicates.add(error["op"]["_id"])
+    registered = [code for code in codes if code not in duplicates]
+    if registered:
+        _bump_version(db)
+
+    if add_stock and registered:
+        db.products.update_one({"_id": product_id}, {"$inc": {"stock_quantity": len(registered)}})
+    return registered, [code for code in codes if code in duplicates], invalid
+
+
+def unregister_tags(db, rfid_tags, product_id=None):
+    """Remove tags (of product_id only, if given) from the registry; returns how many were removed"""
+    codes = [code for code in (try_encode_uid(rfid_tag) for rfid_tag in rfid_tags) if code is not None]
+    if not codes:
+        return 0
+    query = {"_id": {"$in": codes}}
+    if product_id is not None:
+        query["product_id"] = product_id
+    return db.tags.delete_many(query).deleted_count
+
+
+def copy_product_tags(db, batch_size=500):
+    """Register the rfid_tag still carried by single-tag product documents.
+
+    A tag carried by several products, or already registered to another
+    one, is reported and left out rather than given to whichever comes first.
+    """
+    by_code = {}
+    for product in db.products.find({"rfid_tag": {"$exists": True}}, {"rfid_tag": 1}):
+        code = try_encode_uid(product["rfid_tag"])
+        if code is not None:
+            by_code.setdefault(code, []).append(product["_id"])
+
+    copied = 0
+    now = datetime.utcnow()
+    codes = list(by_code)
+    for i in range(0, len(codes), batch_size):
+        batch = codes[i:i + batch_size]
+        registered = {tag["_id"]: tag["product_id"] for tag in db.tags.find({"_id": {"$in": batch}})}
+        operations = []
+        for code in batch:
+            product_ids = by_code[code]
+            if len(product_ids) > 1:
+                print(f"Warning: RFID tag {decode_uid(code)} is carried by products "
+                      f"{', '.join(map(str, product_ids))}; not registered")
+            elif code in registered and registered[code] != product_ids[0]:
+                print(f"Warning: RFID tag {decode_uid(code)} of product {product_ids[0]} is already "
+                      f"registered to product {registered[code]}")
+            elif code not in registered:
+                operations.append(UpdateOne({"_id": code},
+                                            {"$setOnInsert": {"product_id": product_ids[0], "registered_at": now}},
+                                            upsert=True))
+        if operations:
+            copied += db.tags.bulk_write(operations, ordered=False).upserted_count
+    if copied:
+        _bump_version(db)
+    return copied
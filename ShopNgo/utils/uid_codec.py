@@ -0,0 +1,159 @@
+from pymongo import UpdateOne
+import re
+
+# RFID UIDs (4 or 7 bytes for the MIFARE tags in use) are stored as 64-bit
+# integers, as the _id of the tag registry (see utils/tag_registry.py) and
+# in session and order items, instead of 14-character hex strings. The low
+# 56 bits hold the UID and the top byte its length in bytes, so UIDs with
+# leading zero bytes survive the round trip and every stored value is a
+# positive int64.
+#
+# Clients keep sending and receiving the hex strings printed on the tags:
+# encode_uid() is applied where a tag enters the API and decode_uid() where
+# one leaves it.
+
+MAX_UID_BYTES = 7
+LENGTH_SHIFT = 56
+UID_MASK = (1 << LENGTH_SHIFT) - 1
+
+_SEPARATORS = re.compile(r"[\s:\-]")
+_HEX = re.compile(r"[0-9A-F]+")
+
+
+def normalize_uid(value):
+    """Canonical upper-case hex form of a UID; raises ValueError if it is not one.
+
+    Accepts any case, an optional 0x prefix and ':', '-' or space separators,
+    e.g. "53:ff:c7:52:11:00:01" -> "53FFC752110001".
+    """
+    if not isinstance(value, str):
+        raise ValueError("RFID tag must be a string")
+    uid = _SEPARATORS.sub("", value).upper()
+    if uid.startswith("0X"):
+        uid = uid[2:]
+    # int(uid, 16) alone would also take "+1" and "1_23"
+    if not _HEX.fullmatch(uid) or len(uid) % 2 or len(uid) > MAX_UID_BYTES * 2:
+        raise ValueError(f"Invalid RFID tag: {value}")
+    return uid
+
+
+def encode_uid(value):
+    """Stored integer form of a UID given as hex text, raw bytes or an already encoded int"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        length = value >> LENGTH_SHIFT
+        # The UID must fit in the number of bytes the top byte declares
+        if length not in range(1, MAX_UID_BYTES + 1) or (value & UID_MASK) >> (8 * length):
+            raise ValueError(f"Invalid encoded RFID tag: {value}")
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        # Read in place; reader frames pass slices of the request body
+        if not len(value) or len(value) > MAX_UID_BYTES:
+            raise ValueError("Invalid RFID tag length")
+        return (len(value) << LENGTH_SHIFT) | int.from_bytes(value, "big")
+    uid = normalize_uid(value)
+    return (len(uid) // 2 << LENGTH_SHIFT) | int(uid, 16)
+
+
+def try_encode_uid(value):
+    """encode_uid() that returns None for anything that is not a valid UID"""
+    try:
+        return encode_uid(value)
+    except ValueError:
+        return None
+
+
+def decode_uid(value):
+    """Hex string form of a stored UID; strings (not yet migrated) are passed through"""
+    if not isinstance(value, int) or isinstance(value, bool):
+        return value
+    length = value >> LENGTH_SHIFT
+    return f"{value & UID_MASK:0{length * 2}X}"
+
+
+def decode_item(item):
+    """Copy of a session or order item with its tags in hex form, for API responses"""
+    decoded = dict(item, rfid_tag=decode_uid(item.get("rfid_tag")))
+    if "rfid_tags" in item:
+        decoded["rfid_tags"] = [decode_uid(rfid_tag) for rfid_tag in item["rfid_tags"]]
+    return decoded
+
+
+def decode_items(items):
+    """Copies of session or order items with their tags in hex form, for API responses"""
+    return [decode_item(item) for item in items]
+
+
+def _encode_tags(rfid_tags):
+    """Encode the string tags in a list, leaving invalid ones as they are and dropping repeats"""
+    encoded = []
+    for rfid_tag in rfid_tags:
+        code = try_encode_uid(rfid_tag) if isinstance(rfid_tag, str) else rfid_tag
+        code = rfid_tag if code is None else code
+        if code not in encoded:
+            encoded.append(code)
+    return encoded
+
+
+def migrate_uids(db, batch_size=500):
+    """Convert string tags on products and active session items to the integer form.
+
+    Tags that are not valid UIDs, or that several products spell differently
+    (e.g. "53:ff:..." and "53FF..."), are left as they are and reported, so
+    no product silently takes over another's tag. Orders keep the strings
+    they were written with; decode_uid() passes them through unchanged.
+    """
+    converted = 0
+    operations = []
+
+    def flush(collection):
+        nonlocal converted, operations
+        if operations:
+            converted += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+
+    # Group products by encoded tag first, so collisions are found before anything is written
+    by_code = {}
+    for product in db.products.find({"rfid_tag": {"$type": "string"}}, {"rfid_tag": 1}):
+        code = try_encode_uid(product["rfid_tag"])
+        if code is None:
+            print(f"Warning: product {product['_id']} has an invalid RFID tag: {product['rfid_tag']!r}")
+            continue
+        by_code.setdefault(code, []).append(product)
+    codes = list(by_code)
+    for i in range(0, len(codes), batch_size):
+        # Products converted by an earlier run count too
+        for product in db.products.find({"rfid_tag": {"$in": codes[i:i + batch_size]}}, {"rfid_tag": 1}):
+            by_code[product["rfid_tag"]].append(product)
+
+    for code, products in by_code.items():
+        if len(products) > 1:
+            print(f"Warning: RFID tag {decode_uid(code)} is shared by products "
+                  f"{', '.join(str(product['_id']) for product in products)}; left unconverted")
+            continue
+        product = products[0]
+        operations.append(UpdateOne({"_id": product["_id"], "rfid_tag": product["rfid_tag"]},
+                                    {"$set": {"rfid_tag": code}}))
+        if len(operations) >= batch_size:
+            flush(db.products)
+    flush(db.products)
+
+    for session in db.sessions.find({"is_active": True}, {"items": 1}):
+        items = session.get("items")
+        if not isinstance(items, dict):
+            continue
+        changes = {}
+        for product_id, item in items.items():
+            if isinstance(item.get("rfid_tag"), str):
+                code = try_encode_uid(item["rfid_tag"])
+                if code is not None:
+                    changes[f"items.{product_id}.rfid_tag"] = code
+            # Scanned tags must match the integer form new scans are compared with
+            rfid_tags = item.get("rfid_tags") or []
+            if any(isinstance(rfid_tag, str) for rfid_tag in rfid_tags):
+                changes[f"items.{product_id}.rfid_tags"] = _encode_tags(rfid_tags)
+        if changes:
+            operations.append(UpdateOne({"_id": session["_id"]}, {"$set": changes}))
+        if len(operations) >= batch_size:
+            flush(db.sessions)
+    flush(db.sessions)
+    return converted